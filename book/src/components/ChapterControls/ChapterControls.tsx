@@ -78,6 +78,8 @@ export default function ChapterControls({
         body: JSON.stringify({
           content: originalContent,
           target_language: 'ur',
+          chapter_path: chapterPath,
+          chapter_path: chapterPath,
         }),
       });
 
@@ -1,22 +1,66 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Dict, Any, AsyncIterator, Optional
+from datetime import datetime
+import codecs
+import json
 import logging
+import tempfile
+import time
 
 from app.models.schemas import (
     ChatMessage, 
     ChatResponse,
     DocumentIndexRequest,
-    DocumentIndexResponse
+    DocumentIndexResponse,
+    IndexJobResponse
 )
-from app.models.database import get_db, ChatHistory, DocumentChunk
+from app.models.database import get_db, SessionLocal, ChatHistory, IndexJob
 from app.services.rag_agent import rag_agent
-from app.services.document_processor import doc_processor
-from app.services.vector_store import get_vector_store
+from app.services.indexer import document_indexer, IndexResult
+from app.services.index_jobs import index_job_queue, FINISHED_STATUSES
+from app.services.semantic_cache import semantic_cache
+from app.services.embedding_cache import query_embedding_cache, document_embedding_store
+from app.services.translation import translation_service
+from app.services.cache_lifecycle import content_cache_lifecycle
+from app.services.llm_gateway import llm_gateway
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+INDEX_SPOOL_MAX_MEMORY = 8 * 1024 * 1024  # Bulk index bodies larger than this spill to disk
+INDEX_STREAM_GROUP_SIZE = 16  # Documents chunked together (in parallel) by /index/stream
+
+
+def _load_chat_history(db: Session, session_id: str) -> List[Dict[str, str]]:
+    """Load the last few exchanges of a session, oldest first"""
+    recent_chats = db.query(ChatHistory)\
+        .filter(ChatHistory.session_id == session_id)\
+        .order_by(ChatHistory.created_at.desc())\
+        .limit(5)\
+        .all()
+    
+    return [
+        {
+            "user": chat.user_message,
+            "assistant": chat.bot_response
+        }
+        for chat in reversed(recent_chats)
+    ]
+
+
+def _context_for_storage(context_used: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compact retrieved context for the ChatHistory.context_used column"""
+    return [
+        {
+            "text": ctx["text"][:500],  # Truncate for storage
+            "score": ctx["score"],
+            "source": ctx["metadata"].get("source")
+        }
+        for ctx in context_used
+    ]
+
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
@@ -29,22 +73,10 @@ async def chat(
     """
     try:
         # Get recent chat history for context
-        recent_chats = db.query(ChatHistory)\
-            .filter(ChatHistory.session_id == message.session_id)\
-            .order_by(ChatHistory.created_at.desc())\
-            .limit(5)\
-            .all()
-        
-        chat_history = [
-            {
-                "user": chat.user_message,
-                "assistant": chat.bot_response
-            }
-            for chat in reversed(recent_chats)
-        ]
+        chat_history = _load_chat_history(db, message.session_id)
         
         # Generate response using RAG
-        response_text, context_used = rag_agent.chat(
+        response_text, context_used = await rag_agent.achat(
             user_message=message.message,
             selected_text=message.selected_text,
             chat_history=chat_history
@@ -55,14 +87,7 @@ async def chat(
             session_id=message.session_id,
             user_message=message.message,
             bot_response=response_text,
-            context_used=[
-                {
-                    "text": ctx["text"][:500],  # Truncate for storage
-                    "score": ctx["score"],
-                    "source": ctx["metadata"].get("source")
-                }
-                for ctx in context_used
-            ],
+            context_used=_context_for_storage(context_used),
             selected_text=message.selected_text
         )
         db.add(chat_record)
@@ -81,6 +106,81 @@ async def chat(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/chat/stream")
+async def chat_stream(
+    message: ChatMessage,
+    db: Session = Depends(get_db)
+):
+    """
+    Streaming variant of /chat (NDJSON, one event per line).
+    Emits the retrieved context first, then response tokens as the
+    provider produces them, then a final "done" event.
+    """
+    try:
+        chat_history = _load_chat_history(db, message.session_id)
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream() -> AsyncIterator[str]:
+        tokens, context_used = await rag_agent.achat_stream(
+            user_message=message.message,
+            selected_text=message.selected_text,
+            chat_history=chat_history
+        )
+        yield json.dumps({"type": "context", "context_used": context_used}) + "\n"
+        
+        parts = []
+        async for token in tokens:
+            parts.append(token)
+            yield json.dumps({"type": "token", "content": token}) + "\n"
+        
+        # Persist once the full answer is known. The request-scoped session
+        # may already be closed by the time the stream finishes.
+        stream_db = SessionLocal()
+        try:
+            stream_db.add(ChatHistory(
+                session_id=message.session_id,
+                user_message=message.message,
+                bot_response="".join(parts),
+                context_used=_context_for_storage(context_used),
+                selected_text=message.selected_text
+            ))
+            stream_db.commit()
+        except Exception as e:
+            logger.error(f"Error saving streamed chat: {str(e)}")
+        finally:
+            stream_db.close()
+        
+        logger.info(f"Chat stream processed for session: {message.session_id}")
+        yield json.dumps({"type": "done", "session_id": message.session_id}) + "\n"
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+def _index_response(result: IndexResult, elapsed: float) -> DocumentIndexResponse:
+    """Summarise an IndexResult for the index endpoints"""
+    chunks_per_second = result.chunks_total / elapsed if elapsed > 0 else None
+    logger.info(f"Indexed {result.chunks_total} chunks from {result.source} in {elapsed:.2f}s")
+    
+    if result.unchanged:
+        message = f"Source unchanged, {result.chunks_total} chunks already indexed"
+    else:
+        message = (
+            f"Successfully indexed {result.chunks_total} chunks "
+            f"({result.chunks_embedded} embedded, {result.chunks_deleted} removed)"
+        )
+    
+    return DocumentIndexResponse(
+        message=message,
+        chunks_indexed=result.chunks_total,
+        chunk_ids=result.chunk_ids,
+        chunks_per_second=chunks_per_second,
+        chunks_embedded=result.chunks_embedded,
+        chunks_deleted=result.chunks_deleted
+    )
+
+
 @router.post("/index", response_model=DocumentIndexResponse)
 async def index_document(
     request: DocumentIndexRequest,
@@ -91,41 +191,236 @@ async def index_document(
     Use this to index book chapters/pages.
     """
     try:
-        # Process document into chunks
-        chunks, metadatas = doc_processor.process_document(
+        started = time.perf_counter()
+        
+        # Only new or changed chunks are embedded; removed ones are deleted
+        result = await document_indexer.index_document(
+            db=db,
             content=request.content,
             source=request.source,
             metadata=request.metadata
         )
         
-        # Add to vector store
-        chunk_ids = get_vector_store().add_documents(chunks, metadatas)
-        
-        # Save metadata to database
-        for chunk_id, chunk_text, metadata in zip(chunk_ids, chunks, metadatas):
-            doc_chunk = DocumentChunk(
-                chunk_id=chunk_id,
-                source=request.source,
-                content=chunk_text,
-                doc_metadata=metadata
-            )
-            db.add(doc_chunk)
+        return _index_response(result, time.perf_counter() - started)
+    
+    except Exception as e:
+        logger.error(f"Error in index endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/index/upload", response_model=DocumentIndexResponse)
+async def upload_document(
+    request: Request,
+    source: str,
+    metadata: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Index one (arbitrarily large) UTF-8 document sent as the raw request body.
+    The body is chunked, embedded and committed in batches as it arrives, so
+    the document is never held in memory. `metadata` is an optional JSON object.
+    """
+    try:
+        doc_metadata = json.loads(metadata) if metadata else None
+    except ValueError:
+        doc_metadata = None
+    if metadata and not isinstance(doc_metadata, dict):
+        raise HTTPException(status_code=400, detail="metadata must be a JSON object")
+    
+    async def pieces() -> AsyncIterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async for data in request.stream():
+            text = decoder.decode(data)
+            if text:
+                yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+    
+    try:
+        started = time.perf_counter()
+        result = await document_indexer.index_stream(db, source, pieces(), doc_metadata)
+        return _index_response(result, time.perf_counter() - started)
+    
+    except Exception as e:
+        logger.error(f"Error in index upload endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/index/stream")
+async def index_stream(request: Request):
+    """
+    Bulk indexing: the body is NDJSON, one DocumentIndexRequest per line.
+    Responds with NDJSON, one "result" event per document as it finishes
+    (status "indexed", "unchanged" or "error") and a final "summary" event.
+    
+    The body is spooled to a temporary file first (in memory up to
+    INDEX_SPOOL_MAX_MEMORY bytes): the streaming response listens for client
+    disconnects on the same channel, so the body can't be read once it starts.
+    Documents are then read back and indexed INDEX_STREAM_GROUP_SIZE lines
+    at a time, chunking each group in parallel.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=INDEX_SPOOL_MAX_MEMORY)
+    try:
+        async for data in request.stream():
+            spool.write(data)
+        spool.seek(0)
+    except Exception as e:
+        spool.close()
+        logger.error(f"Error receiving index stream: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def result_stream() -> AsyncIterator[str]:
+        started = time.perf_counter()
+        totals = {"documents": 0, "failed": 0, "chunks_indexed": 0, "chunks_embedded": 0, "chunks_deleted": 0}
+        db = SessionLocal()
         
-        db.commit()
+        async def index_group(group: List[tuple]) -> AsyncIterator[str]:
+            # Documents in a group are chunked in parallel, then indexed in line order
+            documents = [
+                (doc.content, doc.source, doc.metadata)
+                for _, doc in group if isinstance(doc, DocumentIndexRequest)
+            ]
+            results = document_indexer.index_documents(db, documents)
+            for line_number, doc in group:
+                if isinstance(doc, DocumentIndexRequest):
+                    source, result = await results.__anext__()
+                else:
+                    source, result = None, doc
+                
+                if isinstance(result, Exception):
+                    totals["failed"] += 1
+                    event = {"type": "result", "line": line_number, "source": source, "status": "error", "detail": str(result)}
+                else:
+                    event = {
+                        "type": "result",
+                        "line": line_number,
+                        "source": source,
+                        "status": "unchanged" if result.unchanged else "indexed",
+                        "chunks_indexed": result.chunks_total,
+                        "chunks_embedded": result.chunks_embedded,
+                        "chunks_deleted": result.chunks_deleted
+                    }
+                    totals["chunks_indexed"] += result.chunks_total
+                    totals["chunks_embedded"] += result.chunks_embedded
+                    totals["chunks_deleted"] += result.chunks_deleted
+                yield json.dumps(event) + "\n"
         
-        logger.info(f"Indexed {len(chunks)} chunks from {request.source}")
+        try:
+            group = []
+            for line_number, line in enumerate(spool, start=1):
+                if not line.strip():
+                    continue
+                totals["documents"] += 1
+                try:
+                    group.append((line_number, DocumentIndexRequest.model_validate_json(line)))
+                except ValueError as e:
+                    logger.error(f"Invalid document on line {line_number}: {str(e)}")
+                    group.append((line_number, e))
+                if len(group) >= INDEX_STREAM_GROUP_SIZE:
+                    async for event in index_group(group):
+                        yield event
+                    group = []
+            async for event in index_group(group):
+                yield event
+        finally:
+            db.close()
+            spool.close()
         
-        return DocumentIndexResponse(
-            message=f"Successfully indexed {len(chunks)} chunks",
-            chunks_indexed=len(chunks),
-            chunk_ids=chunk_ids
+        totals["seconds"] = round(time.perf_counter() - started, 3)
+        yield json.dumps({"type": "summary", **totals}) + "\n"
+    
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
+def _job_response(job: IndexJob) -> IndexJobResponse:
+    """Serialise an IndexJob, deriving its indexing rate"""
+    chunks_per_second = None
+    if job.started_at and job.chunks_done:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+        if elapsed > 0:
+            chunks_per_second = job.chunks_done / elapsed
+    
+    return IndexJobResponse(
+        job_id=job.id,
+        source=job.source,
+        status=job.status,
+        cancel_requested=job.cancel_requested,
+        chunks_total=job.chunks_total,
+        chunks_done=job.chunks_done,
+        chunks_embedded=job.chunks_embedded,
+        chunks_deleted=job.chunks_deleted,
+        chunks_per_second=chunks_per_second,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+
+def _get_job_or_404(db: Session, job_id: str) -> IndexJob:
+    job = db.get(IndexJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Indexing job not found")
+    return job
+
+
+@router.post("/index/jobs", response_model=IndexJobResponse, status_code=202)
+async def submit_index_job(
+    request: DocumentIndexRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Queue a document for background indexing and return the job immediately.
+    Poll GET /index/jobs/{job_id} for progress.
+    """
+    try:
+        job = index_job_queue.submit(
+            db=db,
+            content=request.content,
+            source=request.source,
+            metadata=request.metadata
         )
+        logger.info(f"Queued indexing job {job.id} for {request.source}")
+        return _job_response(job)
     
     except Exception as e:
-        logger.error(f"Error in index endpoint: {str(e)}")
+        logger.error(f"Error submitting index job: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/index/jobs", response_model=List[IndexJobResponse])
+async def list_index_jobs(
+    status: Optional[str] = None,
+    limit: int = 20,
+    db: Session = Depends(get_db)
+):
+    """Most recent indexing jobs, optionally filtered by status"""
+    query = db.query(IndexJob)
+    if status:
+        query = query.filter(IndexJob.status == status)
+    jobs = query.order_by(IndexJob.created_at.desc()).limit(limit).all()
+    return [_job_response(job) for job in jobs]
+
+
+@router.get("/index/jobs/{job_id}", response_model=IndexJobResponse)
+async def get_index_job(job_id: str, db: Session = Depends(get_db)):
+    """Progress of an indexing job"""
+    return _job_response(_get_job_or_404(db, job_id))
+
+
+@router.post("/index/jobs/{job_id}/cancel", response_model=IndexJobResponse)
+async def cancel_index_job(job_id: str, db: Session = Depends(get_db)):
+    """
+    Cancel an indexing job. Queued jobs stop immediately; running jobs stop
+    after the batch in progress (chunks already committed stay indexed).
+    """
+    job = _get_job_or_404(db, job_id)
+    if job.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return _job_response(index_job_queue.cancel(db, job))
+
+
 @router.get("/history/{session_id}")
 async def get_chat_history(
     session_id: str,
@@ -156,3 +451,18 @@ async def get_chat_history(
     except Exception as e:
         logger.error(f"Error getting chat history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters and sizes of the in-process caches, and LLM gateway counters"""
+    return {
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "document_embedding_store": document_embedding_store.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "chat_coalescing": rag_agent.chat_flights.stats(),
+        "translation_cache": translation_service.memory_cache.stats(),
+        "translation_coalescing": translation_service.flights.stats(),
+        "content_caches": content_cache_lifecycle.stats(),
+        "llm_gateway": llm_gateway.stats()
+    }
@@ -2,13 +2,16 @@
 Content personalization and translation API endpoints
 """
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.models.database import get_db
+from typing import AsyncIterator
+from app.models.database import get_db, SessionLocal
 from app.models.auth import User
 from app.models.auth_schemas import PersonalizeRequest, PersonalizeResponse, TranslateRequest, TranslateResponse
 from app.services.auth import get_current_user, get_current_user_optional
 from app.services.personalization import personalization_service
 from app.services.translation import translation_service
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,7 +30,7 @@ async def personalize_content(
     Requires authentication.
     """
     try:
-        result = personalization_service.personalize_content(
+        result = await personalization_service.apersonalize_content(
             content=request.content,
             user=current_user,
             chapter_path=request.chapter_path,
@@ -40,6 +43,34 @@ async def personalize_content(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/personalize/stream")
+async def personalize_content_stream(
+    request: PersonalizeRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Streaming variant of /personalize (NDJSON, one event per line).
+    Emits content tokens as the provider produces them, or the cached
+    version as a single token, then a final "done" event. Output cut off
+    part way is followed by an "error" event and "truncated": true on "done".
+    """
+    async def event_stream() -> AsyncIterator[str]:
+        # The request-scoped session may be closed before the stream ends
+        stream_db = SessionLocal()
+        try:
+            async for event in personalization_service.apersonalize_stream(
+                content=request.content,
+                user=current_user,
+                chapter_path=request.chapter_path,
+                db=stream_db
+            ):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            stream_db.close()
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
 @router.post("/translate", response_model=TranslateResponse)
 async def translate_content(
     request: TranslateRequest,
@@ -51,10 +82,11 @@ async def translate_content(
     Works for both authenticated and non-authenticated users.
     """
     try:
-        result = translation_service.translate(
+        result = await translation_service.atranslate(
             content=request.content,
             target_language=request.target_language,
             source_language=request.source_language,
+            chapter_path=request.chapter_path,
             db=db
         )
         
@@ -62,3 +94,32 @@ async def translate_content(
     except Exception as e:
         logger.error(f"Translation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/translate/stream")
+async def translate_content_stream(
+    request: TranslateRequest,
+    current_user: User = Depends(get_current_user_optional)
+):
+    """
+    Streaming variant of /translate (NDJSON, one event per line).
+    Emits the translation in document order as it is produced (cached
+    sections at once), then a final "done" event with section counters.
+    A section cut off part way is followed by an "error" event, and "done"
+    then carries "truncated": true.
+    """
+    async def event_stream() -> AsyncIterator[str]:
+        stream_db = SessionLocal()
+        try:
+            async for event in translation_service.atranslate_stream(
+                content=request.content,
+                target_language=request.target_language,
+                source_language=request.source_language,
+                chapter_path=request.chapter_path,
+                db=stream_db
+            ):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            stream_db.close()
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
@@ -16,15 +16,106 @@ class Settings(BaseSettings):
     gemini_api_key: str = ""  # Get free key from https://aistudio.google.com/apikey
     gemini_model: str = "gemini-1.5-flash-latest"  # Free tier model
     
-    # Embeddings
+    # Embeddings: "openai" or "local" (deterministic hashing embedder, no network)
+    embedding_provider: str = "openai"
     embedding_model: str = "text-embedding-3-small"
+    embedding_dimensions: int = 1536  # text-embedding-3-small dimension
+    embedding_batch_size: int = 64  # Texts per embeddings API call during ingestion
+    embedding_concurrency: int = 4  # Embedding batches in flight at once
+    upsert_batch_size: int = 128  # Points per vector index upsert
+    index_commit_batch_size: int = 256  # Chunks embedded and committed per step when indexing
+    index_job_workers: int = 2  # Background indexing jobs processed at once
+    chunking_workers: int = 0  # Processes for CPU-bound chunking (0 = one per CPU, 1 = in-process)
+    
+    # Chunking: "tokens" (overlapping windows of up to 1000 tokens, cut between paragraphs) or
+    # "markdown" (split on headings, code blocks kept whole, heading_path metadata)
+    chunking_mode: str = "tokens"
+    markdown_chunk_tokens: int = 400  # Token budget sections are packed into
     demo_mode: bool = False  # Set to True to use mock responses without AI
     
+    # Query embedding cache (in-memory LRU, optional SQLite file to survive restarts)
+    embedding_cache_max_entries: int = 10000
+    embedding_cache_path: Optional[str] = None  # e.g. "./embedding_cache.sqlite3"
+    
+    # Chunk embeddings keyed by (model, dimensions, text), reused across sources,
+    # runs and vector index rebuilds (None to disable)
+    document_embedding_store_path: Optional[str] = "./document_embeddings.sqlite3"
+    
+    # Semantic answer cache (skipped for selected text / follow-up questions)
+    semantic_cache_enabled: bool = True
+    semantic_cache_threshold: float = 0.95  # Min cosine similarity for a hit
+    semantic_cache_max_entries: int = 1000  # 0 disables storing answers
+    semantic_cache_ttl_seconds: int = 3600
+    
+    # Retrieval: "hybrid" (BM25 + vector, fused with RRF), "vector" or "lexical"
+    retrieval_mode: str = "hybrid"
+    rrf_k: int = 60
+    vector_search_timeout_seconds: float = 2.0  # Fall back to lexical-only when exceeded
+    vector_retry_after_seconds: float = 30.0
+    
+    # Prompt context packing (tokens, cl100k_base)
+    context_token_budget: int = 2500
+    context_min_relative_score: float = 0.5  # Drop hits scoring below this fraction of the best hit
+    history_token_budget: int = 1000
+    
+    # Share one in-flight answer between identical concurrent questions
+    chat_coalescing_enabled: bool = True
+    
+    # Translation: chapters are split at markdown sections, translated
+    # concurrently and cached per section
+    translation_section_tokens: int = 1000  # Longer sections are split between paragraphs
+    translation_concurrency: int = 4
+    translation_max_tokens: int = 4000  # Output cap per section
+    translation_cache_max_entries: int = 512  # In-process LRU of hot documents and sections
+    translation_memory_enabled: bool = True  # Reuse translated sentences across sections
+    translation_memory_fuzzy_threshold: float = 1.0  # Below 1.0, near matches are reused as is (may flip meaning)
+    
+    # Personalization is shared between users with the same profile
+    # fingerprint. "full" uses every prompt field but free-text learning goals
+    # (users with goals get their own rows); "tiers" prompts with only the
+    # complexity and experience levels, so all users share a few variants
+    personalization_profile_mode: str = "full"  # full, tiers
+    
+    # Translation / personalization cache lifecycle: a background task flushes
+    # hit counters, then drops rows unused for longer than the age budget,
+    # rows for versions of a chapter older than the one clients now send, and
+    # per table the least recently (lru) or least frequently (lfu) used rows
+    # over budget
+    content_cache_eviction_interval_seconds: int = 3600  # 0 disables the task
+    content_cache_eviction_policy: str = "lru"  # lru, lfu
+    content_cache_max_age_days: int = 90
+    translation_cache_max_rows: int = 50000
+    personalized_content_max_rows: int = 20000
+    shared_personalized_content_max_rows: int = 20000
+    content_cache_stale_grace_hours: int = 24  # Stale rows used more recently are kept
+    
+    # LLM gateway: one pooled client per provider for chat, translation and
+    # personalization. Calls wait for the provider's request and token budgets
+    # in priority order (chat, translation, personalization) instead of
+    # failing, and 429s, 5xx and timeouts are retried with jittered backoff
+    llm_timeout_seconds: float = 60.0
+    llm_connect_timeout_seconds: float = 5.0
+    llm_max_connections: int = 20  # Pooled keep-alive connections per client
+    llm_max_retries: int = 3
+    llm_retry_base_seconds: float = 0.5
+    llm_retry_max_seconds: float = 20.0
+    llm_queue_timeout_seconds: float = 120.0  # Give up on calls still waiting for budget
+    openai_requests_per_minute: int = 500  # 0 = unlimited
+    openai_tokens_per_minute: int = 200000
+    gemini_requests_per_minute: int = 15  # Free tier
+    gemini_tokens_per_minute: int = 1000000
+    
     # Qdrant - Made optional for demo mode
     qdrant_url: Optional[str] = "http://localhost:6333"
     qdrant_api_key: Optional[str] = "demo_key"
     qdrant_collection_name: str = "book_embeddings"
     
+    # Vector backend: "qdrant" (remote, qdrant_url above), "numpy" (in-process,
+    # exact search, persisted as memory-mapped <vector_index_path>.npy + .json)
+    # or "memory" (in-process, not persisted)
+    vector_backend: str = "qdrant"
+    vector_index_path: Optional[str] = "./vector_index"
+    
     # Database - Made optional with default SQLite
     database_url: str = "sqlite:///./book_chat.db"
     
@@ -61,10 +152,62 @@ except Exception as e:
         gemini_model = "gemini-1.5-flash-latest"
         openai_api_key = "not-used"
         openai_model = "gpt-4o-mini"
+        embedding_provider = "openai"
         embedding_model = "text-embedding-3-small"
+        embedding_dimensions = 1536
+        embedding_batch_size = 64
+        embedding_concurrency = 4
+        upsert_batch_size = 128
+        index_commit_batch_size = 256
+        index_job_workers = 2
+        chunking_workers = 0
+        chunking_mode = "tokens"
+        markdown_chunk_tokens = 400
+        embedding_cache_max_entries = 10000
+        embedding_cache_path = None
+        document_embedding_store_path = "./document_embeddings.sqlite3"
+        semantic_cache_enabled = True
+        semantic_cache_threshold = 0.95
+        semantic_cache_max_entries = 1000
+        semantic_cache_ttl_seconds = 3600
+        retrieval_mode = "hybrid"
+        rrf_k = 60
+        vector_search_timeout_seconds = 2.0
+        vector_retry_after_seconds = 30.0
+        context_token_budget = 2500
+        context_min_relative_score = 0.5
+        history_token_budget = 1000
+        chat_coalescing_enabled = True
+        translation_section_tokens = 1000
+        translation_concurrency = 4
+        translation_max_tokens = 4000
+        translation_cache_max_entries = 512
+        translation_memory_enabled = True
+        translation_memory_fuzzy_threshold = 1.0
+        personalization_profile_mode = "full"
+        content_cache_eviction_interval_seconds = 3600
+        content_cache_eviction_policy = "lru"
+        content_cache_max_age_days = 90
+        translation_cache_max_rows = 50000
+        personalized_content_max_rows = 20000
+        shared_personalized_content_max_rows = 20000
+        content_cache_stale_grace_hours = 24
+        llm_timeout_seconds = 60.0
+        llm_connect_timeout_seconds = 5.0
+        llm_max_connections = 20
+        llm_max_retries = 3
+        llm_retry_base_seconds = 0.5
+        llm_retry_max_seconds = 20.0
+        llm_queue_timeout_seconds = 120.0
+        openai_requests_per_minute = 500
+        openai_tokens_per_minute = 200000
+        gemini_requests_per_minute = 15
+        gemini_tokens_per_minute = 1000000
         qdrant_url = "http://localhost:6333"
         qdrant_api_key = "demo_key"
         qdrant_collection_name = "book_embeddings"
+        vector_backend = "qdrant"
+        vector_index_path = "./vector_index"
         database_url = "sqlite:///./book_chat.db"
         jwt_secret_key = "demo-secret-key-1234567890"
         environment = "development"
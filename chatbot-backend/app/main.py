@@ -8,6 +8,12 @@ import logging
 from app.api import chat, auth, content
 from app.models.database import init_db
 from app.models.schemas import HealthResponse
+from app.services.cache_lifecycle import content_cache_lifecycle
+from app.services.document_processor import shutdown_chunking_pool
+from app.services.index_jobs import index_job_queue
+from app.services.llm_gateway import llm_gateway
+from app.services.lexical_index import get_lexical_index
+from app.services.vector_store import get_vector_store, aflush_vector_store
 
 logging.basicConfig(
     level=logging.INFO,
@@ -50,8 +56,26 @@ async def startup_event():
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.warning(f"Skipping DB init (optional): {str(e)}")
+    get_lexical_index()  # Build the BM25 index before the first chat
+    try:
+        get_vector_store()  # Connect now so the first user doesn't pay for it
+    except Exception as e:
+        logger.warning(f"Vector store not available at startup: {str(e)}")
+    try:
+        await index_job_queue.start()  # Also resumes jobs interrupted by a restart
+    except Exception as e:
+        logger.warning(f"Indexing job workers not started: {str(e)}")
+    await content_cache_lifecycle.start()  # Periodic translation / personalization cache eviction
     logger.info("RAG Chatbot API started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await index_job_queue.stop()
+    await aflush_vector_store()
+    await content_cache_lifecycle.stop()
+    await llm_gateway.aclose()
+    shutdown_chunking_pool()
+
 @app.get("/", response_model=HealthResponse)
 async def root():
     return {
@@ -1,7 +1,7 @@
 """
 User authentication and profile models
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Index, JSON, Enum as SQLEnum
 from datetime import datetime
 from app.models.database import Base
 import enum
@@ -48,12 +48,47 @@ class User(Base):
 class TranslationCache(Base):
     """Cache translations to avoid re-translating"""
     __tablename__ = "translation_cache"
+    __table_args__ = (
+        # One row per translation; also serves the three-column lookup
+        Index("uq_translation_cache_key", "source_content_hash", "source_language", "target_language", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     source_content_hash = Column(String(64), index=True, nullable=False)  # MD5 hash
     source_language = Column(String(10), default="en")
     target_language = Column(String(10), nullable=False)
     translated_content = Column(Text, nullable=False)
+    chapter_path = Column(String(255), nullable=True)  # Chapter that last stored it, if any
+    created_at = Column(DateTime, default=datetime.utcnow)
+    hit_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_hit_at = Column(DateTime, nullable=True)  # Flushed periodically, see cache_lifecycle
+
+
+class ChapterVersion(Base):
+    """The content clients currently send for a chapter, so cached rows for older versions can be purged"""
+    __tablename__ = "chapter_versions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    chapter_path = Column(String(255), unique=True, index=True, nullable=False)
+    content_hash = Column(String(64), nullable=False)  # MD5 of the content, as in original_content_hash
+    section_hashes = Column(JSON, nullable=False)  # MD5s of its translation units, as in source_content_hash
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class TranslationMemoryEntry(Base):
+    """Aligned source/target sentence pair, reused across sections and chapters"""
+    __tablename__ = "translation_memory"
+    __table_args__ = (
+        Index("uq_translation_memory_key", "source_hash", "source_language", "target_language", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source_language = Column(String(10), default="en")
+    target_language = Column(String(10), nullable=False)
+    source_hash = Column(String(64), index=True, nullable=False)  # SHA-256 of whitespace-normalized source
+    normalized_hash = Column(String(64), index=True, nullable=False)  # SHA-256 of case/punctuation-folded source
+    source_text = Column(Text, nullable=False)
+    target_text = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
@@ -68,3 +103,24 @@ class PersonalizedContent(Base):
     personalized_content = Column(Text, nullable=False)
     complexity_level = Column(String(20), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    hit_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_hit_at = Column(DateTime, nullable=True)  # Flushed periodically, see cache_lifecycle
+
+
+class SharedPersonalizedContent(Base):
+    """Personalized content shared by every user with the same profile fingerprint"""
+    __tablename__ = "shared_personalized_content"
+    __table_args__ = (
+        Index("uq_shared_personalized_key", "profile_fingerprint", "original_content_hash", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    profile_fingerprint = Column(String(64), nullable=False)  # SHA-256 of the canonical profile
+    profile = Column(JSON, nullable=False)  # The canonical profile fields the prompt was built from
+    chapter_path = Column(String(255), index=True, nullable=False)
+    original_content_hash = Column(String(64), nullable=False)
+    personalized_content = Column(Text, nullable=False)
+    complexity_level = Column(String(20), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    hit_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_hit_at = Column(DateTime, nullable=True)  # Flushed periodically, see cache_lifecycle
@@ -92,9 +92,13 @@ class TranslateRequest(BaseModel):
     content: str
     target_language: str = "ur"
     source_language: str = "en"
+    chapter_path: Optional[str] = None  # The chapter the content is from, if any
 
 
 class TranslateResponse(BaseModel):
     """Translation response"""
     translated_content: str
     cached: bool = False
+    sections: Optional[int] = None  # Translatable sections in the content
+    sections_cached: Optional[int] = None  # Sections served from the translation cache
+    sections_failed: Optional[int] = None  # Sections left in the source language after an error
@@ -1,9 +1,14 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy import create_engine, inspect, insert, text, Column, Integer, String, Text, DateTime, JSON, Boolean
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
 from datetime import datetime
+from typing import Any, Dict, List
+import logging
 from app.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Create SQLAlchemy engine
 engine = create_engine(settings.database_url, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -35,9 +40,129 @@ class DocumentChunk(Base):
     indexed_at = Column(DateTime, default=datetime.utcnow)
 
 
+class SourceManifest(Base):
+    """What is currently indexed for each source, for incremental re-indexing"""
+    __tablename__ = "source_manifests"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(500), unique=True, index=True, nullable=False)
+    content_hash = Column(String(64), nullable=False)  # SHA-256 of content + metadata + chunking config
+    chunk_hashes = Column(JSON, nullable=False)  # {chunk_id: SHA-256 of chunk text}, in chunk order
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class IndexJob(Base):
+    """Background indexing job; content is kept until the job finishes so it can resume"""
+    __tablename__ = "index_jobs"
+    
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    source = Column(String(500), index=True, nullable=False)
+    content = Column(Text, nullable=True)  # Cleared once the job finishes
+    doc_metadata = Column(JSON, nullable=True)
+    status = Column(String(20), index=True, nullable=False, default="queued")  # queued, running, completed, failed, cancelled
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    chunks_total = Column(Integer, nullable=True)
+    chunks_done = Column(Integer, nullable=False, default=0)
+    chunks_embedded = Column(Integer, nullable=False, default=0)
+    chunks_deleted = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    migrate_missing_columns()
+    migrate_unique_keys()
+
+
+def migrate_missing_columns():
+    """
+    Add columns introduced after a table was created (create_all only
+    creates missing tables). Columns must be nullable or have a server
+    default to be added this way.
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        quote = conn.dialect.identifier_preparer.quote
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    logger.warning(f"Cannot add NOT NULL column {table.name}.{column.name} without a server default")
+                    continue
+                ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=conn.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                conn.execute(text(ddl))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+
+# (table, index, columns) of unique keys added after their table existed
+UNIQUE_KEYS = [
+    ("translation_cache", "uq_translation_cache_key", ("source_content_hash", "source_language", "target_language")),
+    ("translation_memory", "uq_translation_memory_key", ("source_hash", "source_language", "target_language")),
+]
+
+
+def migrate_unique_keys():
+    """
+    Add the unique indexes in UNIQUE_KEYS to tables created before they
+    existed, keeping the oldest of any duplicate rows.
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table, index_name, columns in UNIQUE_KEYS:
+            if not inspector.has_table(table):
+                continue
+            if any(index["name"] == index_name for index in inspector.get_indexes(table)):
+                continue
+            column_list = ", ".join(columns)
+            conn.execute(text(
+                f"DELETE FROM {table} WHERE id NOT IN ("
+                f"SELECT MIN(id) FROM {table} GROUP BY {column_list})"
+            ))
+            conn.execute(text(f"CREATE UNIQUE INDEX {index_name} ON {table} ({column_list})"))
+            logger.info(f"Added unique index {index_name}")
+
+
+def upsert(db: Session, model, rows: List[Dict[str, Any]], key_columns: List[str], update_columns: List[str]):
+    """
+    Insert rows, overwriting update_columns of rows that already exist under
+    the unique key_columns, so racing writers never fail. Uses INSERT ... ON
+    CONFLICT on SQLite and Postgres, savepoints elsewhere. The caller commits.
+    """
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(model).values(rows)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: statement.excluded[column] for column in update_columns}
+        ))
+        return
+    
+    for row in rows:
+        try:
+            with db.begin_nested():
+                db.execute(insert(model).values(row))
+        except IntegrityError:
+            db.query(model).filter(
+                *(getattr(model, column) == row[column] for column in key_columns)
+            ).update({column: row[column] for column in update_columns})
 
 
 def get_db():
@@ -29,6 +29,26 @@ class DocumentIndexResponse(BaseModel):
     message: str
     chunks_indexed: int
     chunk_ids: List[str]
+    chunks_per_second: Optional[float] = None
+    chunks_embedded: Optional[int] = None  # New/changed chunks sent to the embeddings API
+    chunks_deleted: Optional[int] = None  # Chunks no longer present in the source
+
+
+class IndexJobResponse(BaseModel):
+    """State of a background indexing job"""
+    job_id: str
+    source: str
+    status: str  # queued, running, completed, failed, cancelled
+    cancel_requested: bool = False
+    chunks_total: Optional[int] = None  # Known once the document has been chunked
+    chunks_done: int = 0
+    chunks_embedded: int = 0
+    chunks_deleted: int = 0
+    chunks_per_second: Optional[float] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
 
 
 class HealthResponse(BaseModel):
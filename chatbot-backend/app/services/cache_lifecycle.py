@@ -0,0 +1,258 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.auth import ChapterVersion, TranslationCache, PersonalizedContent, SharedPersonalizedContent
+from app.models.database import SessionLocal, upsert
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = 500
+
+# Columns that identify a row when recording a hit
+HIT_KEYS = {
+    TranslationCache: ("source_content_hash", "source_language", "target_language"),
+    PersonalizedContent: ("id",),
+    SharedPersonalizedContent: ("id",),
+}
+
+
+class ContentCacheLifecycle:
+    """
+    Keep translation_cache, personalized_content and
+    shared_personalized_content within their budgets.
+
+    Lookups record hits in memory (the in-process translation tier never
+    touches the database), and each eviction pass first flushes them into
+    hit_count / last_hit_at with one batched UPDATE per table. It then
+    deletes, per table: rows unused for content_cache_max_age_days; stale
+    rows, for versions of a chapter no one requests any more; and the least
+    recently or least frequently used rows over the size budget. Deleted
+    translations are also dropped from the translation service's in-process
+    tier.
+
+    A chapter's current version is the content its last request sent,
+    kept in chapter_versions so every worker and restart sees it. Personalized
+    rows of that chapter with another content hash are stale, as are
+    translations stored for a chapter whose sections no current version
+    contains. Rows used within content_cache_stale_grace_hours are kept, for
+    readers still on a page loaded before the change.
+    """
+
+    def __init__(self):
+        self._hits: Dict[Any, Dict[tuple, Tuple[int, datetime]]] = {model: {} for model in HIT_KEYS}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_seconds: Optional[float] = None
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        # chapter_path -> content hash this process last recorded
+        self._chapters: Dict[str, str] = {}
+
+    @staticmethod
+    def _budgets() -> List[Tuple[Any, int]]:
+        return [
+            (TranslationCache, settings.translation_cache_max_rows),
+            (PersonalizedContent, settings.personalized_content_max_rows),
+            (SharedPersonalizedContent, settings.shared_personalized_content_max_rows),
+        ]
+
+    def record_hits(self, model, keys: Iterable[tuple]):
+        """Count cache hits for rows identified by HIT_KEYS[model]"""
+        now = datetime.utcnow()
+        with self._lock:
+            pending = self._hits[model]
+            for key in keys:
+                count, _ = pending.get(key, (0, now))
+                pending[key] = (count + 1, now)
+
+    def flush_hits(self, db: Session) -> int:
+        """Write recorded hits to the tables; returns the rows touched"""
+        with self._lock:
+            hits, self._hits = self._hits, {model: {} for model in HIT_KEYS}
+
+        touched = 0
+        for model, pending in hits.items():
+            if not pending:
+                continue
+            columns = HIT_KEYS[model]
+            statement = update(model.__table__).where(
+                *(getattr(model.__table__.c, column) == bindparam(f"key_{column}") for column in columns)
+            ).values(
+                hit_count=model.__table__.c.hit_count + bindparam("hits"),
+                last_hit_at=bindparam("last_hit")
+            )
+            db.connection().execute(statement, [
+                {**{f"key_{column}": value for column, value in zip(columns, key)}, "hits": count, "last_hit": last_hit}
+                for key, (count, last_hit) in pending.items()
+            ])
+            touched += len(pending)
+        db.commit()
+        return touched
+
+    def record_chapter(self, db: Session, chapter_path: str, content: str):
+        """Record the content a chapter was requested with, if it differs from the last recorded version"""
+        content_hash = hashlib.md5(content.encode()).hexdigest()
+        if self._chapters.get(chapter_path) == content_hash:
+            return
+
+        from app.services.translation import translation_service  # Imports this module
+        _, translatable = translation_service._split(content)
+        upsert(
+            db,
+            ChapterVersion,
+            [{
+                "chapter_path": chapter_path,
+                "content_hash": content_hash,
+                "section_hashes": list(translatable),
+                "updated_at": datetime.utcnow()
+            }],
+            key_columns=["chapter_path"],
+            update_columns=["content_hash", "section_hashes", "updated_at"]
+        )
+        db.commit()
+        self._chapters[chapter_path] = content_hash
+
+    @staticmethod
+    def _stale_rows(db: Session, model, columns: tuple, stale_cutoff: datetime) -> List[tuple]:
+        """Rows of model unused since stale_cutoff that no current chapter version serves"""
+        last_used = func.coalesce(model.last_hit_at, model.created_at)
+        if model is not TranslationCache:
+            return db.query(*columns).join(
+                ChapterVersion, ChapterVersion.chapter_path == model.chapter_path
+            ).filter(
+                model.original_content_hash != ChapterVersion.content_hash,
+                last_used < stale_cutoff
+            ).all()
+
+        # A section may be shared with other chapters, or with other
+        # versions of its own, so check it against every current version
+        current = set()
+        for content_hash, section_hashes in db.query(ChapterVersion.content_hash, ChapterVersion.section_hashes):
+            current.add(content_hash)  # The non-sectioned path caches whole documents
+            current.update(section_hashes)
+        candidates = db.query(*columns, model.source_content_hash).join(
+            ChapterVersion, ChapterVersion.chapter_path == model.chapter_path
+        ).filter(last_used < stale_cutoff)
+        return [tuple(row[:-1]) for row in candidates if row[-1] not in current]
+
+    @staticmethod
+    def _row_columns(model) -> tuple:
+        """id, then for translations the columns of their in-process cache key"""
+        if model is TranslationCache:
+            return (model.id, *(getattr(model, column) for column in HIT_KEYS[TranslationCache]))
+        return (model.id,)
+
+    @staticmethod
+    def _delete_rows(db: Session, model, rows: List[tuple], deleted_keys: List[tuple]) -> int:
+        """Delete rows selected with _row_columns, collecting their cache keys"""
+        ids = [row[0] for row in rows]
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            db.query(model).filter(model.id.in_(ids[start:start + DELETE_BATCH_SIZE])).delete(synchronize_session=False)
+        if model is TranslationCache:
+            deleted_keys.extend(tuple(row[1:]) for row in rows)
+        return len(ids)
+
+    def run_once(self) -> Dict[str, Dict[str, Any]]:
+        """One flush + eviction pass over every table"""
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            self.flush_hits(db)
+            now = datetime.utcnow()
+            age_cutoff = now - timedelta(days=settings.content_cache_max_age_days)
+            stale_cutoff = now - timedelta(hours=settings.content_cache_stale_grace_hours)
+
+            for model, max_rows in self._budgets():
+                last_used = func.coalesce(model.last_hit_at, model.created_at)
+                columns = self._row_columns(model)
+                deleted_keys: List[tuple] = []
+                stats = self.tables.setdefault(model.__tablename__, {
+                    "evicted_age": 0, "evicted_size": 0, "purged_stale": 0,
+                })
+
+                expired = db.query(*columns).filter(last_used < age_cutoff).all()
+                stats["evicted_age"] += self._delete_rows(db, model, expired, deleted_keys)
+
+                stale = self._stale_rows(db, model, columns, stale_cutoff)
+                stats["purged_stale"] += self._delete_rows(db, model, stale, deleted_keys)
+
+                rows = db.query(func.count(model.id)).scalar()
+                if rows > max_rows:
+                    if settings.content_cache_eviction_policy == "lfu":
+                        order = (model.hit_count, last_used)
+                    else:
+                        order = (last_used,)
+                    victims = db.query(*columns).order_by(*order).limit(rows - max_rows).all()
+                    stats["evicted_size"] += self._delete_rows(db, model, victims, deleted_keys)
+                    rows -= len(victims)
+                db.commit()
+                if deleted_keys:
+                    from app.services.translation import translation_service  # Imports this module
+                    translation_service.forget(deleted_keys)
+
+                stats["rows"] = rows
+                stats["max_rows"] = max_rows
+        finally:
+            db.close()
+
+        self.runs += 1
+        self.last_run_at = datetime.utcnow()
+        self.last_run_seconds = time.perf_counter() - started
+        logger.info(f"Content cache eviction pass in {self.last_run_seconds:.2f}s: {self.tables}")
+        return self.tables
+
+    async def start(self):
+        """Run eviction passes every content_cache_eviction_interval_seconds"""
+        if self._task or settings.content_cache_eviction_interval_seconds <= 0:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            # Keep the hits recorded since the last pass
+            db = SessionLocal()
+            try:
+                self.flush_hits(db)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning(f"Could not flush cache hit counters: {str(e)}")
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(settings.content_cache_eviction_interval_seconds)
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Content cache eviction failed: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Table sizes and eviction counters as of the last pass"""
+        with self._lock:
+            pending = sum(len(hits) for hits in self._hits.values())
+        return {
+            "policy": settings.content_cache_eviction_policy,
+            "runs": self.runs,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_seconds": self.last_run_seconds,
+            "pending_hits": pending,
+            "tables": self.tables,
+        }
+
+
+# Global instance - started on application startup
+content_cache_lifecycle = ContentCacheLifecycle()
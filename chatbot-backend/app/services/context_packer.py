@@ -0,0 +1,130 @@
+from typing import List, Dict, Any
+import logging
+
+from app.config import settings
+from app.services.tokenizer import get_encoding
+
+logger = logging.getLogger(__name__)
+
+
+def merge_overlapping_text(first: str, second: str) -> str:
+    """Join two consecutive chunks, writing their shared overlap only once"""
+    probe = second[:64]
+    if probe:
+        pos = first.find(probe, max(0, len(first) - len(second)))
+        while pos != -1:
+            if second.startswith(first[pos:]):
+                return first + second[len(first) - pos:]
+            pos = first.find(probe, pos + 1)
+    return f"{first}\n\n{second}"
+
+
+class ContextPacker:
+    """Fit retrieved chunks and chat history into a fixed token budget"""
+
+    def __init__(
+        self,
+        token_budget: int = 2500,
+        min_relative_score: float = 0.5,
+        history_token_budget: int = 1000
+    ):
+        self.token_budget = token_budget
+        self.min_relative_score = min_relative_score
+        self.history_token_budget = history_token_budget
+
+    @property
+    def encoding(self):
+        """The tokenizer, loaded on first use so importing this module stays offline"""
+        return get_encoding()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def merge_adjacent(self, context: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge hits that are consecutive chunks of the same source"""
+        merged = []
+        runs: Dict[Any, List[Dict[str, Any]]] = {}
+
+        for item in context:
+            metadata = item.get("metadata", {})
+            if isinstance(metadata.get("chunk_index"), int) and metadata.get("source"):
+                runs.setdefault(metadata["source"], []).append(item)
+            else:
+                merged.append(item)
+
+        for items in runs.values():
+            items.sort(key=lambda c: c["metadata"]["chunk_index"])
+            current = dict(items[0])
+            last_index = current["metadata"]["chunk_index"]
+
+            for item in items[1:]:
+                index = item["metadata"]["chunk_index"]
+                if index == last_index:
+                    continue
+                if index == last_index + 1:
+                    current["text"] = merge_overlapping_text(current["text"], item["text"])
+                    current["score"] = max(current["score"], item["score"])
+                    current["metadata"] = {
+                        **current["metadata"],
+                        "merged_chunks": current["metadata"].get("merged_chunks", 1) + 1
+                    }
+                else:
+                    merged.append(current)
+                    current = dict(item)
+                last_index = index
+
+            merged.append(current)
+
+        return merged
+
+    def pack(self, context: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge, filter by relative score and greedily fill the token budget"""
+        if not context:
+            return []
+
+        candidates = sorted(self.merge_adjacent(context), key=lambda c: c["score"], reverse=True)
+
+        top_score = candidates[0]["score"]
+        # RRF scores are rank-based: a hit found by one retriever scores about
+        # half as much as one found by both, so a relative cutoff would keep
+        # only the hits both agree on
+        if top_score > 0 and not candidates[0].get("fused"):
+            candidates = [
+                c for c in candidates
+                if c["score"] >= top_score * self.min_relative_score
+            ]
+
+        packed = []
+        used = 0
+        for item in candidates:
+            tokens = self.encoding.encode(item["text"])
+            if used + len(tokens) <= self.token_budget:
+                packed.append(item)
+                used += len(tokens)
+            elif not packed:
+                # Even the best hit is too long: keep its head rather than nothing
+                packed.append({**item, "text": self.encoding.decode(tokens[:self.token_budget])})
+                used = self.token_budget
+
+        logger.debug(f"Packed {len(packed)}/{len(context)} context chunks into {used} tokens")
+        return packed
+
+    def pack_history(self, chat_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Keep the most recent turns that fit the history budget"""
+        kept = []
+        used = 0
+        for turn in reversed(chat_history or []):
+            tokens = self.count_tokens(turn["user"]) + self.count_tokens(turn["assistant"])
+            if used + tokens > self.history_token_budget:
+                break
+            kept.append(turn)
+            used += tokens
+        return list(reversed(kept))
+
+
+# Global instance
+context_packer = ContextPacker(
+    token_budget=settings.context_token_budget,
+    min_relative_score=settings.context_min_relative_score,
+    history_token_budget=settings.history_token_budget,
+)
@@ -1,44 +1,306 @@
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, NamedTuple
+import asyncio
+import hashlib
+import multiprocessing
+import os
 import re
-import tiktoken
+import threading
+
+from app.config import settings
+from app.services.tokenizer import get_encoding
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+SPECIAL_CHARS_PATTERN = re.compile(r'[^\w\s.,!?;:()\-\'\"]+')
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n[ \t\r]*\n')
+ANCHOR_MODULUS = 4  # About one paragraph in four may end a window
+MAX_PENDING_CHARS = 64 * 1024  # Streamed text without a paragraph break is cut at whitespace beyond this
+
+# Markdown structure
+FRONT_MATTER_PATTERN = re.compile(r'\A---[ \t]*\n(.*?)\n---[ \t]*(?:\n|\Z)', re.DOTALL)
+FRONT_MATTER_TITLE_PATTERN = re.compile(r'^title:\s*[\'"]?(.+?)[\'"]?\s*$', re.MULTILINE)
+HEADING_PATTERN = re.compile(r'^ {0,3}(#{1,6})\s+(.+?)(?:\s+#+)?\s*$')
+FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+HEADING_PATH_SEPARATOR = " › "
+
+# (content, source, metadata)
+Document = Tuple[str, str, Optional[Dict[str, Any]]]
+ProcessedDocument = Tuple[List[str], List[Dict[str, Any]]]
+
+
+class MarkdownSection(NamedTuple):
+    """Content under one heading: paragraphs, lists and whole fenced code blocks"""
+    path: List[str]  # Heading titles from the top level down
+    level: int  # Heading level, 0 for text before the first heading
+    blocks: List[str]
+
+
+def split_markdown_sections(text: str) -> List[MarkdownSection]:
+    """
+    Split markdown into sections along its heading hierarchy.
+    Front matter is dropped (its title becomes the root heading when the
+    document has no H1), and '#' lines inside fenced code are not headings.
+    """
+    title = None
+    front_matter = FRONT_MATTER_PATTERN.match(text)
+    if front_matter:
+        title_match = FRONT_MATTER_TITLE_PATTERN.search(front_matter.group(1))
+        title = title_match.group(1) if title_match else None
+        text = text[front_matter.end():]
+    
+    sections: List[MarkdownSection] = []
+    headings: List[Tuple[int, str]] = []
+    level = 0
+    blocks: List[str] = []
+    lines: List[str] = []
+    fence = None
+    
+    def flush_block():
+        if lines:
+            blocks.append("\n".join(lines))
+            lines.clear()
+    
+    def flush_section():
+        nonlocal blocks
+        flush_block()
+        if blocks:
+            path = [heading for _, heading in headings]
+            if title and (not headings or headings[0][0] > 1):
+                path.insert(0, title)
+            sections.append(MarkdownSection(path, level, blocks))
+            blocks = []
+    
+    for line in text.replace("\r\n", "\n").split("\n"):
+        line = line.rstrip()
+        if fence:
+            lines.append(line)
+            if line.strip().startswith(fence) and not line.strip().strip(fence[0]):
+                fence = None
+                flush_block()
+            continue
+        
+        fence_match = FENCE_PATTERN.match(line)
+        heading_match = HEADING_PATTERN.match(line)
+        if fence_match:
+            flush_block()
+            fence = fence_match.group(1)
+            lines.append(line)
+        elif heading_match:
+            flush_section()
+            level = len(heading_match.group(1))
+            headings = [(l, h) for l, h in headings if l < level] + [(level, heading_match.group(2))]
+        elif not line.strip():
+            flush_block()
+        else:
+            lines.append(line)
+    
+    flush_section()
+    return sections
+
+
+def split_at_headings(text: str) -> List[str]:
+    """
+    Split markdown just before each heading outside fenced code. Unlike
+    split_markdown_sections this is lossless: the pieces join back into
+    text. Front matter, if any, is returned as its own first piece.
+    """
+    pieces: List[str] = []
+    front_matter = FRONT_MATTER_PATTERN.match(text)
+    if front_matter:
+        pieces.append(text[:front_matter.end()])
+        text = text[front_matter.end():]
+    
+    current: List[str] = []
+    fence = None
+    for line in text.splitlines(keepends=True):
+        stripped = line.rstrip()
+        if fence:
+            if stripped.strip().startswith(fence) and not stripped.strip().strip(fence[0]):
+                fence = None
+        elif FENCE_PATTERN.match(stripped):
+            fence = FENCE_PATTERN.match(stripped).group(1)
+        elif HEADING_PATTERN.match(stripped) and current:
+            pieces.append("".join(current))
+            current = []
+        current.append(line)
+    
+    if current:
+        pieces.append("".join(current))
+    return pieces
 
 
 class DocumentProcessor:
     """Process and chunk documents for RAG"""
     
-    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        mode: str = "tokens",
+        markdown_chunk_tokens: int = 400
+    ):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.mode = mode  # "tokens" (overlapping windows of cleaned paragraphs) or "markdown"
+        self.markdown_chunk_tokens = markdown_chunk_tokens
+    
+    @property
+    def encoding(self):
+        """The tokenizer, loaded on first use so importing this module stays offline"""
+        return get_encoding()
+    
+    @property
+    def config(self) -> Tuple[int, int, str, int]:
+        """Everything that determines how a document is chunked"""
+        return (self.chunk_size, self.chunk_overlap, self.mode, self.markdown_chunk_tokens)
+    
+    @property
+    def streaming_config(self) -> Tuple[int, int, str, int]:
+        """config for streaming_chunker(), which always packs paragraphs as in tokens mode"""
+        return (self.chunk_size, self.chunk_overlap, "tokens-stream", 0)
+    
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text"""
         # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
+        text = WHITESPACE_PATTERN.sub(' ', text)
         # Remove special characters but keep punctuation
-        text = re.sub(r'[^\w\s.,!?;:()\-\'\"]+', '', text)
+        text = SPECIAL_CHARS_PATTERN.sub('', text)
         return text.strip()
     
+    def paragraphs(self, text: str) -> List[str]:
+        """Cleaned, non-empty paragraphs (blocks between blank lines) of text"""
+        cleaned = (self.clean_text(block) for block in PARAGRAPH_BREAK_PATTERN.split(text))
+        return [paragraph for paragraph in cleaned if paragraph]
+    
+    def _pack_paragraphs(self, paragraphs: List[str], encoded: List[List[int]]) -> Tuple[List[str], List[int]]:
+        """Chunk texts and token counts for paragraphs and their tokens"""
+        windows = ParagraphWindows(self)
+        chunks = [chunk for paragraph, tokens in zip(paragraphs, encoded) for chunk in windows.add(paragraph, tokens)]
+        chunks += windows.finish()
+        token_counts = [len(tokens) for tokens in self.encoding.encode_batch(chunks)] if chunks else []
+        return chunks, token_counts
+    
     def chunk_text(self, text: str) -> List[str]:
-        """Split text into chunks with overlap"""
-        # Tokenize
-        tokens = self.encoding.encode(text)
-        chunks = []
-        
-        start = 0
-        while start < len(tokens):
-            end = start + self.chunk_size
-            chunk_tokens = tokens[start:end]
-            chunk_text = self.encoding.decode(chunk_tokens)
-            chunks.append(chunk_text)
+        """Split text into overlapping chunks cut between paragraphs"""
+        paragraphs = self.paragraphs(text)
+        chunks, _ = self._pack_paragraphs(paragraphs, self.encoding.encode_batch(paragraphs) if paragraphs else [])
+        return chunks
+    
+    def _split_block(self, block: str, budget: int) -> List[str]:
+        """Break a block larger than budget; code stays fenced in every piece"""
+        fence_match = FENCE_PATTERN.match(block)
+        lines = block.split("\n")
+        if fence_match and len(lines) > 2:
+            opening, closing = lines[0], fence_match.group(1)
+            body = lines[1:-1] if lines[-1].strip().startswith(closing) else lines[1:]
+            room = budget - self.count_tokens(f"{opening}\n{closing}")
             
-            # Move start pointer with overlap
-            start = end - self.chunk_overlap
+            pieces, current, used = [], [], 0
+            for line in body:
+                line_tokens = self.count_tokens(line) + 1
+                if current and used + line_tokens > room:
+                    pieces.append(current)
+                    current, used = [], 0
+                current.append(line)
+                used += line_tokens
+            pieces.append(current)
+            return ["\n".join([opening, *piece, closing]) for piece in pieces]
+        
+        tokens = self.encoding.encode(block)
+        return [self.encoding.decode(tokens[i:i + budget]) for i in range(0, len(tokens), budget)]
+    
+    def chunk_markdown(self, content: str) -> Tuple[List[str], List[int], List[str]]:
+        """
+        Chunk markdown along its structure: texts, token counts and heading paths.
+        
+        Whole sections are packed into chunks of up to markdown_chunk_tokens;
+        a section only starts a new chunk if it doesn't fit the current one,
+        and only a section larger than the budget is split, between blocks.
+        Each chunk opens with its heading path so it reads on its own.
+        """
+        budget = self.markdown_chunk_tokens
+        chunks: List[Tuple[str, List[str]]] = []
+        parts: List[str] = []
+        paths: List[List[str]] = []
+        used = 0
+        
+        def flush():
+            nonlocal parts, paths, used
+            if parts:
+                # A chunk spanning sections belongs to their common ancestor
+                common = paths[0]
+                for path in paths[1:]:
+                    shared = 0
+                    while shared < min(len(common), len(path)) and common[shared] == path[shared]:
+                        shared += 1
+                    common = common[:shared]
+                chunks.append(("\n\n".join(parts), common or paths[0]))
+            parts, paths, used = [], [], 0
+        
+        for section in split_markdown_sections(content):
+            breadcrumb = HEADING_PATH_SEPARATOR.join(section.path)
+            heading = f"{'#' * section.level} {section.path[-1]}" if section.level else breadcrumb
+            blocks = [(block, self.count_tokens(block)) for block in section.blocks]
+            section_tokens = sum(tokens for _, tokens in blocks) + self.count_tokens(breadcrumb)
+            if parts and used + section_tokens > budget and section_tokens <= budget:
+                flush()
             
-            if start >= len(tokens):
-                break
+            piece_budget = max(budget - self.count_tokens(breadcrumb) - 2, budget // 2)
+            for position, (block, block_tokens) in enumerate(blocks):
+                pieces = self._split_block(block, piece_budget) if block_tokens > piece_budget else [block]
+                for piece_index, piece in enumerate(pieces):
+                    piece_tokens = block_tokens if piece is block else self.count_tokens(piece)
+                    label = None
+                    if not parts:
+                        label = breadcrumb
+                    elif position == 0 and piece_index == 0:
+                        label = heading
+                    label_tokens = self.count_tokens(label) if label else 0
+                    
+                    if parts and used + label_tokens + piece_tokens > budget:
+                        flush()
+                        label = breadcrumb
+                        label_tokens = self.count_tokens(label)
+                    if label:
+                        parts.append(label)
+                        used += label_tokens
+                    parts.append(piece)
+                    used += piece_tokens
+                    if section.path not in paths:
+                        paths.append(section.path)
+        flush()
         
-        return chunks
+        texts = [text for text, _ in chunks]
+        token_counts = [len(tokens) for tokens in self.encoding.encode_batch(texts)] if texts else []
+        heading_paths = [HEADING_PATH_SEPARATOR.join(path) for _, path in chunks]
+        return texts, token_counts, heading_paths
+    
+    def streaming_chunker(self) -> "StreamingChunker":
+        """Chunker for text that arrives in pieces (e.g. an upload stream)"""
+        return StreamingChunker(self)
+    
+    @staticmethod
+    def _chunk_metadatas(
+        source: str,
+        token_counts: List[int],
+        metadata: Optional[Dict[str, Any]],
+        heading_paths: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        metadatas = []
+        for idx, token_count in enumerate(token_counts):
+            chunk_metadata = {
+                "source": source,
+                "chunk_index": idx,
+                "total_chunks": len(token_counts),
+                "token_count": token_count
+            }
+            if heading_paths is not None:
+                chunk_metadata["heading_path"] = heading_paths[idx]
+            metadatas.append({**chunk_metadata, **(metadata or {})})
+        return metadatas
     
     def process_document(
         self, 
@@ -47,22 +309,260 @@ class DocumentProcessor:
         metadata: Dict[str, Any] = None
     ) -> tuple[List[str], List[Dict[str, Any]]]:
         """Process document and return chunks with metadata"""
-        cleaned_text = self.clean_text(content)
-        chunks = self.chunk_text(cleaned_text)
+        if self.mode == "markdown":
+            chunks, token_counts, heading_paths = self.chunk_markdown(content)
+            return chunks, self._chunk_metadatas(source, token_counts, metadata, heading_paths)
         
-        # Add metadata to each chunk
-        metadatas = []
-        for idx, chunk in enumerate(chunks):
-            chunk_metadata = {
-                "source": source,
-                "chunk_index": idx,
-                "total_chunks": len(chunks),
-                **(metadata or {})
-            }
-            metadatas.append(chunk_metadata)
+        paragraphs = self.paragraphs(content)
+        chunks, token_counts = self._pack_paragraphs(
+            paragraphs, self.encoding.encode_batch(paragraphs) if paragraphs else []
+        )
+        return chunks, self._chunk_metadatas(source, token_counts, metadata)
+    
+    def process_batch(self, documents: List[Document]) -> List[ProcessedDocument]:
+        """process_document for many documents, tokenizing them with one batch call"""
+        if self.mode == "markdown":
+            return [self.process_document(*document) for document in documents]
+        
+        paragraphs = [self.paragraphs(content) for content, _, _ in documents]
+        flat = [paragraph for document in paragraphs for paragraph in document]
+        encoded = self.encoding.encode_batch(flat) if flat else []
+        
+        results = []
+        offset = 0
+        for (_, source, metadata), document in zip(documents, paragraphs):
+            chunks, token_counts = self._pack_paragraphs(document, encoded[offset:offset + len(document)])
+            offset += len(document)
+            results.append((chunks, self._chunk_metadatas(source, token_counts, metadata)))
+        return results
+    
+    def process_documents(self, documents: List[Document]) -> List[ProcessedDocument]:
+        """
+        Chunk many documents across the chunking process pool.
+        Falls back to process_batch in this process when the pool is
+        disabled (CHUNKING_WORKERS=1) or there is only one document.
+        """
+        pool = _get_chunking_pool()
+        if pool is None or len(documents) < 2:
+            return self.process_batch(documents)
+        
+        futures = [
+            pool.submit(_process_in_worker, self.config, batch)
+            for batch in _split_for_workers(documents, _chunking_workers())
+        ]
+        return [result for future in futures for result in future.result()]
+    
+    async def aprocess_document(
+        self,
+        content: str,
+        source: str,
+        metadata: Dict[str, Any] = None
+    ) -> ProcessedDocument:
+        """process_document in the chunking pool, keeping the event loop free"""
+        pool = _get_chunking_pool()
+        if pool is None:
+            return self.process_document(content, source, metadata)
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            pool, _process_in_worker, self.config, [(content, source, metadata)]
+        )
+        return results[0]
+    
+    async def aprocess_documents(self, documents: List[Document]) -> List[ProcessedDocument]:
+        """process_documents without blocking the event loop"""
+        pool = _get_chunking_pool()
+        if pool is None:
+            return self.process_batch(documents)
+        loop = asyncio.get_running_loop()
+        batches = await asyncio.gather(*(
+            loop.run_in_executor(pool, _process_in_worker, self.config, batch)
+            for batch in _split_for_workers(documents, _chunking_workers())
+        ))
+        return [result for batch in batches for result in batch]
+
+
+# Chunking is CPU-bound (regex + BPE), so batches run in worker processes.
+# The pool is created on first use; workers keep one processor per config.
+_chunking_pool: Optional[ProcessPoolExecutor] = None
+_chunking_pool_lock = threading.Lock()
+_worker_processors: Dict[tuple, DocumentProcessor] = {}
+
+
+def _chunking_workers() -> int:
+    return settings.chunking_workers or os.cpu_count() or 1
+
+
+def _get_chunking_pool() -> Optional[ProcessPoolExecutor]:
+    global _chunking_pool
+    workers = _chunking_workers()
+    if workers <= 1:
+        return None
+    with _chunking_pool_lock:
+        if _chunking_pool is None:
+            # spawn, not fork: the parent runs threads (asyncio, HTTP clients)
+            _chunking_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _chunking_pool
+
+
+def shutdown_chunking_pool():
+    """Stop the chunking worker processes, if started"""
+    global _chunking_pool
+    with _chunking_pool_lock:
+        if _chunking_pool is not None:
+            _chunking_pool.shutdown(cancel_futures=True)
+            _chunking_pool = None
+
+
+def _split_for_workers(documents: List[Document], workers: int) -> List[List[Document]]:
+    """Contiguous slices of roughly equal total size, at most one per worker"""
+    total = sum(len(content) for content, _, _ in documents) or 1
+    target = total / max(1, min(workers, len(documents)))
+    batches: List[List[Document]] = [[]]
+    size = 0
+    for document in documents:
+        if batches[-1] and size >= target:
+            batches.append([])
+            size = 0
+        batches[-1].append(document)
+        size += len(document[0])
+    return batches
+
+
+def _process_in_worker(config: tuple, documents: List[Document]) -> List[ProcessedDocument]:
+    processor = _worker_processors.get(config)
+    if processor is None:
+        processor = DocumentProcessor(*config)
+        _worker_processors[config] = processor
+    return processor.process_batch(documents)
+
+
+class ParagraphWindows:
+    """
+    Pack paragraphs into overlapping windows of up to chunk_size tokens,
+    cut at points defined by the content rather than by token offsets.
+    
+    A window holds its own paragraphs (up to chunk_size - chunk_overlap
+    tokens) after the previous window's trailing paragraphs (up to
+    chunk_overlap tokens, or the tail of its last paragraph if that alone is
+    longer). It ends after an anchor paragraph, picked by its hash, once it
+    holds half its budget, or before a paragraph that won't fit. Both rules
+    only look at the window's own paragraphs, so an edit changes the window
+    holding it (plus the next, if it is in the overlap) and later cuts fall
+    back in step at the next anchor. Fixed token offsets would instead move
+    every window after the first changed token. Paragraphs over the budget
+    are split into token windows of their own.
+    """
+    
+    def __init__(self, processor: DocumentProcessor):
+        self.processor = processor
+        self.budget = max(1, processor.chunk_size - processor.chunk_overlap)
+        self.break_tokens = len(processor.encoding.encode("\n\n"))
+        self._own: List[Tuple[str, List[int]]] = []
+        self._used = 0
+        self._overlap: List[str] = []
+    
+    @staticmethod
+    def _is_anchor(paragraph: str) -> bool:
+        digest = hashlib.blake2b(paragraph.encode(), digest_size=4).digest()
+        return int.from_bytes(digest, "big") % ANCHOR_MODULUS == 0
+    
+    def _cut(self) -> str:
+        text = "\n\n".join(self._overlap + [paragraph for paragraph, _ in self._own])
+        limit = self.processor.chunk_overlap
+        overlap, used = [], 0
+        for paragraph, tokens in reversed(self._own):
+            if used + len(tokens) + self.break_tokens > limit:
+                break
+            overlap.insert(0, paragraph)
+            used += len(tokens) + self.break_tokens
+        if not overlap and limit > self.break_tokens:
+            tail = self._own[-1][1][self.break_tokens - limit:]
+            overlap = [self.processor.encoding.decode(tail).strip()]
+        self._overlap, self._own, self._used = overlap, [], 0
+        return text
+    
+    def add(self, paragraph: str, tokens: List[int]) -> List[str]:
+        """Add one paragraph; return the windows it completed"""
+        if len(tokens) > self.budget:
+            slices = [tokens[i:i + self.budget] for i in range(0, len(tokens), self.budget)]
+            pieces = [(self.processor.encoding.decode(piece).strip(), piece) for piece in slices]
+        else:
+            pieces = [(paragraph, tokens)]
         
-        return chunks, metadatas
+        windows = []
+        for piece, piece_tokens in pieces:
+            size = len(piece_tokens) + self.break_tokens  # With the break joining it to the next one
+            if self._own and self._used + size > self.budget:
+                windows.append(self._cut())
+            self._own.append((piece, piece_tokens))
+            self._used += size
+            if self._used >= self.budget // 2 and self._is_anchor(piece):
+                windows.append(self._cut())
+        return windows
+    
+    def finish(self) -> List[str]:
+        """The last, unfinished window, if any"""
+        return [self._cut()] if self._own else []
+
+
+class StreamingChunker:
+    """
+    Incremental version of chunk_text for tokens mode.
+    
+    Paragraphs are cleaned, tokenized and packed as soon as the blank line
+    ending them arrives, so the chunks match chunk_text on the whole text;
+    only the unfinished paragraph and window are kept in memory. Text with
+    no paragraph break for MAX_PENDING_CHARS is cut at whitespace instead.
+    """
+    
+    _LAST_WHITESPACE_RUN = re.compile(r'\s+\S*\Z')
+    
+    def __init__(self, processor: DocumentProcessor):
+        self.processor = processor
+        self._windows = ParagraphWindows(processor)
+        self._pending = ""
+    
+    def _consume(self, text: str) -> List[Tuple[str, int]]:
+        paragraphs = self.processor.paragraphs(text)
+        if not paragraphs:
+            return []
+        encoded = self.processor.encoding.encode_batch(paragraphs)
+        chunks = [chunk for paragraph, tokens in zip(paragraphs, encoded) for chunk in self._windows.add(paragraph, tokens)]
+        return self._counted(chunks)
+    
+    def _counted(self, chunks: List[str]) -> List[Tuple[str, int]]:
+        if not chunks:
+            return []
+        return [(chunk, len(tokens)) for chunk, tokens in zip(chunks, self.processor.encoding.encode_batch(chunks))]
+    
+    def feed(self, text: str) -> List[Tuple[str, int]]:
+        """Add text; return (chunk, token_count) for any chunks completed by it"""
+        self._pending += text
+        last_break = None
+        for last_break in PARAGRAPH_BREAK_PATTERN.finditer(self._pending):
+            pass
+        if last_break is not None:
+            complete, self._pending = self._pending[:last_break.start()], self._pending[last_break.end():]
+            return self._consume(complete)
+        if len(self._pending) > MAX_PENDING_CHARS:
+            match = self._LAST_WHITESPACE_RUN.search(self._pending)
+            if match is not None and match.start() > 0:
+                complete, self._pending = self._pending[:match.start()], self._pending[match.start():]
+                return self._consume(complete)
+        return []
+    
+    def finish(self) -> List[Tuple[str, int]]:
+        """Flush the remaining text; return (chunk, token_count) for the final chunks"""
+        chunks = self._consume(self._pending)
+        self._pending = ""
+        return chunks + self._counted(self._windows.finish())
 
 
 # Global instance
-doc_processor = DocumentProcessor()
+doc_processor = DocumentProcessor(
+    mode=settings.chunking_mode,
+    markdown_chunk_tokens=settings.markdown_chunk_tokens
+)
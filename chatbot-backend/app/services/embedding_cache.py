@@ -0,0 +1,171 @@
+from array import array
+from typing import List, Dict, Any, Optional
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from app.config import settings
+from app.services.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SQLITE_BATCH_SIZE = 500  # Keys per IN (...) lookup, under SQLite's variable limit
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different strings share one entry"""
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by (model, text hash).
+    Used for query embeddings and, as a disk-only store, for document chunks.
+
+    The first tier is an in-process LRU, left out when max_entries is 0.
+    The optional second tier is a SQLite file holding float32 blobs, so
+    entries survive restarts and are shared by every worker on the host.
+    It is opened on first use, not when the module is imported.
+
+    With normalize=True keys collapse whitespace, which suits user queries;
+    document chunks are keyed on their exact text, since whitespace changes
+    what the embedding model sees (code blocks, tables).
+    """
+
+    def __init__(self, max_entries: int, path: Optional[str] = None, normalize: bool = True):
+        self.memory = LRUCache(max_entries) if max_entries > 0 else None
+        self.normalize = normalize
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_opened = False
+        self._db_lock = threading.Lock()
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """The disk tier, opened on the first call; None without one (hold _db_lock)"""
+        if self._db_opened:
+            return self._db
+        self._db_opened = True
+        if not self.path:
+            return None
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+            logger.info(f"Embedding cache persisted at {self.path}")
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache disk tier disabled: {e}")
+            self._db = None
+        return self._db
+
+    def make_key(self, model: str, text: str) -> str:
+        if self.normalize:
+            return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode()).hexdigest()
+        # Own namespace, so rows written under collapsed-text keys never match
+        return hashlib.sha256(f"exact\n{model}\n{text}".encode()).hexdigest()
+
+    @property
+    def persistent(self) -> bool:
+        with self._db_lock:
+            return self._connection() is not None
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Look up an embedding in memory, then on disk"""
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up a batch of embeddings; misses are None"""
+        keys = [self.make_key(model, text) for text in texts]
+        if self.memory is not None:
+            vectors = [self.memory.get(key) for key in keys]
+        else:
+            vectors = [None] * len(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing and self.path:
+            found = {}
+            with self._db_lock:
+                db = self._connection()
+                if db is not None:
+                    for lo in range(0, len(missing), SQLITE_BATCH_SIZE):
+                        batch = [keys[i] for i in missing[lo:lo + SQLITE_BATCH_SIZE]]
+                        found.update(db.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                            batch
+                        ).fetchall())
+            for i in missing:
+                blob = found.get(keys[i])
+                if blob is not None:
+                    vectors[i] = array("f", blob).tolist()
+                    if self.memory is not None:
+                        self.memory.put(keys[i], vectors[i])
+                    self.disk_hits += 1
+
+        self.misses += sum(vector is None for vector in vectors)
+        return vectors
+
+    def put(self, model: str, text: str, vector: List[float]):
+        """Store an embedding in both tiers"""
+        self.put_many(model, [text], [vector])
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Store a batch of embeddings in both tiers, in one disk transaction"""
+        rows = []
+        for text, vector in zip(texts, vectors):
+            key = self.make_key(model, text)
+            if self.memory is not None:
+                self.memory.put(key, vector)
+            rows.append((key, array("f", vector).tobytes()))
+
+        if not self.path or not rows:
+            return
+
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return
+                db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+                )
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for sizing the cache"""
+        memory = self.memory.stats() if self.memory is not None else {}
+        disk_entries = None
+        with self._db_lock:
+            if self._db is not None:  # Stats alone don't open the file
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "memory_size": memory.get("size"),
+            "memory_max_entries": memory.get("max_entries"),
+            "memory_hits": memory.get("hits"),
+            "memory_evictions": memory.get("evictions"),
+            "disk_entries": disk_entries,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+
+# Global instance for query embeddings
+query_embedding_cache = EmbeddingCache(
+    max_entries=settings.embedding_cache_max_entries,
+    path=settings.embedding_cache_path,
+)
+
+# Global instance for document chunk embeddings: content-addressed, so a
+# chunk seen under any source or in any earlier run is never re-embedded.
+# Disk only: a re-index reads each chunk once, so an LRU would just churn.
+document_embedding_store = EmbeddingCache(
+    max_entries=0,
+    path=settings.document_embedding_store_path,
+    normalize=False,
+)
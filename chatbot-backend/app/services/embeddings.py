@@ -0,0 +1,99 @@
+from abc import ABC, abstractmethod
+from typing import List
+import hashlib
+import math
+
+from openai import OpenAI, AsyncOpenAI
+
+from app.config import settings
+from app.services.lexical_index import tokenize
+
+
+class EmbeddingProvider(ABC):
+    """Turns texts into fixed-size vectors"""
+
+    model_name: str
+    dimensions: int
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts, preserving order"""
+
+    @abstractmethod
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts without blocking the event loop"""
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings API (default)"""
+
+    def __init__(self, model_name: str, dimensions: int, api_key: str):
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.client = OpenAI(api_key=api_key)
+        self.async_client = AsyncOpenAI(api_key=api_key)
+        # Only the text-embedding-3 models can be shortened; others are checked
+        self.request_options = {"dimensions": dimensions} if model_name.startswith("text-embedding-3") else {}
+
+    def _vectors(self, response) -> List[List[float]]:
+        vectors = [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+        for vector in vectors:
+            if len(vector) != self.dimensions:
+                raise ValueError(
+                    f"{self.model_name} returned {len(vector)}-dimensional embeddings, "
+                    f"EMBEDDING_DIMENSIONS is {self.dimensions}"
+                )
+        return vectors
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.model_name, input=texts, **self.request_options)
+        return self._vectors(response)
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        response = await self.async_client.embeddings.create(model=self.model_name, input=texts, **self.request_options)
+        return self._vectors(response)
+
+
+class LocalHashEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic, network-free embedder for tests and benchmarks.
+
+    Word unigrams and bigrams are hashed into a signed bag-of-features
+    vector and L2-normalised, so texts sharing vocabulary score high on
+    cosine similarity. Retrieval quality is lexical, not semantic.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.model_name = f"local-hash-{dimensions}"
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dimensions] += sign
+
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts)
+
+
+def create_embedding_provider() -> EmbeddingProvider:
+    """Build the embedding provider selected by settings.embedding_provider"""
+    if settings.embedding_provider == "local":
+        return LocalHashEmbeddingProvider(settings.embedding_dimensions)
+    return OpenAIEmbeddingProvider(
+        model_name=settings.embedding_model,
+        dimensions=settings.embedding_dimensions,
+        api_key=settings.openai_api_key,
+    )
@@ -0,0 +1,160 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+import uuid
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.database import SessionLocal, IndexJob
+from app.services.indexer import document_indexer, IndexResult
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised from the progress callback to stop a job between batches"""
+
+
+class IndexJobQueue:
+    """
+    Run document indexing off the request path.
+
+    Jobs live in the index_jobs table: submitting stores the content and
+    returns immediately, a fixed pool of worker tasks picks jobs up, and
+    progress is written back after every committed batch. Jobs that were
+    queued or running when the process stopped are resumed on start; the
+    indexer skips chunks an interrupted run already committed.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Re-queue unfinished jobs and start the worker pool"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        db = SessionLocal()
+        try:
+            unfinished = db.query(IndexJob)\
+                .filter(IndexJob.status.in_(("queued", "running")))\
+                .order_by(IndexJob.created_at)\
+                .all()
+            for job in unfinished:
+                job.status = "queued"
+                self._queue.put_nowait(job.id)
+            db.commit()
+            if unfinished:
+                logger.info(f"Resuming {len(unfinished)} unfinished indexing jobs")
+        finally:
+            db.close()
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; running jobs stay 'running' and resume on next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(
+        self,
+        db: Session,
+        content: str,
+        source: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> IndexJob:
+        """Persist a new job and queue it"""
+        job = IndexJob(
+            id=uuid.uuid4().hex,
+            source=source,
+            content=content,
+            doc_metadata=metadata,
+            status="queued"
+        )
+        db.add(job)
+        db.commit()
+        self._queue.put_nowait(job.id)
+        return job
+
+    def cancel(self, db: Session, job: IndexJob) -> IndexJob:
+        """Cancel a queued job now, or ask a running one to stop after its current batch"""
+        if job.status == "queued":
+            self._finish(job, "cancelled")
+        elif job.status == "running":
+            job.cancel_requested = True
+        db.commit()
+        return job
+
+    @staticmethod
+    def _finish(job: IndexJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.content = None  # Only needed to (re)run the job
+        job.finished_at = datetime.utcnow()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.error(f"Indexing job {job_id} crashed: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        db = SessionLocal()
+        try:
+            job = db.get(IndexJob, job_id)
+            if job is None or job.status != "queued":
+                return  # Cancelled while waiting
+            job.status = "running"
+            job.started_at = job.started_at or datetime.utcnow()
+            db.commit()
+
+            def progress(result: IndexResult, chunks_total: Optional[int]):
+                job.chunks_total = chunks_total
+                job.chunks_done = result.chunks_total
+                job.chunks_embedded = result.chunks_embedded
+                db.commit()
+                db.refresh(job)  # Pick up cancel requests from other sessions
+                if job.cancel_requested:
+                    raise JobCancelled()
+
+            try:
+                result = await document_indexer.index_document(
+                    db=db,
+                    content=job.content,
+                    source=job.source,
+                    metadata=job.doc_metadata,
+                    progress=progress
+                )
+                job.chunks_total = result.chunks_total
+                job.chunks_done = result.chunks_total
+                job.chunks_embedded = result.chunks_embedded
+                job.chunks_deleted = result.chunks_deleted
+                self._finish(job, "completed")
+                logger.info(f"Indexing job {job_id} completed: {result.chunks_total} chunks from {job.source}")
+            except JobCancelled:
+                db.rollback()
+                self._finish(job, "cancelled")
+                logger.info(f"Indexing job {job_id} cancelled after {job.chunks_done} chunks")
+            except Exception as e:
+                db.rollback()
+                self._finish(job, "failed", str(e))
+                logger.error(f"Indexing job {job_id} failed: {str(e)}")
+            db.commit()
+        finally:
+            db.close()
+
+
+# Global instance - started on application startup
+index_job_queue = IndexJobQueue(workers=settings.index_job_workers)
@@ -0,0 +1,351 @@
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, AsyncIterable, AsyncIterator, Callable, Tuple, Union
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.database import DocumentChunk, SourceManifest
+from app.services.document_processor import doc_processor, Document, ProcessedDocument
+from app.services.lexical_index import get_lexical_index
+from app.services.semantic_cache import semantic_cache
+from app.services.vector_store import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[["IndexResult", Optional[int]], None]
+
+
+@dataclass
+class IndexResult:
+    """Outcome of indexing one source"""
+    source: str
+    chunk_ids: List[str] = field(default_factory=list)
+    chunks_embedded: int = 0
+    chunks_deleted: int = 0
+    chunks_updated: int = 0
+    unchanged: bool = False
+
+    @property
+    def chunks_total(self) -> int:
+        return len(self.chunk_ids)
+
+
+class DocumentIndexer:
+    """
+    Incrementally index sources into the vector store, the BM25 index and
+    the document_chunks table.
+
+    A per-source manifest records the content hash and the hash of every
+    chunk. Re-indexing an unchanged source is a no-op; otherwise only new
+    chunks are embedded, moved chunks get their payload rewritten and
+    chunks that disappeared are deleted everywhere. An edit re-embeds the
+    chunk holding it and, through the overlap, at most its neighbour: the
+    chunkers cut between paragraphs and sections, not at token offsets that
+    would shift after every changed token.
+    """
+
+    def __init__(self):
+        # source -> (lock, runs holding or waiting for it); dropped when unused
+        self._source_locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @contextlib.asynccontextmanager
+    async def _source_lock(self, source: str):
+        """Serialize runs for one source"""
+        lock, users = self._source_locks.get(source) or (asyncio.Lock(), 0)
+        self._source_locks[source] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._source_locks[source]
+            if users == 1:
+                del self._source_locks[source]
+            else:
+                self._source_locks[source] = (lock, users - 1)
+
+    @staticmethod
+    def _content_hasher(metadata: Optional[Dict[str, Any]], chunking: Optional[tuple] = None):
+        """
+        sha256 primed with everything besides the content that shapes a
+        source's chunks; `chunking` is the chunker config actually used
+        (doc_processor.config unless given)
+        """
+        hasher = hashlib.sha256(json.dumps({
+            "metadata": metadata or {},
+            "chunking": chunking if chunking is not None else doc_processor.config,
+        }, sort_keys=True, default=str).encode())
+        hasher.update(b"\0")
+        return hasher
+
+    @classmethod
+    def content_hash(cls, content: str, metadata: Optional[Dict[str, Any]]) -> str:
+        """Hash of everything that determines a source's chunks and payloads"""
+        hasher = cls._content_hasher(metadata)
+        hasher.update(content.encode())
+        return hasher.hexdigest()
+
+    async def index_document(
+        self,
+        db: Session,
+        content: str,
+        source: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+        processed: Optional[ProcessedDocument] = None
+    ) -> IndexResult:
+        """
+        Bring the index for one source in line with its current content.
+        `progress(result_so_far, chunks_total)` is called before the first
+        batch and after each committed batch; raising from it aborts the run.
+        `processed` passes chunks already computed by the document processor.
+        """
+        async with self._source_lock(source):
+            content_hash = self.content_hash(content, metadata)
+            manifest = db.query(SourceManifest).filter(SourceManifest.source == source).first()
+
+            if manifest and manifest.content_hash == content_hash:
+                logger.info(f"Skipping unchanged source {source}")
+                return IndexResult(source=source, chunk_ids=list(manifest.chunk_hashes), unchanged=True)
+
+            if processed is None:
+                processed = await doc_processor.aprocess_document(
+                    content=content,
+                    source=source,
+                    metadata=metadata
+                )
+            chunks, metadatas = processed
+
+            async def batches():
+                batch_size = settings.index_commit_batch_size
+                for start in range(0, len(chunks), batch_size):
+                    yield chunks[start:start + batch_size], metadatas[start:start + batch_size]
+
+            return await self._index_batches(
+                db, source, manifest, batches(), lambda: content_hash,
+                chunks_total=len(chunks), progress=progress
+            )
+
+    async def index_documents(
+        self,
+        db: Session,
+        documents: List[Document]
+    ) -> AsyncIterator[Tuple[str, Union[IndexResult, Exception]]]:
+        """
+        Index many (content, source, metadata) documents, yielding
+        (source, result or exception) in order. Changed documents are
+        chunked up front in parallel across the chunking process pool.
+        """
+        sources = [source for _, source, _ in documents]
+        known_hashes = dict(
+            db.query(SourceManifest.source, SourceManifest.content_hash)
+            .filter(SourceManifest.source.in_(sources))
+        )
+        changed = [
+            i for i, (content, source, metadata) in enumerate(documents)
+            if known_hashes.get(source) != self.content_hash(content, metadata)
+        ]
+
+        processed: Dict[int, ProcessedDocument] = {}
+        if changed:
+            try:
+                chunked = await doc_processor.aprocess_documents([documents[i] for i in changed])
+                processed = dict(zip(changed, chunked))
+            except Exception as e:
+                logger.warning(f"Batch chunking failed, chunking one document at a time: {str(e)}")
+
+        for i, (content, source, metadata) in enumerate(documents):
+            try:
+                result = await self.index_document(db, content, source, metadata, processed=processed.pop(i, None))
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error indexing {source}: {str(e)}")
+                result = e
+            yield source, result
+
+    async def index_stream(
+        self,
+        db: Session,
+        source: str,
+        pieces: AsyncIterable[str],
+        metadata: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None
+    ) -> IndexResult:
+        """
+        Index one source whose text arrives in pieces (e.g. a request body).
+
+        Chunks are embedded and committed every index_commit_batch_size
+        chunks, so memory stays bounded by one batch however large the
+        source is. Unchanged chunks are still skipped by id, but since the
+        content hash is only known at the end there is no whole-source skip.
+        Streamed text is always chunked as in tokens mode, whatever the
+        chunking_mode: markdown sections can't be packed before they end.
+        """
+        async with self._source_lock(source):
+            manifest = db.query(SourceManifest).filter(SourceManifest.source == source).first()
+            previous_hash = manifest.content_hash if manifest else None  # _index_batches overwrites it
+            hasher = self._content_hasher(metadata, doc_processor.streaming_config)
+            chunker = doc_processor.streaming_chunker()
+            batch_size = settings.index_commit_batch_size
+
+            async def batches():
+                chunk_index = 0
+                pending: List[Tuple[str, int]] = []
+
+                def take(count: int):
+                    nonlocal chunk_index, pending
+                    taken, pending = pending[:count], pending[count:]
+                    metadatas = [
+                        {
+                            "source": source,
+                            "chunk_index": chunk_index + i,
+                            "token_count": token_count,
+                            **(metadata or {})
+                        }
+                        for i, (_, token_count) in enumerate(taken)
+                    ]
+                    chunk_index += len(taken)
+                    return [text for text, _ in taken], metadatas
+
+                async for piece in pieces:
+                    hasher.update(piece.encode())
+                    pending.extend(chunker.feed(piece))
+                    while len(pending) >= batch_size:
+                        yield take(batch_size)
+                pending.extend(chunker.finish())
+                if pending:
+                    yield take(len(pending))
+
+            result = await self._index_batches(
+                db, source, manifest, batches(), hasher.hexdigest, progress=progress
+            )
+            result.unchanged = (
+                previous_hash == hasher.hexdigest()
+                and not (result.chunks_embedded or result.chunks_deleted or result.chunks_updated)
+            )
+            return result
+
+    async def _index_batches(
+        self,
+        db: Session,
+        source: str,
+        manifest: Optional[SourceManifest],
+        batches: AsyncIterator[Tuple[List[str], List[Dict[str, Any]]]],
+        content_hash: Callable[[], str],
+        chunks_total: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None
+    ) -> IndexResult:
+        """
+        Apply a source's chunks batch by batch, then drop stale chunks.
+
+        Each batch is embedded and committed on its own. The manifest is
+        only rewritten at the end, and existing DocumentChunk rows count as
+        indexed, so a run that dies half way resumes without re-embedding
+        what it already committed.
+        """
+        vector_store = get_vector_store()
+        lexical_index = get_lexical_index()
+
+        existing_metadata = {
+            chunk_id: doc_metadata
+            for chunk_id, doc_metadata in db.query(DocumentChunk.chunk_id, DocumentChunk.doc_metadata)
+            .filter(DocumentChunk.source == source)
+        }
+        previous_ids = set(manifest.chunk_hashes) if manifest else set()
+        previous_ids |= set(existing_metadata)  # Also catches rows indexed before manifests existed
+
+        result = IndexResult(source=source)
+        chunk_hashes: Dict[str, str] = {}
+        seen: Dict[tuple, int] = {}
+        if progress:
+            progress(result, chunks_total)
+
+        async for chunks, metadatas in batches:
+            chunk_ids = vector_store.make_chunk_ids(chunks, metadatas, seen)
+            new_positions = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in previous_ids]
+            moved_positions = [
+                i for i, chunk_id in enumerate(chunk_ids)
+                if chunk_id in existing_metadata and existing_metadata[chunk_id] != metadatas[i]
+            ]
+            # Rows committed by a run whose vectors were never flushed
+            lost = vector_store.index.missing([chunk_id for chunk_id in chunk_ids if chunk_id in previous_ids])
+            embed_positions = new_positions + [i for i, chunk_id in enumerate(chunk_ids) if chunk_id in lost]
+
+            # Vector index first: if embedding fails this batch leaves no rows behind
+            if embed_positions:
+                await vector_store.aadd_documents(
+                    [chunks[i] for i in embed_positions],
+                    [metadatas[i] for i in embed_positions],
+                    chunk_ids=[chunk_ids[i] for i in embed_positions]
+                )
+            if moved_positions:
+                # Index writes may be network calls (Qdrant): keep them off the event loop
+                await asyncio.to_thread(
+                    vector_store.index.update_payloads,
+                    [chunk_ids[i] for i in moved_positions],
+                    [{"text": chunks[i], **metadatas[i]} for i in moved_positions]
+                )
+
+            for i in new_positions:
+                db.add(DocumentChunk(
+                    chunk_id=chunk_ids[i],
+                    source=source,
+                    content=chunks[i],
+                    doc_metadata=metadatas[i]
+                ))
+            if moved_positions:
+                moved_rows = db.query(DocumentChunk).filter(
+                    DocumentChunk.chunk_id.in_([chunk_ids[i] for i in moved_positions])
+                ).all()
+                moved_metadata = {chunk_ids[i]: metadatas[i] for i in moved_positions}
+                for row in moved_rows:
+                    row.doc_metadata = moved_metadata[row.chunk_id]
+            db.commit()
+
+            for i in new_positions + moved_positions:
+                lexical_index.add(chunk_ids[i], chunks[i], metadatas[i])
+
+            for chunk_id, chunk in zip(chunk_ids, chunks):
+                chunk_hashes[chunk_id] = hashlib.sha256(chunk.encode()).hexdigest()
+            result.chunk_ids.extend(chunk_ids)
+            result.chunks_embedded += len(embed_positions)
+            result.chunks_updated += len(moved_positions)
+            if progress:
+                progress(result, chunks_total)
+
+        stale_ids = [chunk_id for chunk_id in previous_ids if chunk_id not in chunk_hashes]
+        if stale_ids:
+            await asyncio.to_thread(vector_store.index.delete, stale_ids)
+            db.query(DocumentChunk).filter(
+                DocumentChunk.chunk_id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+
+        # Persist the vectors before the manifest that says they are indexed
+        await vector_store.index.aflush()
+        if manifest is None:
+            db.add(SourceManifest(source=source, content_hash=content_hash(), chunk_hashes=chunk_hashes))
+        else:
+            manifest.content_hash = content_hash()
+            manifest.chunk_hashes = chunk_hashes
+        db.commit()
+
+        # Cached answers may be grounded in the old corpus
+        for chunk_id in stale_ids:
+            lexical_index.remove(chunk_id)
+        if result.chunks_embedded or stale_ids:
+            semantic_cache.clear()
+        result.chunks_deleted = len(stale_ids)
+
+        logger.info(
+            f"Indexed {source}: {result.chunks_total} chunks, {result.chunks_embedded} embedded, "
+            f"{result.chunks_updated} updated, {result.chunks_deleted} removed"
+        )
+        return result
+
+
+# Global instance
+document_indexer = DocumentIndexer()
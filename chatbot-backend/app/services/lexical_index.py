@@ -0,0 +1,167 @@
+from collections import Counter, defaultdict
+from typing import List, Dict, Any, Optional, Sequence
+import heapq
+import logging
+import math
+import re
+import threading
+
+from app.models.database import SessionLocal, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; snake_case identifiers also index their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if "_" in token:
+            tokens.extend(part for part in token.split("_") if part)
+    return tokens
+
+
+def context_key(item: Dict[str, Any]) -> tuple:
+    """Identify a retrieved chunk independently of which retriever found it"""
+    metadata = item.get("metadata", {})
+    if metadata.get("source") is not None and metadata.get("chunk_index") is not None:
+        return (metadata["source"], metadata["chunk_index"])
+    return (None, item.get("text"))
+
+
+def reciprocal_rank_fusion(
+    result_lists: Sequence[List[Dict[str, Any]]],
+    k: int = 60,
+    top_k: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fuse ranked lists with RRF: score = sum over lists of 1 / (k + rank).
+    Results are marked "fused": their scores are rank-based, not similarities.
+    """
+    scores: Dict[tuple, float] = defaultdict(float)
+    items: Dict[tuple, Dict[str, Any]] = {}
+
+    for results in result_lists:
+        for rank, item in enumerate(results, start=1):
+            key = context_key(item)
+            scores[key] += 1.0 / (k + rank)
+            items.setdefault(key, item)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if top_k is not None:
+        ranked = ranked[:top_k]
+    return [{**items[key], "score": scores[key], "fused": True} for key in ranked]
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over document chunks"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._total_length = 0
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, chunk_id: str, text: str, metadata: Dict[str, Any]):
+        """Index (or re-index) one chunk"""
+        term_counts = Counter(tokenize(text))
+        length = sum(term_counts.values())
+
+        with self._lock:
+            self.remove(chunk_id)
+            self._docs[chunk_id] = {"text": text, "metadata": metadata, "length": length}
+            self._total_length += length
+            for term, count in term_counts.items():
+                self._postings[term][chunk_id] = count
+
+    def add_documents(
+        self,
+        chunk_ids: List[str],
+        texts: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """Incrementally index a batch of chunks"""
+        for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+            self.add(chunk_id, text, metadata)
+
+    def remove(self, chunk_id: str):
+        """Drop a chunk from the index if present"""
+        with self._lock:
+            doc = self._docs.pop(chunk_id, None)
+            if doc is None:
+                return
+            self._total_length -= doc["length"]
+            for term in set(tokenize(doc["text"])):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Return the top_k chunks by BM25 score, shaped like vector hits"""
+        terms = set(tokenize(query))
+
+        with self._lock:
+            doc_count = len(self._docs)
+            if not doc_count or not terms:
+                return []
+
+            avg_length = self._total_length / doc_count
+            scores: Dict[str, float] = defaultdict(float)
+
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    length = self._docs[chunk_id]["length"]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [
+                {
+                    "text": self._docs[chunk_id]["text"],
+                    "score": score,
+                    "metadata": self._docs[chunk_id]["metadata"]
+                }
+                for chunk_id, score in best
+            ]
+
+    def load_from_db(self):
+        """Build the index from the document_chunks table"""
+        db = SessionLocal()
+        try:
+            rows = db.query(DocumentChunk).all()
+            with self._lock:
+                for row in rows:
+                    self.add(row.chunk_id, row.content, row.doc_metadata or {"source": row.source})
+                self.loaded = True
+            logger.info(f"Lexical index built with {len(rows)} chunks")
+        finally:
+            db.close()
+
+
+# Global instance - built lazily from the database on first use
+lexical_index = BM25Index()
+
+
+def get_lexical_index() -> BM25Index:
+    """Get the lexical index, loading it from the database the first time"""
+    if not lexical_index.loaded:
+        try:
+            lexical_index.load_from_db()
+        except Exception as e:
+            logger.warning(f"Could not load lexical index: {e}")
+            lexical_index.loaded = True  # Don't retry on every request
+    return lexical_index
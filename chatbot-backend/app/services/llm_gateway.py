@@ -0,0 +1,645 @@
+"""
+Shared LLM client layer: pooled provider clients, timeouts, retries with
+jittered backoff and per-provider request / token budgets
+"""
+from enum import IntEnum
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import google.generativeai as genai
+import httpx
+from google.api_core import exceptions as google_exceptions
+from openai import (
+    OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient,
+    APIConnectionError, APIStatusError, APITimeoutError
+)
+
+from app.config import settings
+from app.services.document_processor import doc_processor
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+GEMINI_TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+GEMINI_RATE_LIMIT_ERRORS = (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)
+
+
+class Priority(IntEnum):
+    """Order in which callers waiting for a provider's budget are served"""
+    CHAT = 0
+    TRANSLATION = 1
+    PERSONALIZATION = 2
+
+
+class LLMQueueTimeout(Exception):
+    """A request waited longer than llm_queue_timeout_seconds for rate budget"""
+
+
+class LLMOutputTruncated(Exception):
+    """A reply stopped at max_tokens instead of finishing (raise_on_length=True)"""
+
+
+class TokenBucket:
+    """`per_minute` units per minute, bursting up to one minute's worth (0 = unlimited)"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.per_minute > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (larger requests wait for a full bucket)"""
+        if self.per_minute <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.per_minute > 0:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount: float):
+        if self.per_minute > 0:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "granted", "notify")
+
+    def __init__(self, priority: int, seq: int, tokens: int, notify: Callable[[], None]):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.granted = False
+        self.notify = notify
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ProviderLimiter:
+    """
+    Request and token budgets of one provider, shared by async and threaded
+    callers.
+
+    Callers that don't fit wait in a priority queue (then first come, first
+    served) rather than failing. A queued caller is only served once
+    everyone ahead of it has been, so a large translation can't be starved
+    by a stream of small requests, and chat never queues behind bulk work.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, tokens_per_minute: float):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.queued = 0
+        self.queue_timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _pump(self) -> float:
+        """
+        Grant queued callers in order while the budgets allow (lock held).
+        Returns how long until the head of the queue fits.
+        """
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        while self._queue:
+            waiter = self._queue[0]
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            waiter.granted = True
+            waiter.notify()
+        return 0.0
+
+    def _enqueue(self, waiter: _Waiter) -> float:
+        with self._lock:
+            heapq.heappush(self._queue, waiter)
+            wait = self._pump()
+            if not waiter.granted:
+                self.queued += 1
+            return wait
+
+    def _poll(self) -> float:
+        with self._lock:
+            return self._pump()
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Leave the queue; False if the caller was granted in the meantime"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queue.remove(waiter)
+            heapq.heapify(self._queue)
+            return True
+
+    def _record_wait(self, started: float):
+        waited = time.monotonic() - started
+        self.granted += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def _timed_out(self, waiter: _Waiter) -> LLMQueueTimeout:
+        self.queue_timeouts += 1
+        return LLMQueueTimeout(
+            f"{self.name}: no rate budget for {waiter.tokens} tokens within "
+            f"{settings.llm_queue_timeout_seconds:g}s"
+        )
+
+    def acquire_sync(self, tokens: int, priority: int):
+        """Block until one request and `tokens` tokens are granted"""
+        event = threading.Event()
+        waiter = _Waiter(priority, next(self._seq), tokens, event.set)
+        started = time.monotonic()
+        deadline = started + settings.llm_queue_timeout_seconds
+        wait = self._enqueue(waiter)
+        while not waiter.granted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and self._withdraw(waiter):
+                raise self._timed_out(waiter)
+            event.wait(min(max(wait, 0.005), max(remaining, 0.005)))
+            wait = self._poll()
+        self._record_wait(started)
+
+    async def acquire(self, tokens: int, priority: int):
+        """Async variant of acquire_sync; a cancelled caller leaves the queue"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = _Waiter(priority, next(self._seq), tokens, notify)
+        started = time.monotonic()
+        deadline = started + settings.llm_queue_timeout_seconds
+        wait = self._enqueue(waiter)
+        try:
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and self._withdraw(waiter):
+                    raise self._timed_out(waiter)
+                try:
+                    await asyncio.wait_for(asyncio.shield(granted), min(max(wait, 0.005), max(remaining, 0.005)))
+                except asyncio.TimeoutError:
+                    pass
+                wait = self._poll()
+        except asyncio.CancelledError:
+            self._withdraw(waiter)
+            raise
+        self._record_wait(started)
+
+    def settle(self, reserved: int, used: Optional[int]):
+        """Return the unused part of a token reservation once usage is known"""
+        if used is None:
+            return
+        with self._lock:
+            if used < reserved:
+                self.tokens.give(reserved - used)
+            else:
+                self.tokens.take(used - reserved)
+
+    def penalize(self):
+        """The provider rate limited us: make every queued caller wait for budget to refill"""
+        with self._lock:
+            self.requests.level = min(self.requests.level, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waiting = len(self._queue)
+        return {
+            "requests_per_minute": self.requests.per_minute,
+            "tokens_per_minute": self.tokens.per_minute,
+            "waiting": waiting,
+            "granted": self.granted,
+            "queued": self.queued,
+            "queue_timeouts": self.queue_timeouts,
+            "avg_wait_seconds": round(self.wait_seconds / self.granted, 3) if self.granted else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
+
+
+class LLMGateway:
+    """
+    The one way the services talk to LLM providers.
+
+    Each provider has a single pooled client (keep-alive HTTP connections
+    for OpenAI, one configured SDK for Gemini) with the configured
+    timeouts. Every call first takes one request and its estimated tokens
+    (prompt + output cap, settled against reported usage) from the
+    provider's ProviderLimiter, and transient failures - 429s, 5xx, timeouts
+    and dropped connections - are retried with full-jitter exponential
+    backoff, honouring Retry-After. Streams are only retried until they
+    start.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._openai: Optional[OpenAI] = None
+        self._async_openai: Optional[AsyncOpenAI] = None
+        self._gemini_models: Dict[str, Any] = {}
+        self._limiters: Dict[str, ProviderLimiter] = {}
+        self.calls: Dict[str, int] = {}
+        self.retries: Dict[str, int] = {}
+        self.rate_limited: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+
+    # --------------------------------------------------
+    # Clients and limits
+
+    @staticmethod
+    def _timeout() -> httpx.Timeout:
+        return httpx.Timeout(settings.llm_timeout_seconds, connect=settings.llm_connect_timeout_seconds)
+
+    @staticmethod
+    def _pool_limits() -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_connections
+        )
+
+    @property
+    def openai(self) -> OpenAI:
+        with self._lock:
+            if self._openai is None:
+                # Retries happen here, so each attempt goes through the limiter
+                self._openai = OpenAI(
+                    api_key=settings.openai_api_key,
+                    timeout=self._timeout(),
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=self._pool_limits(), timeout=self._timeout())
+                )
+            return self._openai
+
+    @property
+    def async_openai(self) -> AsyncOpenAI:
+        with self._lock:
+            if self._async_openai is None:
+                self._async_openai = AsyncOpenAI(
+                    api_key=settings.openai_api_key,
+                    timeout=self._timeout(),
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=self._pool_limits(), timeout=self._timeout())
+                )
+            return self._async_openai
+
+    def gemini_model(self, name: Optional[str] = None):
+        name = name or settings.gemini_model
+        with self._lock:
+            if not self._gemini_models:
+                genai.configure(api_key=settings.gemini_api_key)
+            model = self._gemini_models.get(name)
+            if model is None:
+                model = self._gemini_models[name] = genai.GenerativeModel(name)
+            return model
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        with self._lock:
+            limiter = self._limiters.get(provider)
+            if limiter is None:
+                limiter = self._limiters[provider] = ProviderLimiter(
+                    provider,
+                    getattr(settings, f"{provider}_requests_per_minute"),
+                    getattr(settings, f"{provider}_tokens_per_minute")
+                )
+            return limiter
+
+    def set_limits(
+        self,
+        provider: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None
+    ):
+        """Override a provider's budgets (e.g. for a batch job), keeping its queue"""
+        limiter = self.limiter(provider)
+        with limiter._lock:
+            if requests_per_minute is not None:
+                limiter.requests = TokenBucket(requests_per_minute)
+            if tokens_per_minute is not None:
+                limiter.tokens = TokenBucket(tokens_per_minute)
+
+    async def aclose(self):
+        """Close pooled connections (application shutdown)"""
+        with self._lock:
+            sync_client, async_client = self._openai, self._async_openai
+            self._openai = self._async_openai = None
+        if sync_client is not None:
+            sync_client.close()
+        if async_client is not None:
+            await async_client.close()
+
+    # --------------------------------------------------
+    # Retries
+
+    def _retry_delay(self, provider: str, attempt: int, error: Exception) -> Optional[float]:
+        """Backoff before retrying `error`, or None if it should propagate"""
+        retry_after = None
+        if isinstance(error, (APITimeoutError, APIConnectionError)):
+            pass
+        elif isinstance(error, APIStatusError):
+            if error.status_code not in RETRYABLE_STATUS:
+                return None
+            retry_after = error.response.headers.get("retry-after")
+        elif not isinstance(error, GEMINI_TRANSIENT_ERRORS):
+            return None
+
+        rate_limited = isinstance(error, GEMINI_RATE_LIMIT_ERRORS) or \
+            (isinstance(error, APIStatusError) and error.status_code == 429)
+        if rate_limited:
+            self.rate_limited[provider] = self.rate_limited.get(provider, 0) + 1
+            self.limiter(provider).penalize()
+        if attempt >= settings.llm_max_retries:
+            return None
+
+        self.retries[provider] = self.retries.get(provider, 0) + 1
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), settings.llm_retry_max_seconds)
+        except ValueError:
+            pass  # An HTTP date; fall back to backoff
+        return random.uniform(0, min(settings.llm_retry_max_seconds, settings.llm_retry_base_seconds * 2 ** attempt))
+
+    def _call(self, provider: str, priority: int, tokens: int, request: Callable[[], T]) -> T:
+        limiter = self.limiter(provider)
+        self.calls[provider] = self.calls.get(provider, 0) + 1
+        for attempt in itertools.count():
+            limiter.acquire_sync(tokens, priority)
+            try:
+                return request()
+            except Exception as e:
+                delay = self._retry_delay(provider, attempt, e)
+                if delay is None:
+                    self.failures[provider] = self.failures.get(provider, 0) + 1
+                    raise
+                logger.warning(f"{provider} request failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+
+    async def _acall(self, provider: str, priority: int, tokens: int, request: Callable[[], Awaitable[T]]) -> T:
+        limiter = self.limiter(provider)
+        self.calls[provider] = self.calls.get(provider, 0) + 1
+        for attempt in itertools.count():
+            await limiter.acquire(tokens, priority)
+            try:
+                return await request()
+            except Exception as e:
+                delay = self._retry_delay(provider, attempt, e)
+                if delay is None:
+                    self.failures[provider] = self.failures.get(provider, 0) + 1
+                    raise
+                logger.warning(f"{provider} request failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    # --------------------------------------------------
+    # OpenAI chat completions
+
+    @staticmethod
+    def _chat_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+        return sum(doc_processor.count_tokens(m["content"]) for m in messages) + max_tokens
+
+    @staticmethod
+    def _openai_usage(response) -> Optional[int]:
+        usage = getattr(response, "usage", None)
+        return usage.total_tokens if usage else None
+
+    @staticmethod
+    def _message(response, max_tokens: int, raise_on_length: bool) -> str:
+        choice = response.choices[0]
+        if raise_on_length and choice.finish_reason == "length":
+            raise LLMOutputTruncated(f"Reply reached max_tokens={max_tokens}")
+        return choice.message.content
+
+    def chat(
+        self,
+        messages: List[Dict[str, str]],
+        priority: int,
+        *,
+        max_tokens: int,
+        temperature: float,
+        model: Optional[str] = None,
+        raise_on_length: bool = False,
+        **options
+    ) -> str:
+        """One chat completion; raise_on_length rejects replies cut off at max_tokens"""
+        tokens = self._chat_tokens(messages, max_tokens)
+        response = self._call("openai", priority, tokens, lambda: self.openai.chat.completions.create(
+            model=model or settings.openai_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **options
+        ))
+        self.limiter("openai").settle(tokens, self._openai_usage(response))
+        return self._message(response, max_tokens, raise_on_length)
+
+    async def achat(
+        self,
+        messages: List[Dict[str, str]],
+        priority: int,
+        *,
+        max_tokens: int,
+        temperature: float,
+        model: Optional[str] = None,
+        raise_on_length: bool = False,
+        **options
+    ) -> str:
+        """Async variant of chat; raise_on_length rejects replies cut off at max_tokens"""
+        tokens = self._chat_tokens(messages, max_tokens)
+        response = await self._acall("openai", priority, tokens, lambda: self.async_openai.chat.completions.create(
+            model=model or settings.openai_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **options
+        ))
+        self.limiter("openai").settle(tokens, self._openai_usage(response))
+        return self._message(response, max_tokens, raise_on_length)
+
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        priority: int,
+        *,
+        max_tokens: int,
+        temperature: float,
+        model: Optional[str] = None
+    ) -> Iterator[str]:
+        """Streamed chat completion, yielding content pieces"""
+        stream = self._call("openai", priority, self._chat_tokens(messages, max_tokens),
+                            lambda: self.openai.chat.completions.create(
+                                model=model or settings.openai_model,
+                                messages=messages,
+                                temperature=temperature,
+                                max_tokens=max_tokens,
+                                stream=True
+                            ))
+        for chunk in stream:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                yield text
+
+    async def achat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        priority: int,
+        *,
+        max_tokens: int,
+        temperature: float,
+        model: Optional[str] = None,
+        raise_on_length: bool = False
+    ) -> AsyncIterator[str]:
+        """
+        Async variant of chat_stream. With raise_on_length, a reply cut off
+        at max_tokens raises LLMOutputTruncated after its last piece.
+        """
+        stream = await self._acall("openai", priority, self._chat_tokens(messages, max_tokens),
+                                   lambda: self.async_openai.chat.completions.create(
+                                       model=model or settings.openai_model,
+                                       messages=messages,
+                                       temperature=temperature,
+                                       max_tokens=max_tokens,
+                                       stream=True
+                                   ))
+        finish_reason = None
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            if text:
+                yield text
+        if raise_on_length and finish_reason == "length":
+            raise LLMOutputTruncated(f"Reply reached max_tokens={max_tokens}")
+
+    # --------------------------------------------------
+    # Gemini
+
+    @staticmethod
+    def _gemini_tokens(prompt: str, generation_config: Dict[str, Any]) -> int:
+        return doc_processor.count_tokens(prompt) + generation_config.get("max_output_tokens", 0)
+
+    @staticmethod
+    def _gemini_usage(response) -> Optional[int]:
+        usage = getattr(response, "usage_metadata", None)
+        return usage.total_token_count if usage else None
+
+    def _gemini_request_options(self) -> Dict[str, Any]:
+        # No SDK-level retries: they would bypass the limiter and the timeout
+        return {"timeout": settings.llm_timeout_seconds, "retry": None}
+
+    def gemini_generate(
+        self,
+        prompt: str,
+        priority: int,
+        *,
+        generation_config: Dict[str, Any],
+        model: Optional[str] = None
+    ) -> str:
+        """One Gemini completion; returns its text"""
+        tokens = self._gemini_tokens(prompt, generation_config)
+        response = self._call("gemini", priority, tokens, lambda: self.gemini_model(model).generate_content(
+            prompt,
+            generation_config=generation_config,
+            request_options=self._gemini_request_options()
+        ))
+        self.limiter("gemini").settle(tokens, self._gemini_usage(response))
+        return response.text
+
+    async def agemini_generate(
+        self,
+        prompt: str,
+        priority: int,
+        *,
+        generation_config: Dict[str, Any],
+        model: Optional[str] = None
+    ) -> str:
+        """Async variant of gemini_generate"""
+        tokens = self._gemini_tokens(prompt, generation_config)
+        response = await self._acall("gemini", priority, tokens, lambda: self.gemini_model(model).generate_content_async(
+            prompt,
+            generation_config=generation_config,
+            request_options=self._gemini_request_options()
+        ))
+        self.limiter("gemini").settle(tokens, self._gemini_usage(response))
+        return response.text
+
+    def gemini_stream(
+        self,
+        prompt: str,
+        priority: int,
+        *,
+        generation_config: Dict[str, Any],
+        model: Optional[str] = None
+    ):
+        """Streamed Gemini completion; iterate it for response chunks"""
+        return self._call("gemini", priority, self._gemini_tokens(prompt, generation_config),
+                          lambda: self.gemini_model(model).generate_content(
+                              prompt,
+                              generation_config=generation_config,
+                              stream=True,
+                              request_options=self._gemini_request_options()
+                          ))
+
+    async def agemini_stream(
+        self,
+        prompt: str,
+        priority: int,
+        *,
+        generation_config: Dict[str, Any],
+        model: Optional[str] = None
+    ):
+        """Async variant of gemini_stream; iterate it with `async for`"""
+        return await self._acall("gemini", priority, self._gemini_tokens(prompt, generation_config),
+                                 lambda: self.gemini_model(model).generate_content_async(
+                                     prompt,
+                                     generation_config=generation_config,
+                                     stream=True,
+                                     request_options=self._gemini_request_options()
+                                 ))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {
+            provider: {
+                **limiter.stats(),
+                "calls": self.calls.get(provider, 0),
+                "retries": self.retries.get(provider, 0),
+                "rate_limited": self.rate_limited.get(provider, 0),
+                "failures": self.failures.get(provider, 0),
+            }
+            for provider, limiter in limiters.items()
+        }
+
+
+# Global instance - shared by the RAG agent, translation and personalization
+llm_gateway = LLMGateway()
@@ -1,22 +1,28 @@
 """
 Content personalization service using AI
 """
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, Optional
+import json
 import logging
 import hashlib
 from sqlalchemy.orm import Session
-from app.models.auth import PersonalizedContent, User
+from app.models.auth import PersonalizedContent, SharedPersonalizedContent, User
+from app.models.database import upsert
 from app.config import settings
-from openai import OpenAI
+from app.services.cache_lifecycle import content_cache_lifecycle
+from app.services.llm_gateway import llm_gateway, Priority
 
 logger = logging.getLogger(__name__)
 
 
 class PersonalizationService:
-    """Service for personalizing content based on user background"""
+    """
+    Service for personalizing content based on user background.
     
-    def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key) if not settings.demo_mode else None
+    Rewrites are cached per profile fingerprint rather than per user, so
+    LLM calls scale with the number of distinct profiles. Only users whose
+    prompt includes free-text learning goals get rows of their own.
+    """
     
     def _get_content_hash(self, content: str) -> str:
         """Generate hash of content for caching"""
@@ -42,6 +48,44 @@ class PersonalizationService:
         else:
             return "beginner"
     
+    @staticmethod
+    def _canonical_languages(value: Optional[str]) -> Optional[str]:
+        """Programming languages (JSON list or comma separated) as a sorted, lower-case list"""
+        if not value:
+            return None
+        try:
+            languages = json.loads(value)
+        except ValueError:
+            languages = value.split(",")
+        if isinstance(languages, str):
+            languages = languages.split(",")
+        if not isinstance(languages, list):
+            languages = [languages]
+        canonical = sorted({str(language).strip().lower() for language in languages if str(language).strip()})
+        return ", ".join(canonical) or None
+    
+    def profile(self, user: User) -> Dict[str, Optional[str]]:
+        """The shareable profile fields that enter the prompt, in canonical form"""
+        profile = {
+            "complexity": self._determine_complexity(user),
+            "software_experience": (user.software_experience or "beginner").lower(),
+            "hardware_experience": (user.hardware_experience or "beginner").lower(),
+        }
+        if settings.personalization_profile_mode == "full":
+            profile["programming_languages"] = self._canonical_languages(user.programming_languages)
+            profile["industry"] = " ".join((user.industry_background or "").lower().split()) or None
+        return profile
+    
+    @staticmethod
+    def profile_fingerprint(profile: Dict[str, Optional[str]]) -> str:
+        return hashlib.sha256(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+    
+    def _learning_goals(self, user: User) -> Optional[str]:
+        """Free-text goals make a prompt bespoke; "tiers" mode leaves them out"""
+        if settings.personalization_profile_mode != "full":
+            return None
+        return (user.learning_goals or "").strip() or None
+    
     def personalize_content(
         self,
         content: str,
@@ -51,41 +95,39 @@ class PersonalizationService:
     ) -> Dict[str, Any]:
         """Personalize content based on user profile"""
         
-        # Check cache first
         content_hash = self._get_content_hash(content)
-        complexity = self._determine_complexity(user)
+        content_cache_lifecycle.record_chapter(db, chapter_path, content)
+        profile = self.profile(user)
+        complexity = profile["complexity"]
+        learning_goals = self._learning_goals(user)
         
-        cached = db.query(PersonalizedContent).filter(
-            PersonalizedContent.user_id == user.id,
-            PersonalizedContent.chapter_path == chapter_path,
-            PersonalizedContent.original_content_hash == content_hash,
-            PersonalizedContent.complexity_level == complexity
-        ).first()
-        
-        if cached:
+        # Check cache first
+        cached = self._cached(db, user, profile, learning_goals, chapter_path, content_hash)
+        if cached is not None:
             logger.info(f"Using cached personalized content for user {user.id}, chapter {chapter_path}")
             return {
-                "personalized_content": cached.personalized_content,
+                "personalized_content": cached,
                 "complexity_level": complexity,
                 "cached": True
             }
         
         # Generate personalized content
         if settings.demo_mode:
-            personalized = self._demo_personalize(content, user, complexity)
+            personalized = self._demo_personalize(content, profile)
         else:
-            personalized = self._ai_personalize(content, user, complexity)
+            try:
+                personalized = self._complete(content, profile, learning_goals)
+            except Exception as e:
+                # Serve the fallback, but don't share it with everyone on this profile
+                logger.error(f"AI personalization failed: {e}")
+                return {
+                    "personalized_content": self._demo_personalize(content, profile),
+                    "complexity_level": complexity,
+                    "cached": False
+                }
         
         # Cache the result
-        new_cache = PersonalizedContent(
-            user_id=user.id,
-            chapter_path=chapter_path,
-            original_content_hash=content_hash,
-            personalized_content=personalized,
-            complexity_level=complexity
-        )
-        db.add(new_cache)
-        db.commit()
+        self._remember(db, user, profile, learning_goals, chapter_path, content_hash, personalized)
         
         logger.info(f"Generated personalized content for user {user.id}, chapter {chapter_path}")
         
@@ -95,14 +137,203 @@ class PersonalizationService:
             "cached": False
         }
     
-    def _demo_personalize(self, content: str, user: User, complexity: str) -> str:
+    async def apersonalize_content(
+        self,
+        content: str,
+        user: User,
+        chapter_path: str,
+        db: Session
+    ) -> Dict[str, Any]:
+        """
+        Async variant of personalize_content. The LLM call may wait in the
+        gateway's queue for rate budget, which must not block the event loop.
+        A failed call returns the demo rewrite without caching it.
+        """
+        if settings.demo_mode:
+            return self.personalize_content(content, user, chapter_path, db)
+        
+        content_hash = self._get_content_hash(content)
+        content_cache_lifecycle.record_chapter(db, chapter_path, content)
+        profile = self.profile(user)
+        complexity = profile["complexity"]
+        learning_goals = self._learning_goals(user)
+        
+        cached = self._cached(db, user, profile, learning_goals, chapter_path, content_hash)
+        if cached is not None:
+            logger.info(f"Using cached personalized content for user {user.id}, chapter {chapter_path}")
+            return {
+                "personalized_content": cached,
+                "complexity_level": complexity,
+                "cached": True
+            }
+        
+        try:
+            personalized = await self._acomplete(content, profile, learning_goals)
+        except Exception as e:
+            logger.error(f"AI personalization failed: {e}")
+            return {
+                "personalized_content": self._demo_personalize(content, profile),
+                "complexity_level": complexity,
+                "cached": False
+            }
+        
+        self._remember(db, user, profile, learning_goals, chapter_path, content_hash, personalized)
+        logger.info(f"Generated personalized content for user {user.id}, chapter {chapter_path}")
+        
+        return {
+            "personalized_content": personalized,
+            "complexity_level": complexity,
+            "cached": False
+        }
+    
+    async def apersonalize_stream(
+        self,
+        content: str,
+        user: User,
+        chapter_path: str,
+        db: Session
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of personalize_content, yielding {"type": "token"}
+        events and a final {"type": "done"} event. Cache hits are a single
+        token event; misses forward the provider's tokens as they arrive and
+        are cached once the stream completes. A stream that fails or hits
+        max_tokens part way is followed by {"type": "error", "truncated": True}
+        and a "done" event with "truncated": True, and is not cached.
+        """
+        if settings.demo_mode:
+            result = self.personalize_content(content, user, chapter_path, db)
+            yield {"type": "token", "content": result["personalized_content"]}
+            yield {
+                "type": "done", "complexity_level": result["complexity_level"],
+                "cached": result["cached"], "truncated": False
+            }
+            return
+        
+        content_hash = self._get_content_hash(content)
+        content_cache_lifecycle.record_chapter(db, chapter_path, content)
+        profile = self.profile(user)
+        complexity = profile["complexity"]
+        learning_goals = self._learning_goals(user)
+        
+        cached = self._cached(db, user, profile, learning_goals, chapter_path, content_hash)
+        if cached is not None:
+            logger.info(f"Using cached personalized content for user {user.id}, chapter {chapter_path}")
+            yield {"type": "token", "content": cached}
+            yield {"type": "done", "complexity_level": complexity, "cached": True, "truncated": False}
+            return
+        
+        parts = []
+        try:
+            async for text in llm_gateway.achat_stream(
+                [
+                    {"role": "system", "content": self._system_prompt(profile, learning_goals)},
+                    {"role": "user", "content": f"Personalize this content:\n\n{content}"}
+                ],
+                Priority.PERSONALIZATION,
+                temperature=0.7,
+                max_tokens=2000,
+                raise_on_length=True
+            ):
+                parts.append(text)
+                yield {"type": "token", "content": text}
+        except Exception as e:
+            logger.error(f"AI personalization stream failed: {e}")
+            if parts:
+                yield {"type": "error", "truncated": True, "detail": f"Personalization cut off: {str(e) or type(e).__name__}"}
+            else:
+                yield {"type": "token", "content": self._demo_personalize(content, profile)}
+            yield {"type": "done", "complexity_level": complexity, "cached": False, "truncated": bool(parts)}
+            return  # Nothing is cached for a failed stream
+        
+        self._remember(db, user, profile, learning_goals, chapter_path, content_hash, "".join(parts))
+        logger.info(f"Streamed personalized content for user {user.id}, chapter {chapter_path}")
+        yield {"type": "done", "complexity_level": complexity, "cached": False, "truncated": False}
+    
+    def _cached(
+        self,
+        db: Session,
+        user: User,
+        profile: Dict[str, Optional[str]],
+        learning_goals: Optional[str],
+        chapter_path: str,
+        content_hash: str
+    ) -> Optional[str]:
+        """Cached rewrite: per user for bespoke prompts, per profile otherwise"""
+        model = PersonalizedContent if learning_goals else SharedPersonalizedContent
+        if learning_goals:
+            cached = db.query(PersonalizedContent).filter(
+                PersonalizedContent.user_id == user.id,
+                PersonalizedContent.chapter_path == chapter_path,
+                PersonalizedContent.original_content_hash == content_hash,
+                PersonalizedContent.complexity_level == profile["complexity"]
+            ).first()
+        else:
+            cached = db.query(SharedPersonalizedContent).filter(
+                SharedPersonalizedContent.profile_fingerprint == self.profile_fingerprint(profile),
+                SharedPersonalizedContent.original_content_hash == content_hash
+            ).first()
+        if cached is None:
+            return None
+        content_cache_lifecycle.record_hits(model, [(cached.id,)])
+        return cached.personalized_content
+    
+    def _remember(
+        self,
+        db: Session,
+        user: User,
+        profile: Dict[str, Optional[str]],
+        learning_goals: Optional[str],
+        chapter_path: str,
+        content_hash: str,
+        personalized: str
+    ):
+        """Store a rewrite where _cached looks for it, and commit"""
+        if learning_goals:
+            db.add(PersonalizedContent(
+                user_id=user.id,
+                chapter_path=chapter_path,
+                original_content_hash=content_hash,
+                personalized_content=personalized,
+                complexity_level=profile["complexity"]
+            ))
+        else:
+            self.store_shared(db, profile, chapter_path, content_hash, personalized)
+        db.commit()
+    
+    def store_shared(
+        self,
+        db: Session,
+        profile: Dict[str, Optional[str]],
+        chapter_path: str,
+        content_hash: str,
+        personalized: str
+    ):
+        """Upsert a profile-shared rewrite (the caller commits)"""
+        upsert(
+            db,
+            SharedPersonalizedContent,
+            [{
+                "profile_fingerprint": self.profile_fingerprint(profile),
+                "profile": profile,
+                "chapter_path": chapter_path,
+                "original_content_hash": content_hash,
+                "personalized_content": personalized,
+                "complexity_level": profile["complexity"]
+            }],
+            key_columns=["profile_fingerprint", "original_content_hash"],
+            update_columns=["personalized_content", "chapter_path"]
+        )
+    
+    def _demo_personalize(self, content: str, profile: Dict[str, Optional[str]]) -> str:
         """Demo mode personalization without AI"""
+        complexity = profile["complexity"]
         prefix = f"""
 **🎯 Content Personalized for You**
 
 **Your Profile:**
-- Software Experience: {user.software_experience.title()}
-- Hardware Experience: {user.hardware_experience.title()}
+- Software Experience: {profile["software_experience"].title()}
+- Hardware Experience: {profile["hardware_experience"].title()}
 - Complexity Level: {complexity.title()}
 
 ---
@@ -116,16 +347,20 @@ class PersonalizationService:
         
         return prefix + content
     
-    def _ai_personalize(self, content: str, user: User, complexity: str) -> str:
-        """AI-powered personalization"""
-        try:
-            system_prompt = f"""You are personalizing technical content for a reader with:
-- Software Experience: {user.software_experience}
-- Hardware Experience: {user.hardware_experience}
-- Target Complexity: {complexity}
-- Programming Languages: {user.programming_languages or 'Not specified'}
-- Industry: {user.industry_background or 'Not specified'}
-- Goals: {user.learning_goals or 'Not specified'}
+    def _system_prompt(self, profile: Dict[str, Optional[str]], learning_goals: Optional[str] = None) -> str:
+        reader = [
+            f"- Software Experience: {profile['software_experience']}",
+            f"- Hardware Experience: {profile['hardware_experience']}",
+            f"- Target Complexity: {profile['complexity']}",
+        ]
+        if "programming_languages" in profile:
+            reader.append(f"- Programming Languages: {profile['programming_languages'] or 'Not specified'}")
+            reader.append(f"- Industry: {profile['industry'] or 'Not specified'}")
+            reader.append(f"- Goals: {learning_goals or 'Not specified'}")
+        reader = "\n".join(reader)
+        
+        return f"""You are personalizing technical content for a reader with:
+{reader}
 
 Adjust the content to match their level:
 - For beginners: Add more explanations, examples, and definitions
@@ -133,21 +368,68 @@ Adjust the content to match their level:
 - For advanced/expert: Focus on nuances, best practices, and edge cases
 
 Keep the same structure but adjust language and depth. Maintain markdown formatting."""
-            
-            response = self.client.chat.completions.create(
-                model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Personalize this content:\n\n{content}"}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            return response.choices[0].message.content
-        except Exception as e:
-            logger.error(f"AI personalization failed: {e}")
-            return self._demo_personalize(content, user, complexity)
+    
+    def prerender(
+        self,
+        content: str,
+        profile: Dict[str, Optional[str]],
+        chapter_path: str,
+        db: Session
+    ) -> bool:
+        """
+        Fill the shared cache for one profile ahead of any reader. Returns
+        False if the variant was already cached; raises if the LLM call fails,
+        so no fallback text is stored.
+        """
+        content_hash = self._get_content_hash(content)
+        content_cache_lifecycle.record_chapter(db, chapter_path, content)
+        exists = db.query(SharedPersonalizedContent.id).filter(
+            SharedPersonalizedContent.profile_fingerprint == self.profile_fingerprint(profile),
+            SharedPersonalizedContent.original_content_hash == content_hash
+        ).first()
+        if exists:
+            return False
+        
+        personalized = self._complete(content, profile)
+        self.store_shared(db, profile, chapter_path, content_hash, personalized)
+        db.commit()
+        return True
+    
+    def _complete(
+        self,
+        content: str,
+        profile: Dict[str, Optional[str]],
+        learning_goals: Optional[str] = None
+    ) -> str:
+        """One personalization request; raises on failure or a cut-off reply"""
+        return llm_gateway.chat(
+            [
+                {"role": "system", "content": self._system_prompt(profile, learning_goals)},
+                {"role": "user", "content": f"Personalize this content:\n\n{content}"}
+            ],
+            Priority.PERSONALIZATION,
+            temperature=0.7,
+            max_tokens=2000,
+            raise_on_length=True
+        )
+    
+    async def _acomplete(
+        self,
+        content: str,
+        profile: Dict[str, Optional[str]],
+        learning_goals: Optional[str] = None
+    ) -> str:
+        """Async variant of _complete"""
+        return await llm_gateway.achat(
+            [
+                {"role": "system", "content": self._system_prompt(profile, learning_goals)},
+                {"role": "user", "content": f"Personalize this content:\n\n{content}"}
+            ],
+            Priority.PERSONALIZATION,
+            temperature=0.7,
+            max_tokens=2000,
+            raise_on_length=True
+        )
 
 
 personalization_service = PersonalizationService()
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional
+import threading
+import time
+import logging
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    """A stored answer together with the context it was generated from"""
+    response: str
+    context: List[Dict[str, Any]]
+    created_at: float
+    score: float = 1.0
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on query embeddings.
+
+    A lookup returns the stored answer of the most similar earlier query if
+    its cosine similarity clears the threshold. Entries live in a
+    preallocated float32 matrix so a lookup is one matrix-vector product;
+    eviction is LRU with a per-entry TTL. Every clear() starts a new
+    generation; answers generated during an older one are not stored.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim), unit rows
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()  # slot -> answer, LRU order
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _release(self, slot: int):
+        self._entries.pop(slot, None)
+        self._valid[slot] = False
+        self._free_slots.append(slot)
+
+    def _purge_expired(self, now: float):
+        expired = [
+            slot for slot, entry in self._entries.items()
+            if now - entry.created_at > self.ttl_seconds
+        ]
+        for slot in expired:
+            self._release(slot)
+        self.evictions += len(expired)
+
+    def lookup(self, embedding: List[float]) -> Optional[CachedAnswer]:
+        """Return the cached answer for a semantically equivalent query, if any"""
+        query = self._normalize(embedding)
+
+        with self._lock:
+            self._purge_expired(time.time())
+
+            if not self._entries or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            scores = self._vectors @ query
+            scores[~self._valid] = -np.inf
+            slot = int(np.argmax(scores))
+            score = float(scores[slot])
+
+            if score < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            entry = self._entries[slot]
+            return CachedAnswer(entry.response, entry.context, entry.created_at, score)
+
+    def store(
+        self,
+        embedding: List[float],
+        response: str,
+        context: List[Dict[str, Any]],
+        generation: Optional[int] = None
+    ):
+        """
+        Cache an answer under its query embedding. Pass the generation read
+        before retrieval: if the cache was cleared since, the answer may be
+        based on the old corpus and is dropped. A cache with max_entries 0
+        stores nothing.
+        """
+        if self.max_entries <= 0:
+            return
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                # First entry (or embedding model changed): size the matrix
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._entries.clear()
+                self._valid[:] = False
+                self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+            if not self._free_slots:
+                lru_slot = next(iter(self._entries))
+                self._release(lru_slot)
+                self.evictions += 1
+
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vector
+            self._valid[slot] = True
+            self._entries[slot] = CachedAnswer(response, context, time.time())
+
+    def clear(self):
+        """Drop every entry, e.g. after the indexed corpus changed"""
+        with self._lock:
+            self.generation += 1
+            dropped = len(self._entries)
+            self._entries.clear()
+            self._valid[:] = False
+            self._free_slots = list(range(self.max_entries - 1, -1, -1))
+        if dropped:
+            logger.info(f"Semantic cache invalidated ({dropped} entries)")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Global instance
+semantic_cache = SemanticCache(
+    max_entries=settings.semantic_cache_max_entries,
+    ttl_seconds=settings.semantic_cache_ttl_seconds,
+    threshold=settings.semantic_cache_threshold,
+)
@@ -0,0 +1,47 @@
+from typing import List
+import functools
+import logging
+
+import tiktoken
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+
+
+class ByteEncoding:
+    """
+    UTF-8 bytes as tokens: a network-free stand-in for cl100k_base when it
+    can't be downloaded and embeddings are local anyway. Counts run about
+    four times higher, so chunks and context budgets hold less text.
+    """
+
+    name = "utf-8-bytes"
+
+    def encode(self, text: str) -> List[int]:
+        return list(text.encode())
+
+    def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        return [self.encode(text) for text in texts]
+
+    def decode(self, tokens: List[int]) -> str:
+        # A slice may end inside a character
+        return bytes(tokens).decode(errors="ignore")
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding():
+    """
+    The cl100k_base encoding, loaded on first use rather than at import
+    (tiktoken downloads it the first time). Falls back to ByteEncoding if
+    it can't be loaded and EMBEDDING_PROVIDER is local.
+    """
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        if settings.embedding_provider != "local":
+            raise
+        logger.warning(f"Could not load the {ENCODING_NAME} tokenizer ({e}), counting UTF-8 bytes instead")
+        return ByteEncoding()
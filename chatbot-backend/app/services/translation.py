@@ -1,51 +1,196 @@
 """
 Translation service for Urdu localization
 """
+import asyncio
+import json
 import logging
 import hashlib
-from typing import Dict, Any
+import re
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple, Union
 from sqlalchemy.orm import Session
 from app.models.auth import TranslationCache
+from app.models.database import upsert
 from app.config import settings
-from openai import OpenAI
+from app.services.cache_lifecycle import content_cache_lifecycle
+from app.services.document_processor import doc_processor, split_at_headings, FRONT_MATTER_PATTERN, FENCE_PATTERN
+from app.services.llm_gateway import llm_gateway, Priority
+from app.services.lru_cache import LRUCache
+from app.services.single_flight import SingleFlight
+from app.services.translation_memory import translation_memory, segment_markdown, Segment
 
 logger = logging.getLogger(__name__)
 
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n[ \t]*\n')
+
+SEGMENTS_INSTRUCTIONS = """
+
+The input is a JSON object whose "segments" array holds sentences from one
+section, in order. Reply with a JSON object {"translations": [...]} holding
+exactly one translation per segment, in the same order. Keep inline markdown
+(bold, italics, links, inline code) intact."""
+
+
+def split_into_sections(content: str, max_tokens: int) -> List[str]:
+    """
+    Split markdown into translation units at section boundaries; sections
+    over max_tokens are further split between paragraphs (never inside
+    fenced code). Lossless: the units join back into content.
+    """
+    units = []
+    for section in split_at_headings(content):
+        if doc_processor.count_tokens(section) <= max_tokens:
+            units.append(section)
+            continue
+        
+        # Paragraphs outside fences, each keeping its trailing blank lines
+        paragraphs, start, fence = [], 0, None
+        position = 0
+        for line in section.splitlines(keepends=True):
+            stripped = line.strip()
+            fence_match = FENCE_PATTERN.match(line)
+            if fence:
+                if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                    fence = None
+            elif fence_match:
+                fence = fence_match.group(1)
+            elif not stripped and position > start:
+                paragraphs.append(section[start:position + len(line)])
+                start = position + len(line)
+            position += len(line)
+        if start < len(section):
+            paragraphs.append(section[start:])
+        
+        current, used = "", 0
+        for paragraph in paragraphs:
+            tokens = doc_processor.count_tokens(paragraph)
+            if current and used + tokens > max_tokens:
+                units.append(current)
+                current, used = "", 0
+            current += paragraph
+            used += tokens
+        if current:
+            units.append(current)
+    return units
+
 
 class TranslationService:
-    """Service for translating content to Urdu"""
+    """
+    Service for translating content to Urdu.
+    
+    Translations are cached in two tiers: an in-process LRU of hot documents
+    and sections in front of the translation_cache table. Concurrent misses
+    for the same document share one translation.
+    """
     
     def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key) if not settings.demo_mode else None
+        self.memory_cache = LRUCache(settings.translation_cache_max_entries)
+        self.flights = SingleFlight()
     
     def _get_content_hash(self, content: str) -> str:
         """Generate hash of content for caching"""
         return hashlib.md5(content.encode()).hexdigest()
     
+    def _lookup(
+        self,
+        db: Optional[Session],
+        content_hashes: List[str],
+        source_language: str,
+        target_language: str
+    ) -> Dict[str, str]:
+        """Cached translations by hash: memory first, then one query for the rest"""
+        found = {}
+        for content_hash in content_hashes:
+            translated = self.memory_cache.get((content_hash, source_language, target_language))
+            if translated is not None:
+                found[content_hash] = translated
+        
+        remaining = [h for h in content_hashes if h not in found]
+        if db and remaining:
+            rows = db.query(TranslationCache.source_content_hash, TranslationCache.translated_content).filter(
+                TranslationCache.source_content_hash.in_(remaining),
+                TranslationCache.source_language == source_language,
+                TranslationCache.target_language == target_language
+            ).all()
+            for content_hash, translated in rows:
+                found[content_hash] = translated
+                self.memory_cache.put((content_hash, source_language, target_language), translated)
+        
+        content_cache_lifecycle.record_hits(
+            TranslationCache, [(content_hash, source_language, target_language) for content_hash in found]
+        )
+        return found
+    
+    def _store(
+        self,
+        db: Optional[Session],
+        translations: Dict[str, str],
+        source_language: str,
+        target_language: str,
+        chapter_path: Optional[str] = None
+    ):
+        """
+        Upsert translations into both tiers and commit. Rows another request
+        stored first are overwritten, so racing writers never fail.
+        """
+        for content_hash, translated in translations.items():
+            self.memory_cache.put((content_hash, source_language, target_language), translated)
+        if not db or not translations:
+            return
+        
+        upsert(
+            db,
+            TranslationCache,
+            [
+                {
+                    "source_content_hash": content_hash,
+                    "source_language": source_language,
+                    "target_language": target_language,
+                    "translated_content": translated,
+                    "chapter_path": chapter_path
+                }
+                for content_hash, translated in translations.items()
+            ],
+            key_columns=["source_content_hash", "source_language", "target_language"],
+            update_columns=["translated_content", "chapter_path"]
+        )
+        db.commit()
+    
+    def forget(self, keys: List[Tuple[str, str, str]]):
+        """
+        Drop (content hash, source language, target language) sections from
+        the in-process tier, with any cached document built from them, once
+        their rows have been deleted
+        """
+        keys = set(keys)
+        if not keys:
+            return
+        for key in keys:
+            self.memory_cache.pop(key)
+        for key, value in self.memory_cache.items():
+            if key[0] == "document" and any(
+                (section_hash, key[2], key[3]) in keys for section_hash in value["section_hashes"]
+            ):
+                self.memory_cache.pop(key)
+    
     def translate(
         self,
         content: str,
         target_language: str = "ur",
         source_language: str = "en",
-        db: Session = None
+        db: Session = None,
+        chapter_path: Optional[str] = None
     ) -> Dict[str, Any]:
         """Translate content to target language"""
         
-        # Check cache first if db provided
-        if db:
-            content_hash = self._get_content_hash(content)
-            cached = db.query(TranslationCache).filter(
-                TranslationCache.source_content_hash == content_hash,
-                TranslationCache.source_language == source_language,
-                TranslationCache.target_language == target_language
-            ).first()
-            
-            if cached:
-                logger.info(f"Using cached translation {source_language}->{target_language}")
-                return {
-                    "translated_content": cached.translated_content,
-                    "cached": True
-                }
+        self._record_chapter(db, chapter_path, content)
+        content_hash = self._get_content_hash(content)
+        cached = self._lookup(db, [content_hash], source_language, target_language)
+        if cached:
+            logger.info(f"Using cached translation {source_language}->{target_language}")
+            return {
+                "translated_content": cached[content_hash],
+                "cached": True
+            }
         
         # Translate
         if settings.demo_mode:
@@ -53,16 +198,7 @@ class TranslationService:
         else:
             translated = self._ai_translate(content, target_language, source_language)
         
-        # Cache if db provided
-        if db:
-            new_cache = TranslationCache(
-                source_content_hash=content_hash,
-                source_language=source_language,
-                target_language=target_language,
-                translated_content=translated
-            )
-            db.add(new_cache)
-            db.commit()
+        self._store(db, {content_hash: translated}, source_language, target_language, chapter_path)
         
         logger.info(f"Translated content {source_language}->{target_language}")
         
@@ -71,6 +207,337 @@ class TranslationService:
             "cached": False
         }
     
+    async def atranslate(
+        self,
+        content: str,
+        target_language: str = "ur",
+        source_language: str = "en",
+        db: Session = None,
+        chapter_path: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Translate content section by section.
+        
+        Content is split at markdown headings (and long sections between
+        paragraphs). Each unit is cached under its own hash, so an edited
+        chapter only re-translates the edited sections, and the uncached
+        ones are translated concurrently, TRANSLATION_CONCURRENCY at a time.
+        Within an uncached section, sentences found in the translation
+        memory are reused and only the rest are sent to the LLM. Hot
+        documents are answered from memory, and concurrent requests for the
+        same document share one translation. Requests for a chapter pass its
+        chapter_path, so the cache lifecycle can tell its current version.
+        """
+        if settings.demo_mode:
+            return self.translate(content, target_language, source_language, db, chapter_path)
+        
+        self._record_chapter(db, chapter_path, content)
+        # Whole documents are cached in memory too, skipping the section split
+        document_key = ("document", self._get_content_hash(content), source_language, target_language)
+        document = self._cached_document(document_key)
+        if document is not None:
+            return {
+                "translated_content": document["translated_content"],
+                "cached": True,
+                "sections": document["sections"],
+                "sections_cached": document["sections"],
+                "sections_failed": 0
+            }
+        
+        return await self.flights.do(
+            document_key,
+            lambda: self._atranslate(content, target_language, source_language, db, document_key, chapter_path)
+        )
+    
+    @staticmethod
+    def _record_chapter(db: Optional[Session], chapter_path: Optional[str], content: str):
+        """Tell the cache lifecycle which version of a chapter was requested"""
+        if db and chapter_path:
+            content_cache_lifecycle.record_chapter(db, chapter_path, content)
+    
+    def _cached_document(self, document_key: tuple) -> Optional[Dict[str, Any]]:
+        """Whole-document memory hit, counted as a hit on each of its sections"""
+        document = self.memory_cache.get(document_key)
+        if document is not None:
+            _, _, source_language, target_language = document_key
+            content_cache_lifecycle.record_hits(
+                TranslationCache,
+                [(section_hash, source_language, target_language) for section_hash in document["section_hashes"]]
+            )
+        return document
+    
+    def _split(self, content: str) -> Tuple[List[str], Dict[str, str]]:
+        """Translation units in order, and the translatable ones by hash"""
+        units = split_into_sections(content, settings.translation_section_tokens)
+        # Front matter and blank units pass through as they are
+        translatable = {
+            self._get_content_hash(unit.strip()): unit.strip()
+            for unit in units
+            if unit.strip() and not FRONT_MATTER_PATTERN.match(unit)
+        }
+        return units, translatable
+    
+    def _assemble(self, units: List[str], translations: Dict[str, str]) -> str:
+        """
+        Reassemble in order, keeping each unit's surrounding whitespace;
+        sections without a translation stay in the source language
+        """
+        parts = []
+        for unit in units:
+            core = unit.strip()
+            if not core or FRONT_MATTER_PATTERN.match(unit):
+                parts.append(unit)
+                continue
+            leading = unit[:len(unit) - len(unit.lstrip())]
+            trailing = unit[len(unit.rstrip()):]
+            translated = translations.get(self._get_content_hash(core), core)
+            parts.append(f"{leading}{translated.strip()}{trailing}")
+        return "".join(parts)
+    
+    async def _atranslate(
+        self,
+        content: str,
+        target_language: str,
+        source_language: str,
+        db: Optional[Session],
+        document_key: tuple,
+        chapter_path: Optional[str]
+    ) -> Dict[str, Any]:
+        """Section lookup, translation of the misses and reassembly for one document"""
+        units, translatable = self._split(content)
+        translations = self._lookup(db, list(translatable), source_language, target_language)
+        cached_count = len(translations)
+        
+        semaphore = asyncio.Semaphore(settings.translation_concurrency)
+        new_translations: Dict[str, str] = {}
+        
+        async def translate_unit(unit_hash: str, text: str):
+            async with semaphore:
+                try:
+                    new_translations[unit_hash] = await self._translate_section(
+                        text, target_language, source_language, db
+                    )
+                except Exception as e:
+                    logger.error(f"AI translation of a section failed: {e}")
+        
+        missing = [(h, text) for h, text in translatable.items() if h not in translations]
+        await asyncio.gather(*(translate_unit(h, text) for h, text in missing))
+        if missing:
+            self._store(db, new_translations, source_language, target_language, chapter_path)
+        translations.update(new_translations)
+        
+        failed = len(missing) - len(new_translations)
+        logger.info(
+            f"Translated content {source_language}->{target_language}: {len(translatable)} sections, "
+            f"{cached_count} cached, {len(new_translations)} translated, {failed} failed"
+        )
+        
+        translated_content = self._assemble(units, translations)
+        if not failed:
+            self.memory_cache.put(document_key, {
+                "translated_content": translated_content,
+                "sections": len(translatable),
+                "section_hashes": list(translatable)
+            })
+        
+        return {
+            "translated_content": translated_content,
+            "cached": not missing,
+            "sections": len(translatable),
+            "sections_cached": cached_count,
+            "sections_failed": failed
+        }
+    
+    async def _translate_section(
+        self,
+        text: str,
+        target_language: str,
+        source_language: str,
+        db: Optional[Session]
+    ) -> str:
+        """
+        Translate one section through the translation memory. Falls back to
+        translating the section as a whole when there is no memory or the
+        sentence translations can't be aligned back to the source.
+        """
+        if not (db and settings.translation_memory_enabled):
+            return await self._ai_translate_async(text, target_language, source_language)
+        
+        parts, found, missing = self._recall(text, target_language, source_language, db)
+        if missing:
+            try:
+                translated = await self._ai_translate_segments(missing, target_language, source_language)
+            except ValueError as e:
+                logger.warning(f"Could not align sentence translations, translating the whole section: {e}")
+                return await self._ai_translate_async(text, target_language, source_language)
+            new_pairs = dict(zip(missing, translated))
+            translation_memory.store(db, new_pairs, source_language, target_language)
+            found.update(new_pairs)
+        
+        return "".join(found[part] if isinstance(part, Segment) else part for part in parts)
+    
+    def _recall(
+        self,
+        text: str,
+        target_language: str,
+        source_language: str,
+        db: Session
+    ) -> Tuple[List[Union[str, Segment]], Dict[str, str], List[str]]:
+        """Segment a section and look its sentences up: (parts, found, missing)"""
+        parts = segment_markdown(text)
+        segments = list(dict.fromkeys(part for part in parts if isinstance(part, Segment)))
+        found = translation_memory.lookup(db, segments, source_language, target_language) if segments else {}
+        missing = [segment for segment in segments if segment not in found]
+        logger.debug(f"Section has {len(segments) - len(missing)}/{len(segments)} sentences in memory")
+        return parts, found, missing
+    
+    async def atranslate_stream(
+        self,
+        content: str,
+        target_language: str = "ur",
+        source_language: str = "en",
+        db: Session = None,
+        chapter_path: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of atranslate, yielding {"type": "token"} events
+        in document order and a final {"type": "done"} event with the same
+        counters. Cached sections are emitted at once. Uncached ones are
+        translated concurrently: the first streams the provider's tokens as
+        they arrive, later ones are buffered until their turn. Sections
+        the translation memory can't fully cover are streamed whole, since
+        sentence replies come back as JSON. A section that fails or hits
+        translation_max_tokens after part of it was sent is followed by an
+        {"type": "error", "truncated": True} event, and "done" then carries
+        "truncated": True.
+        """
+        if settings.demo_mode:
+            result = self.translate(content, target_language, source_language, db, chapter_path)
+            yield {"type": "token", "content": result["translated_content"]}
+            yield {"type": "done", "cached": result["cached"], "truncated": False}
+            return
+        
+        self._record_chapter(db, chapter_path, content)
+        document_key = ("document", self._get_content_hash(content), source_language, target_language)
+        document = self._cached_document(document_key)
+        if document is not None:
+            yield {"type": "token", "content": document["translated_content"]}
+            yield {
+                "type": "done", "cached": True, "sections": document["sections"],
+                "sections_cached": document["sections"], "sections_failed": 0, "truncated": False
+            }
+            return
+        
+        units, translatable = self._split(content)
+        translations = self._lookup(db, list(translatable), source_language, target_language)
+        cached_count = len(translations)
+        
+        semaphore = asyncio.Semaphore(settings.translation_concurrency)
+        new_translations: Dict[str, str] = {}
+        queues: Dict[str, asyncio.Queue] = {}
+        cut_off: Dict[str, str] = {}  # Sections that failed after streaming part of their text
+        
+        async def translate_unit(unit_hash: str, text: str, queue: asyncio.Queue):
+            pieces = []
+            try:
+                async with semaphore:
+                    recalled = None
+                    if db and settings.translation_memory_enabled:
+                        parts, found, missing = self._recall(text, target_language, source_language, db)
+                        if not missing:
+                            recalled = "".join(found[part] if isinstance(part, Segment) else part for part in parts)
+                    if recalled is not None:
+                        pieces.append(recalled)
+                        queue.put_nowait(recalled)
+                    else:
+                        async for piece in self._ai_translate_stream(text, target_language, source_language):
+                            pieces.append(piece)
+                            queue.put_nowait(piece)
+                new_translations[unit_hash] = "".join(pieces)
+            except Exception as e:
+                logger.error(f"AI translation of a section failed: {e}")
+                if pieces:
+                    cut_off[unit_hash] = str(e) or type(e).__name__
+            finally:
+                queue.put_nowait(None)
+        
+        tasks = []
+        for unit_hash, text in translatable.items():
+            if unit_hash not in translations:
+                queues[unit_hash] = asyncio.Queue()
+                tasks.append(asyncio.create_task(translate_unit(unit_hash, text, queues[unit_hash])))
+        
+        try:
+            for unit in units:
+                core = unit.strip()
+                if not core or FRONT_MATTER_PATTERN.match(unit):
+                    yield {"type": "token", "content": unit}
+                    continue
+                leading = unit[:len(unit) - len(unit.lstrip())]
+                trailing = unit[len(unit.rstrip()):]
+                if leading:
+                    yield {"type": "token", "content": leading}
+                
+                unit_hash = self._get_content_hash(core)
+                queue = queues.pop(unit_hash, None)
+                if queue is None:
+                    # Cached, or a repeat of a section streamed earlier
+                    translated = translations.get(unit_hash) or new_translations.get(unit_hash, core)
+                    yield {"type": "token", "content": translated.strip()}
+                else:
+                    # Strip the section like atranslate does: skip leading
+                    # whitespace and hold trailing whitespace back until
+                    # more text follows
+                    started, held = False, ""
+                    while (piece := await queue.get()) is not None:
+                        if not started:
+                            piece = piece.lstrip()
+                            started = bool(piece)
+                        body = piece.rstrip()
+                        if body:
+                            yield {"type": "token", "content": held + body}
+                            held = ""
+                        held += piece[len(body):]
+                    if not started:
+                        yield {"type": "token", "content": core}  # Failed before any output
+                    elif unit_hash in cut_off:
+                        yield {"type": "error", "truncated": True, "detail": f"Section translation cut off: {cut_off[unit_hash]}"}
+                
+                if trailing:
+                    yield {"type": "token", "content": trailing}
+        finally:
+            # A client that disconnects stops the translations it no longer reads
+            for task in tasks:
+                task.cancel()
+        
+        missing_count = len(tasks)
+        if missing_count:
+            self._store(db, new_translations, source_language, target_language, chapter_path)
+        failed = missing_count - len(new_translations)
+        if not failed:
+            translations.update(new_translations)
+            self.memory_cache.put(
+                document_key,
+                {
+                    "translated_content": self._assemble(units, translations),
+                    "sections": len(translatable),
+                    "section_hashes": list(translatable)
+                }
+            )
+        
+        logger.info(
+            f"Streamed translation {source_language}->{target_language}: {len(translatable)} sections, "
+            f"{cached_count} cached, {len(new_translations)} translated, {failed} failed"
+        )
+        yield {
+            "type": "done",
+            "cached": not missing_count,
+            "sections": len(translatable),
+            "sections_cached": cached_count,
+            "sections_failed": failed,
+            "truncated": bool(cut_off)
+        }
+    
     def _demo_translate(self, content: str, target_language: str) -> str:
         """Demo translation without AI"""
         if target_language == "ur":
@@ -89,17 +556,15 @@ class TranslationService:
 """
         return content
     
-    def _ai_translate(self, content: str, target_language: str, source_language: str) -> str:
-        """AI-powered translation"""
-        try:
-            lang_names = {
-                "ur": "Urdu (اردو)",
-                "en": "English"
-            }
-            
-            target_lang_name = lang_names.get(target_language, target_language)
-            
-            system_prompt = f"""You are a professional translator specializing in technical documentation.
+    def _system_prompt(self, target_language: str, source_language: str) -> str:
+        lang_names = {
+            "ur": "Urdu (اردو)",
+            "en": "English"
+        }
+        
+        target_lang_name = lang_names.get(target_language, target_language)
+        
+        return f"""You are a professional translator specializing in technical documentation.
 Translate the following technical content from {source_language} to {target_lang_name}.
 
 Requirements:
@@ -114,21 +579,75 @@ For Urdu translations:
 - Use proper Urdu technical vocabulary
 - Right-to-left formatting will be handled by the frontend
 - Keep proper nouns and product names in English"""
-            
-            response = self.client.chat.completions.create(
-                model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
+    
+    def _ai_translate(self, content: str, target_language: str, source_language: str) -> str:
+        """AI-powered translation"""
+        try:
+            return llm_gateway.chat(
+                [
+                    {"role": "system", "content": self._system_prompt(target_language, source_language)},
                     {"role": "user", "content": f"Translate this content:\n\n{content}"}
                 ],
+                Priority.TRANSLATION,
                 temperature=0.3,  # Lower temperature for more accurate translations
                 max_tokens=2000
             )
-            
-            return response.choices[0].message.content
         except Exception as e:
             logger.error(f"AI translation failed: {e}")
             return self._demo_translate(content, target_language)
+    
+    async def _ai_translate_async(self, content: str, target_language: str, source_language: str) -> str:
+        """Translate one section; raises on failure or a cut-off reply so it isn't cached"""
+        return await llm_gateway.achat(
+            [
+                {"role": "system", "content": self._system_prompt(target_language, source_language)},
+                {"role": "user", "content": f"Translate this content:\n\n{content}"}
+            ],
+            Priority.TRANSLATION,
+            temperature=0.3,  # Lower temperature for more accurate translations
+            max_tokens=settings.translation_max_tokens,
+            raise_on_length=True
+        )
+    
+    async def _ai_translate_stream(self, content: str, target_language: str, source_language: str) -> AsyncIterator[str]:
+        """Translate one section, yielding the provider's tokens; raises on failure or a cut-off reply"""
+        async for text in llm_gateway.achat_stream(
+            [
+                {"role": "system", "content": self._system_prompt(target_language, source_language)},
+                {"role": "user", "content": f"Translate this content:\n\n{content}"}
+            ],
+            Priority.TRANSLATION,
+            temperature=0.3,
+            max_tokens=settings.translation_max_tokens,
+            raise_on_length=True
+        ):
+            yield text
+    
+    async def _ai_translate_segments(
+        self,
+        segments: List[str],
+        target_language: str,
+        source_language: str
+    ) -> List[str]:
+        """Translate sentences in one request; raises ValueError if the reply doesn't line up"""
+        reply = await llm_gateway.achat(
+            [
+                {"role": "system", "content": self._system_prompt(target_language, source_language) + SEGMENTS_INSTRUCTIONS},
+                {"role": "user", "content": json.dumps({"segments": segments}, ensure_ascii=False)}
+            ],
+            Priority.TRANSLATION,
+            temperature=0.3,
+            max_tokens=settings.translation_max_tokens,
+            response_format={"type": "json_object"}
+        )
+        try:
+            translations = json.loads(reply)["translations"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            raise ValueError(f"unreadable reply ({e})")
+        if not isinstance(translations, list) or len(translations) != len(segments) \
+                or not all(isinstance(t, str) for t in translations):
+            raise ValueError(f"expected {len(segments)} translations")
+        return [t.strip() for t in translations]
 
 
 translation_service = TranslationService()
@@ -0,0 +1,278 @@
+"""
+Sentence-level translation memory: aligned source/target segments reused
+across chapters, with exact, normalized and fuzzy lookup
+"""
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import List, Dict, Optional, Tuple, Union
+import hashlib
+import logging
+import re
+import threading
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.auth import TranslationMemoryEntry
+from app.models.database import upsert
+from app.services.document_processor import FENCE_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Markdown line prefixes kept out of segments: headings, bullets (with task
+# boxes), numbered items and blockquotes
+LINE_PREFIX_PATTERN = re.compile(r'^(\s*(?:#{1,6}\s+|[-*+]\s+(?:\[[ xX]\]\s+)?|\d+[.)]\s+|>\s*)*)')
+SENTENCE_BREAK_PATTERN = re.compile(r'(?<=[.!?])(\s+)(?=[A-Z"\'*`\[(])')
+TABLE_CELL_PATTERN = re.compile(r'(\|)')
+LETTER_PATTERN = re.compile(r'[^\W\d_]')
+WORD_PATTERN = re.compile(r'\w+')
+VERBATIM_PATTERN = re.compile(r'`[^`]*`|\d+(?:\.\d+)*|https?://\S+')
+MARKUP_PATTERN = re.compile(r'[*_~`\[\]()<>#|]')
+QUESTION_EXCLAMATION_PATTERN = re.compile(r'[?!]')
+
+
+class Segment(str):
+    """A translatable piece of a segmented section (plain str parts are kept verbatim)"""
+
+
+def segment_markdown(text: str) -> List[Union[str, Segment]]:
+    """
+    Split a markdown section into sentences to translate and the markup
+    around them. Fenced code, blank lines, JSX/import lines and pieces with
+    no letters stay verbatim. Joining the parts gives back the text.
+    """
+    parts: List[Union[str, Segment]] = []
+    fence = None
+
+    def add_prose(prose: str):
+        for piece in SENTENCE_BREAK_PATTERN.split(prose):
+            if LETTER_PATTERN.search(piece) and piece.strip():
+                leading = piece[:len(piece) - len(piece.lstrip())]
+                trailing = piece[len(piece.rstrip()):]
+                parts.extend([leading, Segment(piece.strip()), trailing])
+            else:
+                parts.append(piece)
+
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if fence:
+            parts.append(line)
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                fence = None
+            continue
+        fence_match = FENCE_PATTERN.match(line)
+        if fence_match:
+            fence = fence_match.group(1)
+            parts.append(line)
+        elif not stripped or stripped.startswith(("<", "import ", "export ")):
+            parts.append(line)
+        elif stripped.startswith("|"):
+            for cell in TABLE_CELL_PATTERN.split(line):
+                if cell == "|":
+                    parts.append(cell)
+                else:
+                    add_prose(cell)
+        else:
+            prefix = LINE_PREFIX_PATTERN.match(line).group(1)
+            body = line[len(prefix):]
+            parts.append(prefix)
+            add_prose(body)
+
+    return [part for part in parts if part]
+
+
+def _exact_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _normalized_text(text: str) -> str:
+    """Case-, punctuation- and markup-insensitive form of a segment"""
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _signature(text: str) -> Tuple[Tuple[str, ...], str, str]:
+    """
+    Numbers, code spans, URLs, markup and question/exclamation marks a
+    reused translation must share with its source ("It is enabled." is not
+    "It is enabled?")
+    """
+    return (
+        tuple(VERBATIM_PATTERN.findall(text)),
+        "".join(MARKUP_PATTERN.findall(text)),
+        "".join(QUESTION_EXCLAMATION_PATTERN.findall(text))
+    )
+
+
+class FuzzyIndex:
+    """In-memory word index over one language pair's memory, for near-miss lookup"""
+
+    def __init__(self):
+        self._entries: List[Tuple[str, tuple, str]] = []  # (normalized source, signature, target)
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._ids: Dict[str, int] = {}  # Whitespace-collapsed source -> entry, as keyed in the table
+
+    def add(self, source_text: str, target_text: str):
+        """Index a segment, replacing the entry of a source stored before"""
+        normalized = _normalized_text(source_text)
+        entry = (normalized, _signature(source_text), target_text)
+        key = _exact_text(source_text)
+        entry_id = self._ids.get(key)
+        if entry_id is not None:
+            self._entries[entry_id] = entry  # Same words, so the postings still hold
+            return
+        entry_id = self._ids[key] = len(self._entries)
+        self._entries.append(entry)
+        for word in set(normalized.split()):
+            self._postings[word].append(entry_id)
+
+    def search(self, text: str, threshold: float, candidates: int = 10) -> Optional[str]:
+        """Best stored translation whose source is at least `threshold` similar"""
+        normalized = _normalized_text(text)
+        signature = _signature(text)
+        overlap = Counter(
+            entry_id
+            for word in set(normalized.split())
+            for entry_id in self._postings.get(word, ())
+        )
+
+        best, best_ratio = None, threshold
+        for entry_id, _ in overlap.most_common(candidates):
+            source, source_signature, target = self._entries[entry_id]
+            if source_signature != signature:
+                continue
+            matcher = SequenceMatcher(None, normalized, source, autojunk=False)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = target, ratio
+        return best
+
+
+class TranslationMemory:
+    """
+    Segment-level translation memory backed by the translation_memory table.
+
+    Lookup tries, in order: the exact segment (whitespace-insensitive), its
+    normalized form (case and punctuation ignored) and, below a
+    fuzzy_threshold of 1.0, a fuzzy match of at least that similarity. The
+    last two only reuse a translation whose source has the same numbers,
+    code spans, URLs, markup and question or exclamation marks. A fuzzy match is copied as is, so a one-word
+    difference ("enabled" / "disabled") can flip its meaning; fuzzy reuse
+    is off by default. Only segments missing from every tier need the LLM.
+    """
+
+    def __init__(self, fuzzy_threshold: float = 1.0):
+        self.fuzzy_threshold = fuzzy_threshold
+        self._fuzzy: Dict[Tuple[str, str], FuzzyIndex] = {}
+        self._lock = threading.Lock()
+
+    def _fuzzy_index(self, db: Session, source_language: str, target_language: str) -> FuzzyIndex:
+        """Word index for a language pair, built from the table on first use"""
+        key = (source_language, target_language)
+        with self._lock:
+            index = self._fuzzy.get(key)
+            if index is None:
+                index = FuzzyIndex()
+                rows = db.query(TranslationMemoryEntry.source_text, TranslationMemoryEntry.target_text).filter(
+                    TranslationMemoryEntry.source_language == source_language,
+                    TranslationMemoryEntry.target_language == target_language
+                ).all()
+                for source_text, target_text in rows:
+                    index.add(source_text, target_text)
+                self._fuzzy[key] = index
+                logger.info(f"Translation memory index built with {len(rows)} {source_language}->{target_language} segments")
+            return index
+
+    def lookup(
+        self,
+        db: Session,
+        segments: List[str],
+        source_language: str,
+        target_language: str
+    ) -> Dict[str, str]:
+        """Map each segment found in memory to its translation"""
+        found: Dict[str, str] = {}
+        pair = (
+            TranslationMemoryEntry.source_language == source_language,
+            TranslationMemoryEntry.target_language == target_language
+        )
+
+        by_hash = {_hash(_exact_text(s)): s for s in segments}
+        rows = db.query(TranslationMemoryEntry.source_hash, TranslationMemoryEntry.target_text).filter(
+            *pair, TranslationMemoryEntry.source_hash.in_(list(by_hash))
+        ).all()
+        for source_hash, target_text in rows:
+            found[by_hash[source_hash]] = target_text
+
+        by_normalized: Dict[str, List[str]] = defaultdict(list)
+        for segment in segments:
+            if segment not in found:
+                by_normalized[_hash(_normalized_text(segment))].append(segment)
+        if by_normalized:
+            rows = db.query(
+                TranslationMemoryEntry.normalized_hash, TranslationMemoryEntry.source_text, TranslationMemoryEntry.target_text
+            ).filter(
+                *pair, TranslationMemoryEntry.normalized_hash.in_(list(by_normalized))
+            ).all()
+            for normalized_hash, source_text, target_text in rows:
+                for segment in by_normalized[normalized_hash]:
+                    if segment not in found and _signature(segment) == _signature(source_text):
+                        found[segment] = target_text
+
+        remaining = [s for s in segments if s not in found]
+        if remaining and self.fuzzy_threshold < 1.0:
+            index = self._fuzzy_index(db, source_language, target_language)
+            for segment in remaining:
+                match = index.search(segment, self.fuzzy_threshold)
+                if match is not None:
+                    found[segment] = match
+
+        return found
+
+    def store(
+        self,
+        db: Session,
+        pairs: Dict[str, str],
+        source_language: str,
+        target_language: str
+    ):
+        """
+        Upsert aligned segments and commit. Concurrent sections storing the
+        same sentence overwrite each other instead of adding duplicates; the
+        fuzzy index only sees rows once they are committed.
+        """
+        rows = {}
+        for source_text, target_text in pairs.items():
+            source_hash = _hash(_exact_text(source_text))
+            rows[source_hash] = {
+                "source_language": source_language,
+                "target_language": target_language,
+                "source_hash": source_hash,
+                "normalized_hash": _hash(_normalized_text(source_text)),
+                "source_text": source_text,
+                "target_text": target_text
+            }
+        if not rows:
+            return
+        upsert(
+            db,
+            TranslationMemoryEntry,
+            list(rows.values()),
+            key_columns=["source_hash", "source_language", "target_language"],
+            update_columns=["target_text"]
+        )
+        db.commit()
+
+        index = self._fuzzy.get((source_language, target_language))
+        if index is not None:
+            with self._lock:
+                for row in rows.values():
+                    index.add(row["source_text"], row["target_text"])
+
+
+translation_memory = TranslationMemory(fuzzy_threshold=settings.translation_memory_fuzzy_threshold)
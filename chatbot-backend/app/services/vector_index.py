@@ -0,0 +1,385 @@
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, NamedTuple, Optional, Set
+import asyncio
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, PointIdsList, OverwritePayloadOperation, SetPayload
+)
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ScoredHit(NamedTuple):
+    """Search hit with the same attributes as Qdrant's ScoredPoint"""
+    id: str
+    score: float
+    payload: Dict[str, Any]
+
+
+class VectorIndex(ABC):
+    """Stores vectors with payloads and answers nearest-neighbour queries"""
+
+    @abstractmethod
+    def upsert(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        payloads: List[Dict[str, Any]]
+    ):
+        """Insert or overwrite vectors by id"""
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        """Remove vectors by id"""
+
+    @abstractmethod
+    def update_payloads(self, ids: List[str], payloads: List[Dict[str, Any]]):
+        """Replace payloads of existing vectors without touching the vectors"""
+
+    @abstractmethod
+    def search(
+        self,
+        vector: List[float],
+        top_k: int = 5,
+        filter_conditions: Any = None
+    ) -> List[ScoredHit]:
+        """Top-k hits by cosine similarity"""
+
+    def missing(self, ids: List[str]) -> Set[str]:
+        """Those ids the index does not hold, where it can tell cheaply"""
+        return set()
+
+    def flush(self):
+        """Persist pending writes (indexes that write through need not)"""
+
+    async def aflush(self):
+        """Async flush; disk writes run in a worker thread"""
+        await asyncio.to_thread(self.flush)
+
+    async def aupsert(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        payloads: List[Dict[str, Any]]
+    ):
+        """Async upsert; local indexes are fast enough to write inline"""
+        self.upsert(ids, vectors, payloads)
+
+    async def asearch(
+        self,
+        vector: List[float],
+        top_k: int = 5,
+        filter_conditions: Any = None
+    ) -> List[ScoredHit]:
+        """Async search; local indexes are fast enough to answer inline"""
+        return self.search(vector, top_k, filter_conditions)
+
+
+class QdrantVectorIndex(VectorIndex):
+    """Remote Qdrant collection"""
+
+    def __init__(self, url: str, api_key: Optional[str], collection_name: str, dimensions: int):
+        self.collection_name = collection_name
+        self.dimensions = dimensions
+        self.client = QdrantClient(
+            url=url,
+            api_key=api_key,
+            prefer_grpc=False,  # Use HTTP for Qdrant Cloud
+        )
+        # Async client backs the request path so searches don't block the event loop
+        self.async_client = AsyncQdrantClient(
+            url=url,
+            api_key=api_key,
+            prefer_grpc=False,
+        )
+        self._ensure_collection()
+
+    def _ensure_collection(self):
+        """Ensure collection exists, create if not"""
+        collections = self.client.get_collections().collections
+        collection_names = [col.name for col in collections]
+
+        if self.collection_name not in collection_names:
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                vectors_config=VectorParams(
+                    size=self.dimensions,
+                    distance=Distance.COSINE
+                )
+            )
+            logger.info(f"Created collection: {self.collection_name}")
+
+    def upsert(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        payloads: List[Dict[str, Any]]
+    ):
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                PointStruct(id=chunk_id, vector=vector, payload=payload)
+                for chunk_id, vector, payload in zip(ids, vectors, payloads)
+            ]
+        )
+
+    async def aupsert(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        payloads: List[Dict[str, Any]]
+    ):
+        await self.async_client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                PointStruct(id=chunk_id, vector=vector, payload=payload)
+                for chunk_id, vector, payload in zip(ids, vectors, payloads)
+            ]
+        )
+
+    def delete(self, ids: List[str]):
+        if ids:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=PointIdsList(points=ids)
+            )
+
+    def update_payloads(self, ids: List[str], payloads: List[Dict[str, Any]]):
+        if ids:
+            self.client.batch_update_points(
+                collection_name=self.collection_name,
+                update_operations=[
+                    OverwritePayloadOperation(
+                        overwrite_payload=SetPayload(payload=payload, points=[chunk_id])
+                    )
+                    for chunk_id, payload in zip(ids, payloads)
+                ]
+            )
+
+    def search(
+        self,
+        vector: List[float],
+        top_k: int = 5,
+        filter_conditions: Any = None
+    ) -> List[ScoredHit]:
+        return self.client.search(
+            collection_name=self.collection_name,
+            query_vector=vector,
+            limit=top_k,
+            query_filter=filter_conditions
+        )
+
+    async def asearch(
+        self,
+        vector: List[float],
+        top_k: int = 5,
+        filter_conditions: Any = None
+    ) -> List[ScoredHit]:
+        return await self.async_client.search(
+            collection_name=self.collection_name,
+            query_vector=vector,
+            limit=top_k,
+            query_filter=filter_conditions
+        )
+
+
+class NumpyVectorIndex(VectorIndex):
+    """
+    Exact cosine search over a contiguous float32 matrix.
+
+    Rows are L2-normalised on insert so a query is one matrix-vector
+    product followed by argpartition. With a path, the matrix is saved as
+    ``<path>.npy`` (memory-mapped on load, so startup does not read it)
+    and ids/payloads as ``<path>.json``; without one it is purely in-memory.
+    Writes only change memory; flush() saves both files, so an ingestion
+    run pays for one rewrite rather than one per batch. Payload filters are
+    a Qdrant feature and are ignored here.
+    """
+
+    def __init__(self, dimensions: int, path: Optional[str] = None):
+        self.dimensions = dimensions
+        self.path = path
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._matrix = np.zeros((0, dimensions), dtype=np.float32)
+        self._writable = True
+        self._dirty = False
+        self._save_lock = threading.Lock()
+
+        if path and os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json"):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # --------------------------------------------------
+
+    def _load(self):
+        matrix = np.load(f"{self.path}.npy", mmap_mode="r")
+        with open(f"{self.path}.json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if matrix.shape[1] != self.dimensions or matrix.shape[0] != len(data["ids"]):
+            logger.warning(f"Ignoring vector index at {self.path}: shape {matrix.shape} does not match")
+            return
+
+        self._matrix = matrix
+        self._writable = False  # Copied into memory on first write
+        self._ids = data["ids"]
+        self._payloads = data["payloads"]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        logger.info(f"Loaded {len(self._ids)} vectors from {self.path}.npy")
+
+    def flush(self):
+        """Save the index if it changed since the last flush"""
+        if not self.path:
+            return
+        with self._save_lock:
+            # Snapshot under the index lock, write without it so searches go on
+            with self._lock:
+                if not self._dirty:
+                    return
+                matrix = self._matrix[:len(self._ids)].copy()
+                data = {"ids": list(self._ids), "payloads": list(self._payloads)}
+                self._dirty = False
+            try:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+
+                # Write to temp files, then swap, so a crash never leaves a torn index
+                np.save(f"{self.path}.tmp.npy", matrix)
+                with open(f"{self.path}.tmp.json", "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(f"{self.path}.tmp.npy", f"{self.path}.npy")
+                os.replace(f"{self.path}.tmp.json", f"{self.path}.json")
+            except BaseException:
+                with self._lock:
+                    self._dirty = True
+                raise
+            logger.info(f"Saved {len(data['ids'])} vectors to {self.path}.npy")
+
+    def _ensure_capacity(self, rows: int):
+        if not self._writable:
+            self._matrix = np.array(self._matrix, dtype=np.float32)
+            self._writable = True
+        if rows > self._matrix.shape[0]:
+            capacity = max(rows, 2 * self._matrix.shape[0], 64)
+            grown = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+            self._matrix = grown
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    # --------------------------------------------------
+
+    def upsert(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        payloads: List[Dict[str, Any]]
+    ):
+        """Insert or overwrite vectors by id"""
+        if not ids:
+            return
+        normalized = self._normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._lock:
+            self._ensure_capacity(len(self._ids) + len(ids))
+            for chunk_id, vector, payload in zip(ids, normalized, payloads):
+                row = self._rows.get(chunk_id)
+                if row is None:
+                    row = len(self._ids)
+                    self._rows[chunk_id] = row
+                    self._ids.append(chunk_id)
+                    self._payloads.append(payload)
+                else:
+                    self._payloads[row] = payload
+                self._matrix[row] = vector
+            self._dirty = True
+
+    def delete(self, ids: List[str]):
+        """Remove vectors by id (swap-with-last keeps the matrix contiguous)"""
+        with self._lock:
+            targets = [chunk_id for chunk_id in ids if chunk_id in self._rows]
+            if not targets:
+                return
+            self._ensure_capacity(len(self._ids))
+            for chunk_id in targets:
+                row = self._rows.pop(chunk_id)
+                last = len(self._ids) - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._ids[row] = self._ids[last]
+                    self._payloads[row] = self._payloads[last]
+                    self._rows[self._ids[row]] = row
+                self._ids.pop()
+                self._payloads.pop()
+            self._dirty = True
+
+    def update_payloads(self, ids: List[str], payloads: List[Dict[str, Any]]):
+        with self._lock:
+            changed = False
+            for chunk_id, payload in zip(ids, payloads):
+                row = self._rows.get(chunk_id)
+                if row is not None:
+                    self._payloads[row] = payload
+                    changed = True
+            if changed:
+                self._dirty = True
+
+    def missing(self, ids: List[str]) -> Set[str]:
+        """Ids not in the index, e.g. written after the last flush before a crash"""
+        with self._lock:
+            return {chunk_id for chunk_id in ids if chunk_id not in self._rows}
+
+    def search(
+        self,
+        vector: List[float],
+        top_k: int = 5,
+        filter_conditions: Any = None
+    ) -> List[ScoredHit]:
+        """Exact top-k by cosine similarity"""
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+
+        with self._lock:
+            count = len(self._ids)
+            if not count or top_k <= 0:
+                return []
+
+            scores = self._matrix[:count] @ query
+            k = min(top_k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            return [
+                ScoredHit(self._ids[row], float(scores[row]), self._payloads[row])
+                for row in top
+            ]
+
+
+def create_vector_index() -> VectorIndex:
+    """Build the vector index selected by settings.vector_backend"""
+    if settings.vector_backend == "numpy":
+        return NumpyVectorIndex(settings.embedding_dimensions, settings.vector_index_path)
+    if settings.vector_backend == "memory":
+        return NumpyVectorIndex(settings.embedding_dimensions)
+    return QdrantVectorIndex(
+        url=settings.qdrant_url,
+        api_key=settings.qdrant_api_key,
+        collection_name=settings.qdrant_collection_name,
+        dimensions=settings.embedding_dimensions,
+    )
@@ -1,90 +1,210 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from openai import OpenAI
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import asyncio
 import hashlib
 import logging
+import time
 from app.config import settings
+from app.services.embedding_cache import EmbeddingCache, query_embedding_cache, document_embedding_store
+from app.services.embeddings import EmbeddingProvider, create_embedding_provider
+from app.services.vector_index import VectorIndex, create_vector_index
 
 logger = logging.getLogger(__name__)
 
 
 class VectorStore:
-    """Handle vector storage and retrieval with Qdrant"""
+    """Embed, store and retrieve document chunks through pluggable backends"""
     
-    def __init__(self):
-        self.client = QdrantClient(
-            url=settings.qdrant_url,
-            api_key=settings.qdrant_api_key,
-            prefer_grpc=False,  # Use HTTP for Qdrant Cloud
+    def __init__(
+        self,
+        embedder: Optional[EmbeddingProvider] = None,
+        index: Optional[VectorIndex] = None,
+        embedding_store: Optional[EmbeddingCache] = None
+    ):
+        self.embedder = embedder if embedder is not None else create_embedding_provider()
+        self.index = index if index is not None else create_vector_index()
+        self.embedding_store = embedding_store if embedding_store is not None else document_embedding_store
+        # Vectors are only interchangeable for the same model and size
+        self.embedding_store_model = f"{self.embedder.model_name}:{self.embedder.dimensions}"
+        logger.info(
+            f"Vector store ready: {type(self.embedder).__name__} ({self.embedder.model_name}) "
+            f"+ {type(self.index).__name__}"
         )
-        self.collection_name = settings.qdrant_collection_name
-        self.openai_client = OpenAI(api_key=settings.openai_api_key)
-        self._ensure_collection()
     
-    def _ensure_collection(self):
-        """Ensure collection exists, create if not"""
-        collections = self.client.get_collections().collections
-        collection_names = [col.name for col in collections]
-        
-        if self.collection_name not in collection_names:
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=VectorParams(
-                    size=1536,  # text-embedding-3-small dimension
-                    distance=Distance.COSINE
-                )
+    def generate_embedding(self, text: str) -> List[float]:
+        """Generate embedding for one text"""
+        return self.embedder.embed([text])[0]
+    
+    async def agenerate_embedding(self, text: str) -> List[float]:
+        """Generate embedding for one text (async)"""
+        return (await self.embedder.aembed([text]))[0]
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed chunk texts, only calling the provider for ones not in the embedding store"""
+        vectors = self.embedding_store.get_many(self.embedding_store_model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = self.embedder.embed([texts[i] for i in missing])
+            self.embedding_store.put_many(self.embedding_store_model, [texts[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+        return vectors
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed chunk texts (async), only calling the provider for ones not in the store"""
+        # The store is a SQLite file: keep its reads and writes off the event loop
+        vectors = await asyncio.to_thread(self.embedding_store.get_many, self.embedding_store_model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = await self.embedder.aembed([texts[i] for i in missing])
+            await asyncio.to_thread(
+                self.embedding_store.put_many, self.embedding_store_model, [texts[i] for i in missing], fresh
             )
-            logger.info(f"Created collection: {self.collection_name}")
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+        return vectors
     
-    def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding using OpenAI"""
-        response = self.openai_client.embeddings.create(
-            model=settings.embedding_model,
-            input=text
-        )
-        return response.data[0].embedding
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a search query, served from the query embedding cache when possible"""
+        embedding = query_embedding_cache.get(self.embedder.model_name, query)
+        if embedding is None:
+            embedding = self.generate_embedding(query)
+            query_embedding_cache.put(self.embedder.model_name, query, embedding)
+        return embedding
+    
+    async def aembed_query(self, query: str) -> List[float]:
+        """Embed a search query (async), served from the cache when possible"""
+        embedding = query_embedding_cache.get(self.embedder.model_name, query)
+        if embedding is None:
+            embedding = await self.agenerate_embedding(query)
+            query_embedding_cache.put(self.embedder.model_name, query, embedding)
+        return embedding
+    
+    @staticmethod
+    def make_chunk_ids(
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        seen: Optional[Dict[tuple, int]] = None
+    ) -> List[str]:
+        """
+        Deterministic chunk ids derived from source and chunk content, so an
+        unchanged chunk keeps its id across re-indexing runs. Repeated
+        identical chunks within a source are told apart by occurrence; pass
+        the same `seen` dict when a source is processed in several batches.
+        """
+        chunk_ids = []
+        if seen is None:
+            seen = {}
+        
+        for text, metadata in zip(texts, metadatas):
+            source = metadata.get('source', '')
+            text_hash = hashlib.sha256(text.encode()).hexdigest()
+            occurrence = seen.get((source, text_hash), 0)
+            seen[(source, text_hash)] = occurrence + 1
+            chunk_ids.append(hashlib.md5(
+                f"{source}\0{text_hash}\0{occurrence}".encode()
+            ).hexdigest())
+        
+        return chunk_ids
+    
+    def _prepare_points(
+        self,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        chunk_ids: Optional[List[str]] = None
+    ) -> tuple[List[str], List[Dict[str, Any]]]:
+        """Chunk ids (unless given) and payloads for a document's chunks"""
+        if chunk_ids is None:
+            chunk_ids = self.make_chunk_ids(texts, metadatas)
+        payloads = [
+            {
+                "text": text,
+                **metadata
+            }
+            for text, metadata in zip(texts, metadatas)
+        ]
+        return chunk_ids, payloads
     
     def add_documents(
         self, 
         texts: List[str], 
-        metadatas: List[Dict[str, Any]]
+        metadatas: List[Dict[str, Any]],
+        chunk_ids: Optional[List[str]] = None
     ) -> List[str]:
-        """Add documents to vector store"""
-        points = []
-        chunk_ids = []
+        """Add documents to vector store (sequential batches, for scripts)"""
+        started = time.perf_counter()
+        chunk_ids, payloads = self._prepare_points(texts, metadatas, chunk_ids)
+        batch_size = settings.embedding_batch_size
+        upsert_size = settings.upsert_batch_size
         
-        for idx, (text, metadata) in enumerate(zip(texts, metadatas)):
-            # Generate unique ID
-            chunk_id = hashlib.md5(
-                f"{metadata.get('source', '')}_{idx}_{text[:100]}".encode()
-            ).hexdigest()
-            
-            # Generate embedding
-            embedding = self.generate_embedding(text)
-            
-            # Create point
-            point = PointStruct(
-                id=chunk_id,
-                vector=embedding,
-                payload={
-                    "text": text,
-                    **metadata
-                }
+        embeddings = []
+        for lo in range(0, len(texts), batch_size):
+            embeddings.extend(self.embed_documents(texts[lo:lo + batch_size]))
+        
+        for lo in range(0, len(chunk_ids), upsert_size):
+            self.index.upsert(
+                chunk_ids[lo:lo + upsert_size],
+                embeddings[lo:lo + upsert_size],
+                payloads[lo:lo + upsert_size]
             )
-            
-            points.append(point)
-            chunk_ids.append(chunk_id)
         
-        # Upload to Qdrant
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=points
-        )
+        self._log_throughput(len(chunk_ids), started)
+        return chunk_ids
+    
+    async def aadd_documents(
+        self, 
+        texts: List[str], 
+        metadatas: List[Dict[str, Any]],
+        chunk_ids: Optional[List[str]] = None
+    ) -> List[str]:
+        """
+        Add documents to vector store as a pipeline: texts are embedded in
+        batches, several batches in flight at once, while finished vectors
+        are upserted in fixed-size batches.
+        """
+        started = time.perf_counter()
+        chunk_ids, payloads = self._prepare_points(texts, metadatas, chunk_ids)
+        batch_size = settings.embedding_batch_size
+        upsert_size = settings.upsert_batch_size
+        batch_starts = list(range(0, len(texts), batch_size))
+        
+        semaphore = asyncio.Semaphore(settings.embedding_concurrency)
+        embedded: asyncio.Queue = asyncio.Queue()
+        
+        async def embed_batch(lo: int):
+            async with semaphore:
+                vectors = await self.aembed_documents(texts[lo:lo + batch_size])
+            await embedded.put((lo, vectors))
+        
+        async def upsert_ready():
+            ids, vectors, points = [], [], []
+            for _ in batch_starts:
+                lo, batch_vectors = await embedded.get()
+                ids.extend(chunk_ids[lo:lo + len(batch_vectors)])
+                vectors.extend(batch_vectors)
+                points.extend(payloads[lo:lo + len(batch_vectors)])
+                while len(ids) >= upsert_size:
+                    await self.index.aupsert(ids[:upsert_size], vectors[:upsert_size], points[:upsert_size])
+                    del ids[:upsert_size], vectors[:upsert_size], points[:upsert_size]
+            if ids:
+                await self.index.aupsert(ids, vectors, points)
+        
+        tasks = [asyncio.create_task(embed_batch(lo)) for lo in batch_starts]
+        tasks.append(asyncio.create_task(upsert_ready()))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
         
-        logger.info(f"Added {len(points)} documents to vector store")
+        self._log_throughput(len(chunk_ids), started)
         return chunk_ids
     
+    def _log_throughput(self, count: int, started: float):
+        elapsed = time.perf_counter() - started
+        rate = count / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Added {count} documents to vector store in {elapsed:.2f}s ({rate:.1f} chunks/s)")
+    
     def search(
         self, 
         query: str, 
@@ -92,15 +212,26 @@ class VectorStore:
         filter_conditions: Dict[str, Any] = None
     ) -> List[Dict[str, Any]]:
         """Search for similar documents"""
-        query_embedding = self.generate_embedding(query)
-        
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_embedding,
-            limit=top_k,
-            query_filter=filter_conditions
-        )
+        query_embedding = self.embed_query(query)
+        results = self.index.search(query_embedding, top_k, filter_conditions)
+        return self._format_hits(results)
+    
+    async def asearch(
+        self, 
+        query: str, 
+        top_k: int = 5,
+        filter_conditions: Dict[str, Any] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Search for similar documents (async), reusing query_embedding if given"""
+        if query_embedding is None:
+            query_embedding = await self.aembed_query(query)
         
+        results = await self.index.asearch(query_embedding, top_k, filter_conditions)
+        return self._format_hits(results)
+    
+    def _format_hits(self, results) -> List[Dict[str, Any]]:
+        """Convert index hits into context dicts"""
         return [
             {
                 "text": hit.payload.get("text", ""),
@@ -114,7 +245,7 @@ class VectorStore:
         ]
 
 
-# Global instance - initialized lazily to avoid connection errors at startup
+# Global instance - warmed up at startup, created on first use if that failed
 _vector_store_instance = None
 
 def get_vector_store() -> VectorStore:
@@ -124,5 +255,10 @@ def get_vector_store() -> VectorStore:
         _vector_store_instance = VectorStore()
     return _vector_store_instance
 
+async def aflush_vector_store():
+    """Persist pending vector index writes, if the store was ever created"""
+    if _vector_store_instance is not None:
+        await _vector_store_instance.index.aflush()
+
 # For backward compatibility
 vector_store = None  # Will be initialized on first use
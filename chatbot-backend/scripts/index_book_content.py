@@ -1,10 +1,19 @@
 """
 Script to index book content into the RAG system.
 Run this after deployment to populate the vector store.
+
+Files are sent concurrently over one pooled HTTP client, with retries
+and exponential backoff for transient failures (429, 5xx, network).
+
+Usage:
+    python scripts/index_book_content.py [--concurrency 4] [--retries 3]
 """
 
 import os
 import sys
+import time
+import random
+import argparse
 from pathlib import Path
 import asyncio
 import httpx
@@ -14,59 +23,138 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_URL = os.getenv("API_URL", "http://localhost:8000")
+DOCS_DIR = Path(__file__).parent.parent.parent / "book" / "docs"
+DOC_PATTERNS = ("*.md", "*.mdx")
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def find_doc_files(docs_dir: Path) -> list[Path]:
+    """Find all markdown / MDX files in the docs directory"""
+    files = set()
+    for pattern in DOC_PATTERNS:
+        files.update(docs_dir.rglob(pattern))
+    return sorted(files)
+
+
+def backoff_delay(attempt: int, response: httpx.Response = None) -> float:
+    """Exponential backoff with full jitter, honouring Retry-After"""
+    if response is not None and response.headers.get("retry-after", "").isdigit():
+        return float(response.headers["retry-after"])
+    return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
 
 
-async def index_markdown_file(file_path: Path, api_url: str, docs_dir: Path):
-    """Index a single markdown file"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
+async def index_markdown_file(
+    client: httpx.AsyncClient,
+    file_path: Path,
+    docs_dir: Path,
+    retries: int
+) -> dict:
+    """Index a single markdown file, retrying transient failures"""
+    content = await asyncio.to_thread(file_path.read_text, encoding="utf-8")
+
     # Extract relative path as source
-    source = str(file_path.relative_to(docs_dir))
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{api_url}/api/v1/index",
-            json={
-                "content": content,
-                "source": source,
-                "metadata": {
-                    "file_type": "markdown",
-                    "file_name": file_path.name
-                }
-            },
-            timeout=60.0
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            print(f"✓ Indexed {source}: {data['chunks_indexed']} chunks")
-        else:
-            print(f"✗ Failed to index {source}: {response.text}")
+    source = file_path.relative_to(docs_dir).as_posix()
+    payload = {
+        "content": content,
+        "source": source,
+        "metadata": {
+            "file_type": "mdx" if file_path.suffix == ".mdx" else "markdown",
+            "file_name": file_path.name
+        }
+    }
+
+    started = time.perf_counter()
+    error = None
+    for attempt in range(retries + 1):
+        response = None
+        try:
+            response = await client.post("/api/v1/index", json=payload)
+            if response.status_code == 200:
+                data = response.json()
+                latency = time.perf_counter() - started
+                print(f"✓ Indexed {source}: {data['chunks_indexed']} chunks ({latency:.2f}s)")
+                return {"source": source, "ok": True, "chunks": data["chunks_indexed"], "latency": latency}
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            if response.status_code not in RETRYABLE_STATUS:
+                break
+        except httpx.TransportError as e:
+            error = f"{type(e).__name__}: {e}"
+
+        if attempt < retries:
+            delay = backoff_delay(attempt, response)
+            print(f"… Retrying {source} in {delay:.1f}s ({error})")
+            await asyncio.sleep(delay)
+
+    latency = time.perf_counter() - started
+    print(f"✗ Failed to index {source}: {error}")
+    return {"source": source, "ok": False, "chunks": 0, "latency": latency}
+
 
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
 
-async def index_all_docs():
+
+async def index_all_docs(api_url: str, docs_dir: Path, concurrency: int, retries: int, timeout: float):
     """Index all markdown files in the docs directory"""
-    docs_dir = Path(__file__).parent.parent.parent / "book" / "docs"
-    
     if not docs_dir.exists():
         print(f"Error: docs directory not found at {docs_dir}")
-        return
-    
-    # Find all markdown files
-    md_files = list(docs_dir.rglob("*.md"))
-    
-    print(f"Found {len(md_files)} markdown files to index...")
-    print(f"Using API: {API_URL}")
+        return 1
+
+    doc_files = find_doc_files(docs_dir)
+
+    print(f"Found {len(doc_files)} markdown files to index...")
+    print(f"Using API: {api_url} (concurrency {concurrency})")
     print("-" * 60)
-    
-    # Index each file
-    for md_file in md_files:
-        await index_markdown_file(md_file, API_URL, docs_dir)
-    
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def bounded(file_path: Path) -> dict:
+        async with semaphore:
+            return await index_markdown_file(client, file_path, docs_dir, retries)
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(base_url=api_url, timeout=timeout, limits=limits) as client:
+        results = await asyncio.gather(*(bounded(f) for f in doc_files))
+    elapsed = time.perf_counter() - started
+
+    succeeded = [r for r in results if r["ok"]]
+    failed = [r for r in results if not r["ok"]]
+    chunks = sum(r["chunks"] for r in succeeded)
+    latencies = [r["latency"] for r in succeeded]
+
     print("-" * 60)
-    print(f"✓ Indexing complete! Indexed {len(md_files)} files.")
+    print(f"✓ Indexing complete! Indexed {len(succeeded)}/{len(doc_files)} files, {chunks} chunks in {elapsed:.2f}s")
+    if elapsed > 0:
+        print(f"  Throughput: {len(doc_files) / elapsed:.2f} files/s, {chunks / elapsed:.1f} chunks/s")
+    if latencies:
+        print(
+            f"  Latency per file: p50 {percentile(latencies, 50):.2f}s, "
+            f"p95 {percentile(latencies, 95):.2f}s, max {max(latencies):.2f}s"
+        )
+    if failed:
+        print(f"✗ {len(failed)} files failed: {', '.join(r['source'] for r in failed)}")
+        return 1
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Index book docs into the RAG backend")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--docs-dir", type=Path, default=DOCS_DIR)
+    parser.add_argument("--concurrency", type=int, default=4, help="Files indexed at once")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per file on transient errors")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(index_all_docs())
+    args = parse_args()
+    sys.exit(asyncio.run(index_all_docs(
+        args.api_url, args.docs_dir, args.concurrency, args.retries, args.timeout
+    )))
@@ -0,0 +1,206 @@
+"""
+Script to pre-render translated and personalized chapter variants.
+Run this after a book release so no reader waits on a cold LLM call.
+
+Cache rows are keyed on the content a request sends, so variants are
+built from exactly what the book's clients send: every <ChapterControls>
+in book/docs, with its chapterPath and the template literal passed as
+originalContent. Each goes through the translation service for each target
+language and through the personalization service for each standard profile
+(one per complexity tier, or the full software x hardware experience grid),
+filling the same cache tables the API reads. Chapters without chapter
+controls never send a request and are skipped.
+
+Variants run --concurrency at a time, and --rpm replaces the LLM
+gateway's requests-per-minute budget for OpenAI, which every request of
+the run passes (the token budget still applies). Finished variants are
+appended to --state-file, so an interrupted run picks up where it stopped.
+
+Usage:
+    python scripts/prerender_variants.py [--languages ur] [--concurrency 4] [--rpm 60]
+"""
+
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import re
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Load environment variables before the app reads its settings
+load_dotenv()
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.config import settings  # noqa: E402
+from app.models.auth import User  # noqa: E402
+from app.models.database import init_db, SessionLocal  # noqa: E402
+from app.services.llm_gateway import llm_gateway  # noqa: E402
+from app.services.personalization import personalization_service  # noqa: E402
+from app.services.translation import translation_service  # noqa: E402
+
+DOCS_DIR = Path(__file__).parent.parent.parent / "book" / "docs"
+DOC_PATTERNS = ("*.md", "*.mdx")
+EXPERIENCE_LEVELS = ("beginner", "intermediate", "advanced", "expert")
+
+CONTROLS_PATTERN = re.compile(r'<ChapterControls\b(.*?)/>', re.DOTALL)
+CHAPTER_PATH_PATTERN = re.compile(r'chapterPath\s*=\s*(?:"([^"]*)"|\{\s*["\']([^"\']*)["\']\s*\})')
+CONTENT_PATTERN = re.compile(r'originalContent\s*=\s*\{\s*(?:(\w+)|`((?:[^`\\]|\\.)*)`)\s*\}', re.DOTALL)
+TEMPLATE_ESCAPES = {"n": "\n", "t": "\t", "r": "\r"}
+
+
+def find_doc_files(docs_dir: Path) -> list[Path]:
+    """Find all markdown / MDX files in the docs directory"""
+    files = set()
+    for pattern in DOC_PATTERNS:
+        files.update(docs_dir.rglob(pattern))
+    return sorted(files)
+
+
+def unescape_template(literal: str) -> str:
+    """The string a JS template literal without ${} placeholders evaluates to"""
+    return re.sub(r'\\(.)', lambda m: TEMPLATE_ESCAPES.get(m.group(1), m.group(1)), literal, flags=re.DOTALL)
+
+
+def client_requests(file_path: Path) -> list[tuple[str, str]]:
+    """(chapter_path, content) of every <ChapterControls> in a doc, as its requests send them"""
+    source = file_path.read_text(encoding="utf-8")
+    requests = []
+    for controls in CONTROLS_PATTERN.finditer(source):
+        path_match = CHAPTER_PATH_PATTERN.search(controls.group(1))
+        content_match = CONTENT_PATTERN.search(controls.group(1))
+        if not (path_match and content_match):
+            print(f"⚠ {file_path.name}: skipping <ChapterControls> without a literal chapterPath and originalContent")
+            continue
+        chapter_path = path_match.group(1) if path_match.group(1) is not None else path_match.group(2)
+        literal = content_match.group(2)
+        if literal is None:
+            variable = re.search(
+                rf'\b(?:const|let|var)\s+{content_match.group(1)}\s*=\s*`((?:[^`\\]|\\.)*)`', source, re.DOTALL
+            )
+            literal = variable.group(1) if variable else None
+        if literal is None or re.search(r'(?<!\\)\$\{', literal):
+            print(f"⚠ {file_path.name}: skipping {chapter_path}, originalContent is not a static template literal")
+            continue
+        requests.append((chapter_path, unescape_template(literal)))
+    return requests
+
+
+def standard_profiles(grid: bool) -> list[dict]:
+    """Canonical profiles of readers who gave no languages, industry or goals"""
+    if grid:
+        pairs = [(software, hardware) for software in EXPERIENCE_LEVELS for hardware in EXPERIENCE_LEVELS]
+    else:
+        pairs = [(level, level) for level in EXPERIENCE_LEVELS]
+    profiles = {}
+    for software, hardware in pairs:
+        user = User(software_experience=software, hardware_experience=hardware, content_complexity="auto")
+        profile = personalization_service.profile(user)
+        profiles[personalization_service.profile_fingerprint(profile)] = profile
+    return list(profiles.values())
+
+
+def load_state(state_file: Path) -> set[str]:
+    if not state_file.exists():
+        return set()
+    with state_file.open(encoding="utf-8") as f:
+        return {json.loads(line)["key"] for line in f if line.strip()}
+
+
+async def prerender(args: argparse.Namespace) -> int:
+    if settings.demo_mode:
+        print("Error: DEMO_MODE is on, variants would only be demo placeholders")
+        return 1
+    if not args.docs_dir.exists():
+        print(f"Error: docs directory not found at {args.docs_dir}")
+        return 1
+
+    init_db()
+    llm_gateway.set_limits("openai", requests_per_minute=args.rpm)
+
+    if args.fresh and args.state_file.exists():
+        args.state_file.unlink()
+    done = load_state(args.state_file)
+    profiles = standard_profiles(args.experience_grid) if not args.skip_personalization else []
+
+    # One variant per (chapter, language) and (chapter, profile)
+    variants = []
+    for chapter_path, content in (
+        request for file_path in find_doc_files(args.docs_dir) for request in client_requests(file_path)
+    ):
+        content_hash = hashlib.md5(content.encode()).hexdigest()
+        for language in args.languages:
+            variants.append((f"translate:{language}:{chapter_path}:{content_hash}", chapter_path, content, language))
+        for profile in profiles:
+            fingerprint = personalization_service.profile_fingerprint(profile)
+            variants.append((f"personalize:{fingerprint}:{chapter_path}:{content_hash}", chapter_path, content, profile))
+
+    pending = [variant for variant in variants if variant[0] not in done]
+    print(f"{len(variants)} variants ({len(variants) - len(pending)} already done), {len(pending)} to render")
+    print(f"Concurrency {args.concurrency}, {args.rpm:g} requests/minute")
+    print("-" * 60)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    state_lock = asyncio.Lock()
+    failed = []
+
+    async def render(key: str, chapter_path: str, content: str, target) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                if isinstance(target, str):
+                    label = f"{target} {chapter_path}"
+                    result = await translation_service.atranslate(
+                        content, target_language=target, db=db, chapter_path=chapter_path
+                    )
+                    if result["sections_failed"]:
+                        raise RuntimeError(f"{result['sections_failed']} of {result['sections']} sections failed")
+                    detail = f"{result['sections_cached']}/{result['sections']} sections cached"
+                else:
+                    label = f"{target['complexity']} ({target['software_experience']}/{target['hardware_experience']}) {chapter_path}"
+                    rendered = await asyncio.to_thread(personalization_service.prerender, content, target, chapter_path, db)
+                    detail = "rendered" if rendered else "already cached"
+            except Exception as e:
+                print(f"✗ {key}: {e}")
+                failed.append(key)
+                return
+            finally:
+                db.close()
+
+            async with state_lock:
+                with args.state_file.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "finished_at": time.time()}) + "\n")
+            print(f"✓ {label}: {detail} ({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(render(*variant) for variant in pending))
+    elapsed = time.perf_counter() - started
+
+    print("-" * 60)
+    print(f"✓ Pre-rendered {len(pending) - len(failed)}/{len(pending)} variants in {elapsed:.1f}s")
+    if failed:
+        print(f"✗ {len(failed)} variants failed; run again to retry them")
+        return 1
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pre-render translated and personalized chapter variants")
+    parser.add_argument("--docs-dir", type=Path, default=DOCS_DIR)
+    parser.add_argument("--languages", nargs="+", default=["ur"], help="Target languages to translate into")
+    parser.add_argument("--experience-grid", action="store_true",
+                        help="Render every software x hardware experience pair, not just one profile per tier")
+    parser.add_argument("--skip-personalization", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=4, help="Variants rendered at once")
+    parser.add_argument("--rpm", type=float, default=60, help="LLM requests per minute across all variants")
+    parser.add_argument("--state-file", type=Path, default=Path("prerender_state.jsonl"),
+                        help="Finished variants, for resuming")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the state file and start over")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(prerender(parse_args())))
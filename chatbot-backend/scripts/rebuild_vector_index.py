@@ -0,0 +1,80 @@
+"""
+Script to rebuild the vector index from the document_chunks table.
+Run this after recreating or migrating the Qdrant collection, or after
+switching VECTOR_BACKEND.
+
+Vectors are read from the document embedding store, so chunks embedded
+before (by any source or run) cost no embedding API calls; only chunks
+missing from the store are embedded.
+
+Usage:
+    python scripts/rebuild_vector_index.py [--batch-size 256]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Load environment variables before the app reads its settings
+load_dotenv()
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.models.database import SessionLocal, DocumentChunk  # noqa: E402
+from app.services.embedding_cache import document_embedding_store  # noqa: E402
+from app.services.vector_store import get_vector_store  # noqa: E402
+
+
+def rebuild(batch_size: int) -> int:
+    """Re-upsert every stored chunk into the configured vector index"""
+    if not document_embedding_store.persistent:
+        print("Warning: DOCUMENT_EMBEDDING_STORE_PATH is not set, every chunk will be re-embedded")
+
+    vector_store = get_vector_store()
+    db = SessionLocal()
+    started = time.perf_counter()
+    misses_before = document_embedding_store.misses
+    total = 0
+
+    try:
+        query = db.query(DocumentChunk).order_by(DocumentChunk.id).yield_per(batch_size)
+        batch = []
+        for row in query:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                total += upsert_batch(vector_store, batch)
+                batch = []
+        if batch:
+            total += upsert_batch(vector_store, batch)
+        vector_store.index.flush()
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    embedded = document_embedding_store.misses - misses_before
+    print("-" * 60)
+    print(f"✓ Rebuilt vector index: {total} chunks in {elapsed:.2f}s")
+    print(f"  Reused {total - embedded} stored embeddings, embedded {embedded} chunks")
+    return 0
+
+
+def upsert_batch(vector_store, rows: list) -> int:
+    vector_store.add_documents(
+        [row.content for row in rows],
+        [row.doc_metadata or {"source": row.source} for row in rows],
+        chunk_ids=[row.chunk_id for row in rows]
+    )
+    print(f"✓ Upserted {len(rows)} chunks")
+    return len(rows)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Rebuild the vector index from stored chunks")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks read and upserted at once")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(rebuild(args.batch_size))
@@ -0,0 +1,34 @@
+"""
+Test settings: local embeddings, in-memory vector index and database, no
+API keys or network. Set before any app module reads its settings.
+"""
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("DEMO_MODE", "true")
+os.environ.setdefault("EMBEDDING_PROVIDER", "local")
+os.environ.setdefault("VECTOR_BACKEND", "memory")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("DOCUMENT_EMBEDDING_STORE_PATH", "")
+os.environ.setdefault("CONTENT_CACHE_EVICTION_INTERVAL_SECONDS", "0")
+os.environ.setdefault("CHUNKING_WORKERS", "1")
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """A session on a fresh in-memory database"""
+    from app.models import auth  # noqa: F401  (registers the tables)
+    from app.models.database import Base, SessionLocal, engine, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+import hashlib
+
+from app.config import settings
+from app.models.auth import SharedPersonalizedContent, TranslationCache
+from app.services.cache_lifecycle import ContentCacheLifecycle
+from app.services.translation import translation_service
+
+LONG_AGO = datetime.utcnow() - timedelta(days=2)
+
+
+def personalized(chapter_path: str, content: str, created_at: datetime = LONG_AGO) -> SharedPersonalizedContent:
+    return SharedPersonalizedContent(
+        profile_fingerprint=f"{chapter_path}:{content}", profile={}, chapter_path=chapter_path,
+        original_content_hash=hashlib.md5(content.encode()).hexdigest(), personalized_content="...",
+        complexity_level="beginner", created_at=created_at
+    )
+
+
+def test_personalized_rows_for_older_chapter_versions_are_purged(db):
+    ContentCacheLifecycle().record_chapter(db, "/docs/intro", "v1")
+    db.add_all([
+        personalized("/docs/intro", "v1"),
+        personalized("/docs/setup", "v1"),  # No recorded version: left alone
+    ])
+    db.commit()
+    ContentCacheLifecycle().run_once()
+    assert db.query(SharedPersonalizedContent).count() == 2
+
+    # A new process (or another worker) sees the edited chapter
+    ContentCacheLifecycle().record_chapter(db, "/docs/intro", "v2")
+    db.add_all([
+        personalized("/docs/intro", "v2"),
+        personalized("/docs/intro", "v1, still read", created_at=datetime.utcnow()),
+    ])
+    db.commit()
+    lifecycle = ContentCacheLifecycle()
+    lifecycle.run_once()
+    db.expire_all()
+    assert {row.profile_fingerprint for row in db.query(SharedPersonalizedContent)} == {
+        "/docs/setup:v1", "/docs/intro:v2", "/docs/intro:v1, still read"
+    }
+    assert lifecycle.tables["shared_personalized_content"]["purged_stale"] == 1
+
+
+def test_translations_no_current_chapter_contains_are_purged(db):
+    v1, v2 = "# A\n\nAlpha.\n\n# B\n\nBeta.\n", "# A\n\nAlpha.\n\n# B\n\nBeta, revised.\n"
+    _, v1_sections = translation_service._split(v1)
+    ContentCacheLifecycle().record_chapter(db, "/docs/intro", v1)
+    ContentCacheLifecycle().record_chapter(db, "/docs/other", "# A\n\nAlpha.\n")
+    db.add_all([
+        TranslationCache(
+            source_content_hash=section_hash, target_language="ur", translated_content=text,
+            chapter_path="/docs/intro", created_at=LONG_AGO
+        )
+        for section_hash, text in v1_sections.items()
+    ] + [
+        TranslationCache(source_content_hash="no-chapter", target_language="ur", translated_content="x", created_at=LONG_AGO)
+    ])
+    db.commit()
+
+    ContentCacheLifecycle().record_chapter(db, "/docs/intro", v2)
+    ContentCacheLifecycle().run_once()
+    db.expire_all()
+    # "# B Beta." is gone; "# A Alpha." is in both chapters' current versions
+    assert {row.translated_content for row in db.query(TranslationCache)} == {"# A\n\nAlpha.", "x"}
+    translation_service.memory_cache.clear()
+
+
+def test_evicted_translations_leave_the_in_process_tier(db, monkeypatch):
+    monkeypatch.setattr(settings, "translation_cache_max_rows", 1)
+    translation_service.memory_cache.clear()
+    db.add_all([
+        TranslationCache(source_content_hash="old", target_language="ur", translated_content="a", created_at=LONG_AGO),
+        TranslationCache(source_content_hash="new", target_language="ur", translated_content="b"),
+    ])
+    db.commit()
+    for content_hash in ("old", "new"):
+        translation_service.memory_cache.put((content_hash, "en", "ur"), content_hash)
+    translation_service.memory_cache.put(("document", "doc", "en", "ur"), {"section_hashes": ["old"]})
+
+    ContentCacheLifecycle().run_once()
+    assert translation_service.memory_cache.get(("old", "en", "ur")) is None
+    assert translation_service.memory_cache.get(("document", "doc", "en", "ur")) is None
+    assert translation_service.memory_cache.get(("new", "en", "ur")) == "new"
+    translation_service.memory_cache.clear()
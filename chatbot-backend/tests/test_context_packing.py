@@ -0,0 +1,66 @@
+from app.services.context_packer import ContextPacker
+from app.services.lexical_index import reciprocal_rank_fusion
+
+
+def hit(source: str, score: float = 1.0, chunk_index: int = 0) -> dict:
+    return {"text": f"Text of {source}.", "score": score, "metadata": {"source": source, "chunk_index": chunk_index}}
+
+
+def test_rrf_ranks_hits_found_by_both_retrievers_first():
+    fused = reciprocal_rank_fusion([[hit("a"), hit("b")], [hit("c"), hit("a")]], k=60)
+    assert [c["metadata"]["source"] for c in fused] == ["a", "c", "b"]
+    assert fused[0]["score"] == 1 / 61 + 1 / 62
+
+
+def test_fused_hits_from_one_retriever_survive_packing():
+    vector = [hit("a"), hit("b"), hit("c")]
+    lexical = [hit("a"), hit("d"), hit("e")]
+    fused = reciprocal_rank_fusion([vector, lexical], k=60, top_k=5)
+
+    packed = ContextPacker(token_budget=1000, min_relative_score=0.5).pack(fused)
+
+    assert {c["metadata"]["source"] for c in packed} == {"a", "b", "c", "d", "e"}
+    assert packed[0]["metadata"]["source"] == "a"
+
+
+def test_relative_cutoff_drops_weak_vector_hits():
+    packed = ContextPacker(token_budget=1000, min_relative_score=0.5).pack(
+        [hit("a", 0.9), hit("b", 0.5), hit("c", 0.3)]
+    )
+    assert [c["metadata"]["source"] for c in packed] == ["a", "b"]
+
+
+def test_budget_is_filled_greedily_in_score_order():
+    packer = ContextPacker(min_relative_score=0)
+    long_hit = {**hit("long", 0.8), "text": "word " * 50}
+    hits = [hit("a", 0.9), long_hit, hit("b", 0.7)]
+    packer.token_budget = packer.count_tokens(hits[0]["text"]) + packer.count_tokens(hits[2]["text"])
+
+    assert [c["metadata"]["source"] for c in packer.pack(hits)] == ["a", "b"]
+
+
+def test_a_top_hit_over_budget_is_truncated_rather_than_dropped():
+    packer = ContextPacker(token_budget=10)
+    packed = packer.pack([{**hit("a"), "text": "word " * 50}])
+    assert len(packed) == 1
+    assert packer.count_tokens(packed[0]["text"]) == 10
+
+
+def test_consecutive_chunks_merge_without_repeating_their_overlap():
+    overlap = "The controller reads every sensor at a fixed rate of one kilohertz and then"
+    first = {**hit("a", 0.6, chunk_index=0), "text": f"Sensors publish readings. {overlap}"}
+    second = {**hit("a", 0.9, chunk_index=1), "text": f"{overlap} drives the motors."}
+    apart = hit("a", 0.5, chunk_index=5)
+
+    merged = ContextPacker().merge_adjacent([second, apart, first])
+    assert len(merged) == 2
+    assert merged[0]["text"] == f"Sensors publish readings. {overlap} drives the motors."
+    assert merged[0]["score"] == 0.9
+    assert merged[0]["metadata"]["merged_chunks"] == 2
+
+
+def test_history_keeps_the_most_recent_turns_that_fit():
+    packer = ContextPacker()
+    turns = [{"user": f"question {i}", "assistant": f"answer {i}"} for i in range(5)]
+    packer.history_token_budget = 2 * (packer.count_tokens("question 0") + packer.count_tokens("answer 0"))
+    assert packer.pack_history(turns) == turns[-2:]
@@ -0,0 +1,65 @@
+from app.services.document_processor import DocumentProcessor
+from app.services import tokenizer
+
+PARAGRAPHS = [f"Paragraph {i} describes joint {i % 7} of the arm, and how its encoder reports angles." for i in range(300)]
+TEXT = "\n\n".join(PARAGRAPHS)
+
+
+def processor() -> DocumentProcessor:
+    return DocumentProcessor(chunk_size=200, chunk_overlap=40)
+
+
+def test_chunks_are_cut_between_paragraphs_and_fit_the_budget():
+    chunker = processor()
+    chunks = chunker.chunk_text(TEXT)
+    assert len(chunks) > 10
+    assert all(chunker.count_tokens(chunk) <= chunker.chunk_size for chunk in chunks)
+    # Only the overlap that opens a chunk may be part of a paragraph
+    assert all(paragraph in PARAGRAPHS for chunk in chunks for paragraph in chunk.split("\n\n")[1:])
+
+
+def test_consecutive_chunks_overlap():
+    chunks = processor().chunk_text(TEXT)
+    for first, second in zip(chunks, chunks[1:]):
+        assert second.split("\n\n")[0] in first
+
+
+def test_an_edit_only_changes_the_chunks_around_it():
+    chunker = processor()
+    before = chunker.chunk_text(TEXT)
+    after = chunker.chunk_text(TEXT.replace("Paragraph 150 describes", "Paragraph 150 briefly describes"))
+    assert len(set(after) - set(before)) <= 2
+
+
+def test_a_paragraph_over_the_budget_is_split():
+    chunker = processor()
+    chunks = chunker.chunk_text("word " * 1000)
+    assert len(chunks) > 1
+    assert all(chunker.count_tokens(chunk) <= chunker.chunk_size for chunk in chunks)
+
+
+def test_streamed_text_is_chunked_like_the_whole_text():
+    chunker = processor()
+    streaming = chunker.streaming_chunker()
+    streamed = []
+    for start in range(0, len(TEXT), 97):
+        streamed += streaming.feed(TEXT[start:start + 97])
+    streamed += streaming.finish()
+
+    assert [chunk for chunk, _ in streamed] == chunker.chunk_text(TEXT)
+    assert all(count == chunker.count_tokens(chunk) for chunk, count in streamed)
+
+
+def test_local_embeddings_fall_back_to_byte_tokens_offline(monkeypatch):
+    def offline(name):
+        raise ConnectionError("no network")
+
+    monkeypatch.setattr(tokenizer.tiktoken, "get_encoding", offline)
+    tokenizer.get_encoding.cache_clear()
+    try:
+        chunker = processor()
+        assert isinstance(chunker.encoding, tokenizer.ByteEncoding)
+        assert chunker.count_tokens("ünï") == len("ünï".encode())
+        assert all(chunker.count_tokens(chunk) <= chunker.chunk_size for chunk in chunker.chunk_text(TEXT))
+    finally:
+        tokenizer.get_encoding.cache_clear()
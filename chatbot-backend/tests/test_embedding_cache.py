@@ -0,0 +1,34 @@
+from app.services.embedding_cache import EmbeddingCache
+
+
+def test_query_cache_shares_entries_across_whitespace():
+    cache = EmbeddingCache(max_entries=10)
+    cache.put("m", "what  is\nROS?", [1.0, 2.0])
+    assert cache.get("m", "what is ROS?") == [1.0, 2.0]
+
+
+def test_document_store_keys_on_exact_text(tmp_path):
+    store = EmbeddingCache(max_entries=0, path=str(tmp_path / "docs.sqlite3"), normalize=False)
+    store.put("m", "def f():\n    return 1", [1.0])
+    assert store.get("m", "def f():\n    return 1") == [1.0]
+    assert store.get("m", "def f(): return 1") is None
+
+
+def test_disk_only_store_has_no_memory_tier(tmp_path):
+    store = EmbeddingCache(max_entries=0, path=str(tmp_path / "docs.sqlite3"), normalize=False)
+    store.put_many("m", ["a", "b"], [[1.0], [2.0]])
+    assert store.get_many("m", ["a", "b", "c"]) == [[1.0], [2.0], None]
+
+    stats = store.stats()
+    assert stats["memory_size"] is None and stats["memory_evictions"] is None
+    assert stats["disk_entries"] == 2
+    assert stats["disk_hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_disk_tier_is_opened_on_first_use(tmp_path):
+    path = tmp_path / "docs.sqlite3"
+    store = EmbeddingCache(max_entries=0, path=str(path), normalize=False)
+    assert not path.exists()
+    assert store.get("m", "a") is None
+    assert path.exists() and store.persistent
@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.embeddings import OpenAIEmbeddingProvider
+
+
+def response(*vectors):
+    return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=v) for i, v in enumerate(vectors)])
+
+
+def test_openai_provider_requests_and_checks_the_configured_dimensions(monkeypatch):
+    provider = OpenAIEmbeddingProvider("text-embedding-3-small", 3, api_key="test")
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return response([0.1, 0.2, 0.3])
+
+    monkeypatch.setattr(provider.client.embeddings, "create", create)
+    assert provider.embed(["a"]) == [[0.1, 0.2, 0.3]]
+    assert calls[0]["dimensions"] == 3
+
+    legacy = OpenAIEmbeddingProvider("text-embedding-ada-002", 3, api_key="test")
+    monkeypatch.setattr(legacy.client.embeddings, "create", lambda **kwargs: response([0.1] * 1536))
+    with pytest.raises(ValueError, match="1536-dimensional"):
+        legacy.embed(["a"])
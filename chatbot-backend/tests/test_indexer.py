@@ -0,0 +1,96 @@
+import asyncio
+
+from app.services.document_processor import doc_processor
+from app.services.indexer import DocumentIndexer
+
+CONTENT = "# Robots\n\n" + "\n\n".join(f"Paragraph {i} explains how sensors feed the controller." for i in range(40))
+
+
+async def pieces(text: str, size: int = 100):
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+def index(db, content: str, source: str):
+    return asyncio.run(DocumentIndexer().index_document(db, content, source))
+
+
+def index_stream(db, content: str, source: str):
+    return asyncio.run(DocumentIndexer().index_stream(db, source, pieces(content)))
+
+
+def test_content_hash_covers_content_metadata_and_chunking(monkeypatch):
+    base = DocumentIndexer.content_hash(CONTENT, {"chapter": 1})
+    assert DocumentIndexer.content_hash(CONTENT, {"chapter": 1}) == base
+    assert DocumentIndexer.content_hash(CONTENT + ".", {"chapter": 1}) != base
+    assert DocumentIndexer.content_hash(CONTENT, {"chapter": 2}) != base
+    monkeypatch.setattr(doc_processor, "mode", "markdown")
+    assert DocumentIndexer.content_hash(CONTENT, {"chapter": 1}) != base
+
+
+def test_reindexing_unchanged_content_is_skipped(db):
+    first = index(db, CONTENT, "manifest.md")
+    assert not first.unchanged and first.chunks_embedded > 0
+
+    second = index(db, CONTENT, "manifest.md")
+    assert second.unchanged
+    assert second.chunks_embedded == 0
+
+
+def test_changed_content_only_embeds_new_chunks_and_drops_stale_ones(db, monkeypatch):
+    monkeypatch.setattr(doc_processor, "mode", "markdown")
+    first = index(db, CONTENT, "changed.md")
+    changed = CONTENT.replace("Paragraph 39", "Closing paragraph")
+    result = index(db, changed, "changed.md")
+    assert not result.unchanged
+    assert 0 < result.chunks_embedded < first.chunks_embedded
+    assert result.chunks_deleted == result.chunks_embedded
+
+
+def test_streamed_reindex_reports_unchanged_only_when_nothing_changed(db):
+    first = index_stream(db, CONTENT, "streamed.md")
+    assert not first.unchanged
+
+    assert index_stream(db, CONTENT, "streamed.md").unchanged
+    assert not index_stream(db, CONTENT + " More.", "streamed.md").unchanged
+
+
+def test_streamed_reindex_with_identical_chunks_but_new_content_is_not_unchanged(db):
+    index_stream(db, CONTENT, "whitespace.md")
+    result = index_stream(db, CONTENT + "\n\n\n", "whitespace.md")
+    assert result.chunks_embedded == result.chunks_deleted == 0
+    assert not result.unchanged
+
+
+def test_markdown_reindex_after_a_streamed_index_is_not_skipped(db, monkeypatch):
+    monkeypatch.setattr(doc_processor, "mode", "markdown")
+    index_stream(db, CONTENT, "mixed.md")
+    result = index(db, CONTENT, "mixed.md")
+    assert not result.unchanged
+    assert result.chunks_embedded > 0
+
+
+def test_a_small_edit_in_a_long_document_re_embeds_only_nearby_chunks(db):
+    long_document = "\n\n".join(
+        f"Paragraph {i} explains how sensors feed the controller in loop {i * 7}." for i in range(600)
+    )
+    first = index(db, long_document, "long.md")
+    assert first.chunks_embedded > 20
+
+    edited = index(db, long_document.replace("Paragraph 3 explains", "Paragraph 3 explain"), "long.md")
+    assert 1 <= edited.chunks_embedded <= 2
+    assert edited.chunks_deleted == edited.chunks_embedded
+
+
+def test_runs_for_one_source_are_serialized_and_leave_no_lock_behind(db):
+    indexer = DocumentIndexer()
+
+    async def run_twice():
+        return await asyncio.gather(
+            indexer.index_document(db, CONTENT, "locks.md"),
+            indexer.index_document(db, CONTENT, "locks.md"),
+        )
+
+    first, second = asyncio.run(run_twice())
+    assert first.chunks_embedded > 0 and second.unchanged
+    assert indexer._source_locks == {}
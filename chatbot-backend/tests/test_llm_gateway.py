@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.llm_gateway import LLMQueueTimeout, Priority, ProviderLimiter, TokenBucket, _Waiter
+
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+
+    bucket.refill(bucket.updated + 30)
+    assert bucket.level == pytest.approx(30)
+    bucket.refill(bucket.updated + 600)
+    assert bucket.level == 60
+    # Larger requests than the bucket holds wait for a full bucket
+    assert bucket.wait_time(1000) == 0
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(per_minute=0)
+    bucket.take(10 ** 6)
+    assert bucket.wait_time(10 ** 6) == 0
+
+
+def drained(requests_per_minute: float = 600, tokens_per_minute: float = 0) -> ProviderLimiter:
+    limiter = ProviderLimiter("test", requests_per_minute, tokens_per_minute)
+    limiter.requests.level = 0
+    limiter.tokens.level = 0
+    return limiter
+
+
+def enqueue(limiter: ProviderLimiter, callers) -> list:
+    """Queue callers as acquire() does; returns the names in the order they are granted"""
+    granted = []
+    for name, tokens, priority in callers:
+        limiter._enqueue(_Waiter(priority, next(limiter._seq), tokens, lambda name=name: granted.append(name)))
+    return granted
+
+
+def test_queued_callers_are_served_by_priority_then_arrival():
+    limiter = drained(requests_per_minute=6)
+    granted = enqueue(limiter, [
+        ("personalize", 1, Priority.PERSONALIZATION),
+        ("translate 1", 1, Priority.TRANSLATION),
+        ("chat", 1, Priority.CHAT),
+        ("translate 2", 1, Priority.TRANSLATION),
+    ])
+    assert granted == []
+
+    limiter.requests.level = 2
+    limiter._poll()
+    assert granted == ["chat", "translate 1"]
+    limiter.requests.level = 2
+    limiter._poll()
+    assert granted == ["chat", "translate 1", "translate 2", "personalize"]
+
+
+def test_a_large_request_is_not_overtaken_by_smaller_ones():
+    limiter = drained(requests_per_minute=0, tokens_per_minute=60)
+    granted = enqueue(limiter, [("large", 50, Priority.TRANSLATION), ("small", 1, Priority.TRANSLATION)])
+
+    limiter.tokens.level = 10
+    limiter._poll()
+    assert granted == []
+    limiter.tokens.level = 51
+    limiter._poll()
+    assert granted == ["large", "small"]
+
+
+def test_async_callers_wait_for_budget_to_refill():
+    limiter = drained(requests_per_minute=600)
+
+    async def run():
+        started = time.monotonic()
+        await asyncio.gather(*(limiter.acquire(1, Priority.CHAT) for _ in range(2)))
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.15
+    assert limiter.stats()["granted"] == 2
+
+
+def test_a_caller_without_budget_times_out_and_leaves_the_queue(monkeypatch):
+    monkeypatch.setattr(settings, "llm_queue_timeout_seconds", 0.05)
+    limiter = drained(requests_per_minute=1)
+
+    with pytest.raises(LLMQueueTimeout):
+        asyncio.run(limiter.acquire(1, Priority.CHAT))
+    with pytest.raises(LLMQueueTimeout):
+        limiter.acquire_sync(1, Priority.CHAT)
+
+    stats = limiter.stats()
+    assert stats["waiting"] == 0
+    assert stats["queue_timeouts"] == 2
+    assert stats["granted"] == 0
+
+
+def test_a_cancelled_caller_leaves_the_queue():
+    limiter = drained(requests_per_minute=1)
+
+    async def run():
+        task = asyncio.create_task(limiter.acquire(1, Priority.CHAT))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert limiter.stats()["waiting"] == 0
@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.config import settings
+from app.models.auth import SharedPersonalizedContent, User
+from app.services import personalization as personalization_module
+from app.services.llm_gateway import LLMGateway, LLMQueueTimeout
+from app.services.personalization import personalization_service
+
+
+def reader(db) -> User:
+    user = User(email="reader@example.com", username="reader", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def personalize(user, db) -> dict:
+    return asyncio.run(personalization_service.apersonalize_content("Content", user, "/docs/intro", db))
+
+
+def test_a_failed_rewrite_is_served_but_not_shared(db, monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", False)
+    user = reader(db)
+
+    async def queue_timeout(*args, **kwargs):
+        raise LLMQueueTimeout("no budget")
+
+    monkeypatch.setattr(personalization_module.llm_gateway, "achat", queue_timeout)
+    result = personalize(user, db)
+    assert result["personalized_content"] and not result["cached"]
+    assert db.query(SharedPersonalizedContent).count() == 0
+
+    async def rewritten(*args, **kwargs):
+        return "Rewritten"
+
+    monkeypatch.setattr(personalization_module.llm_gateway, "achat", rewritten)
+    assert personalize(user, db)["personalized_content"] == "Rewritten"
+    assert personalize(user, db)["cached"]
+
+
+def test_a_failed_sync_rewrite_is_not_shared(db, monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", False)
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("reset")
+
+    monkeypatch.setattr(personalization_module.llm_gateway, "chat", unavailable)
+    result = personalization_service.personalize_content("Content", reader(db), "/docs/intro", db)
+    assert not result["cached"]
+    assert db.query(SharedPersonalizedContent).count() == 0
+
+
+def test_a_rewrite_cut_off_at_max_tokens_is_not_shared(db, monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", False)
+    gateway = LLMGateway()
+    cut_off = SimpleNamespace(
+        choices=[SimpleNamespace(finish_reason="length", message=SimpleNamespace(content="Half a rewr"))], usage=None
+    )
+
+    async def acall(provider, priority, tokens, request):
+        return cut_off
+
+    monkeypatch.setattr(gateway, "_acall", acall)
+    monkeypatch.setattr(personalization_module, "llm_gateway", gateway)
+    result = personalize(reader(db), db)
+    assert result["personalized_content"] != "Half a rewr"
+    assert db.query(SharedPersonalizedContent).count() == 0
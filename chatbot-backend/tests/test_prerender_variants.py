@@ -0,0 +1,96 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+
+from app.api import content as content_api
+from app.config import settings
+from app.models.auth import User
+from app.models.auth_schemas import PersonalizeRequest, TranslateRequest
+from app.services import personalization as personalization_module
+from app.services import translation as translation_module
+from app.services.personalization import personalization_service
+from app.services.translation import translation_service
+
+spec = importlib.util.spec_from_file_location(
+    "prerender_variants", Path(__file__).parent.parent / "scripts" / "prerender_variants.py"
+)
+prerender_variants = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(prerender_variants)
+
+CHAPTER = """---
+id: example
+---
+
+import ChapterControls from '@site/src/components/ChapterControls/ChapterControls';
+
+export const Chapter = () => {
+  const originalMarkdown = `
+# Example
+
+Some text with \\`inline code\\` and a fence:
+
+\\`\\`\\`python
+print("hi")
+\\`\\`\\`
+  `;
+
+  return (
+    <ChapterControls
+      chapterPath="/docs/example"
+      originalContent={originalMarkdown}
+      onContentUpdate={() => {}}
+    />
+  );
+};
+"""
+SENT = '\n# Example\n\nSome text with `inline code` and a fence:\n\n```python\nprint("hi")\n```\n  '
+
+
+def test_variants_are_built_from_what_chapter_controls_send(tmp_path):
+    (tmp_path / "example.mdx").write_text(CHAPTER)
+    (tmp_path / "plain.md").write_text("# Plain chapter without controls")
+
+    assert prerender_variants.client_requests(tmp_path / "example.mdx") == [("/docs/example", SENT)]
+    assert prerender_variants.client_requests(tmp_path / "plain.md") == []
+
+
+def test_prerendered_variants_serve_the_matching_requests(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", False)
+    monkeypatch.setattr(settings, "translation_memory_enabled", False)
+    (tmp_path / "example.mdx").write_text(CHAPTER)
+    [(chapter_path, content)] = prerender_variants.client_requests(tmp_path / "example.mdx")
+
+    user = User(email="reader@example.com", username="reader", hashed_password="x",
+                software_experience="beginner", hardware_experience="beginner", content_complexity="auto")
+    db.add(user)
+    db.commit()
+
+    async def translated(*args, **kwargs):
+        return "Translated"
+
+    monkeypatch.setattr(personalization_module.llm_gateway, "chat", lambda *args, **kwargs: "Rewritten")
+    monkeypatch.setattr(translation_module.llm_gateway, "achat", translated)
+    [profile] = [p for p in prerender_variants.standard_profiles(grid=False) if p == personalization_service.profile(user)]
+    assert personalization_service.prerender(content, profile, chapter_path, db)
+    asyncio.run(translation_service.atranslate(content, target_language="ur", db=db))
+
+    # Requests must be served from the rows alone
+    async def unavailable(*args, **kwargs):
+        raise AssertionError("LLM called for a prerendered variant")
+
+    monkeypatch.setattr(personalization_module.llm_gateway, "achat", unavailable)
+    monkeypatch.setattr(translation_module.llm_gateway, "achat", unavailable)
+    translation_service.memory_cache.clear()
+
+    personalized = asyncio.run(content_api.personalize_content(
+        PersonalizeRequest(chapter_path="/docs/example", content=SENT, user_experience="beginner"),
+        current_user=user, db=db
+    ))
+    assert personalized.cached and personalized.personalized_content == "Rewritten"
+
+    translation = asyncio.run(content_api.translate_content(
+        TranslateRequest(content=SENT, target_language="ur", chapter_path="/docs/example"), db=db, current_user=None
+    ))
+    assert translation.cached
+    translation_service.memory_cache.clear()
@@ -0,0 +1,86 @@
+import asyncio
+
+from app.config import settings
+from app.services import rag_agent as rag_agent_module
+from app.services.rag_agent import rag_agent
+from app.services.semantic_cache import SemanticCache
+
+QUERY = [1.0, 0.0, 0.0]
+
+
+def new_cache() -> SemanticCache:
+    return SemanticCache(max_entries=4, ttl_seconds=60, threshold=0.9)
+
+
+def test_lookup_returns_answers_of_similar_queries():
+    cache = new_cache()
+    cache.store(QUERY, "answer", [])
+    assert cache.lookup([0.99, 0.05, 0.0]).response == "answer"
+    assert cache.lookup([0.0, 1.0, 0.0]) is None
+
+
+def test_answers_generated_before_a_clear_are_not_stored():
+    cache = new_cache()
+    generation = cache.generation
+    cache.clear()
+    cache.store(QUERY, "stale answer", [], generation=generation)
+    assert cache.lookup(QUERY) is None
+
+    cache.store(QUERY, "fresh answer", [], generation=cache.generation)
+    assert cache.lookup(QUERY).response == "fresh answer"
+
+
+def test_a_cache_without_room_stores_nothing():
+    cache = SemanticCache(max_entries=0, ttl_seconds=60, threshold=0.9)
+    cache.store(QUERY, "answer", [])
+    assert cache.lookup(QUERY) is None
+
+
+def test_demo_answers_are_not_cached(monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", True)
+    monkeypatch.setattr(settings, "semantic_cache_enabled", True)
+    cache = new_cache()
+    monkeypatch.setattr(rag_agent_module, "semantic_cache", cache)
+
+    async def embed(query):
+        return QUERY
+
+    async def retrieve(*args, **kwargs):
+        return []
+
+    monkeypatch.setattr(rag_agent, "_aembed_query", embed)
+    monkeypatch.setattr(rag_agent, "aretrieve_context", retrieve)
+    asyncio.run(rag_agent._achat("What is ROS?"))
+    assert cache.lookup(QUERY) is None
+
+
+def collect_stream(monkeypatch, provider_stream) -> tuple:
+    monkeypatch.setattr(settings, "demo_mode", False)
+    monkeypatch.setattr(rag_agent, "ai_provider", "openai")
+    monkeypatch.setattr(rag_agent_module.llm_gateway, "achat_stream", lambda *args, **kwargs: provider_stream())
+    completed = []
+
+    async def run():
+        return [token async for token in rag_agent.astream_response("q", [], on_complete=completed.append)]
+
+    return asyncio.run(run()), completed
+
+
+def test_a_stream_that_finishes_is_reported_complete(monkeypatch):
+    async def provider_stream():
+        yield "Hello "
+        yield "world"
+
+    tokens, completed = collect_stream(monkeypatch, provider_stream)
+    assert tokens == ["Hello ", "world"]
+    assert completed == ["Hello world"]
+
+
+def test_a_stream_cut_off_by_an_error_is_not_reported_complete(monkeypatch):
+    async def provider_stream():
+        yield "Hello "
+        raise ConnectionError("reset")
+
+    tokens, completed = collect_stream(monkeypatch, provider_stream)
+    assert tokens == ["Hello "]
+    assert completed == []
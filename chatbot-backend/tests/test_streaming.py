@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import settings
+from app.models.auth import User
+from app.services import personalization as personalization_module
+from app.services import translation as translation_module
+from app.services.llm_gateway import LLMGateway, LLMOutputTruncated, Priority
+from app.services.personalization import personalization_service
+from app.services.translation import translation_service
+
+
+def chunk(text=None, finish_reason=None):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=finish_reason)])
+
+
+def gateway_stream(monkeypatch, chunks, **kwargs):
+    gateway = LLMGateway()
+
+    async def provider_stream():
+        for item in chunks:
+            yield item
+
+    async def acall(provider, priority, tokens, request):
+        return provider_stream()
+
+    monkeypatch.setattr(gateway, "_acall", acall)
+
+    async def run():
+        return [text async for text in gateway.achat_stream(
+            [{"role": "user", "content": "hi"}], Priority.CHAT, max_tokens=5, temperature=0, **kwargs
+        )]
+
+    return asyncio.run(run())
+
+
+def test_a_reply_cut_off_at_max_tokens_raises_only_when_asked(monkeypatch):
+    chunks = [chunk("Hello"), chunk(" wor"), chunk(finish_reason="length")]
+    assert gateway_stream(monkeypatch, chunks) == ["Hello", " wor"]
+    with pytest.raises(LLMOutputTruncated):
+        gateway_stream(monkeypatch, chunks, raise_on_length=True)
+
+    finished = [chunk("Hello"), chunk(finish_reason="stop")]
+    assert gateway_stream(monkeypatch, finished, raise_on_length=True) == ["Hello"]
+
+
+def events(stream) -> list:
+    async def run():
+        return [event async for event in stream]
+
+    return asyncio.run(run())
+
+
+def failing_after(*pieces, error=LLMOutputTruncated("Reply reached max_tokens=5")):
+    async def provider_stream(*args, **kwargs):
+        for piece in pieces:
+            yield piece
+        raise error
+
+    return provider_stream
+
+
+def test_a_translation_section_cut_off_midway_is_flagged(db, monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", False)
+    monkeypatch.setattr(settings, "translation_memory_enabled", False)
+    monkeypatch.setattr(translation_module.llm_gateway, "achat_stream", failing_after("Partial ", "text"))
+
+    result = events(translation_service.atranslate_stream("# Title\n\nA section about robots.", db=db))
+    assert [event["type"] for event in result][-2:] == ["error", "done"]
+    assert result[-2]["truncated"]
+    assert result[-1]["truncated"] and result[-1]["sections_failed"] == 1
+
+
+def test_a_translation_that_completes_is_not_flagged(db, monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", False)
+    monkeypatch.setattr(settings, "translation_memory_enabled", False)
+
+    async def provider_stream(*args, **kwargs):
+        yield "Complete"
+
+    monkeypatch.setattr(translation_module.llm_gateway, "achat_stream", provider_stream)
+    result = events(translation_service.atranslate_stream("# Heading\n\nAnother section.", db=db))
+    assert "error" not in [event["type"] for event in result]
+    assert result[-1]["truncated"] is False and result[-1]["sections_failed"] == 0
+
+
+def test_a_personalization_cut_off_midway_is_flagged_and_not_cached(db, monkeypatch):
+    monkeypatch.setattr(settings, "demo_mode", False)
+    monkeypatch.setattr(personalization_module.llm_gateway, "achat_stream", failing_after("Partial", error=ConnectionError("reset")))
+    user = User(email="reader@example.com", username="reader", hashed_password="x")
+    db.add(user)
+    db.commit()
+
+    result = events(personalization_service.apersonalize_stream("Content", user, "intro.md", db))
+    assert [event["type"] for event in result] == ["token", "error", "done"]
+    assert result[-1]["truncated"] and not result[-1]["cached"]
+
+    result = events(personalization_service.apersonalize_stream("Content", user, "intro.md", db))
+    assert not result[-1]["cached"]
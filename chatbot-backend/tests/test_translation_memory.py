@@ -0,0 +1,88 @@
+import pytest
+
+from app.models.auth import TranslationMemoryEntry
+from app.services.translation_memory import Segment, TranslationMemory, segment_markdown
+
+ENABLED = "This option is enabled by default in the development configuration of the server."
+DISABLED = "This option is disabled by default in the development configuration of the server."
+
+
+def lookup(memory: TranslationMemory, db, *segments: str) -> dict:
+    return memory.lookup(db, list(segments), "en", "ur")
+
+
+def test_segmentation_is_lossless_and_skips_code():
+    text = "# Setup\n\nInstall it first. Then run it.\n\n```bash\npip install x\n```\n| a | b |\n"
+    parts = segment_markdown(text)
+    assert "".join(parts) == text
+    segments = [part for part in parts if isinstance(part, Segment)]
+    assert segments == ["Setup", "Install it first.", "Then run it.", "a", "b"]
+
+
+def test_exact_tier_ignores_whitespace(db):
+    memory = TranslationMemory()
+    memory.store(db, {"Install it first.": "T1"}, "en", "ur")
+    assert lookup(memory, db, "Install  it first.") == {"Install  it first.": "T1"}
+
+
+def test_normalized_tier_ignores_case_and_punctuation(db):
+    memory = TranslationMemory()
+    memory.store(db, {"Install it first.": "T1"}, "en", "ur")
+    assert lookup(memory, db, "install, it first") == {"install, it first": "T1"}
+
+
+@pytest.mark.parametrize("segment", ["It is enabled?", "It is enabled!"])
+def test_questions_and_exclamations_are_not_statements(db, segment):
+    memory = TranslationMemory(fuzzy_threshold=0.8)
+    memory.store(db, {"It is enabled.": "T1"}, "en", "ur")
+    assert lookup(memory, db, segment) == {}
+
+
+@pytest.mark.parametrize("segment", ["Run `make` first.", "Run **make** first.", "Run make 2 times."])
+def test_normalized_tier_requires_the_same_code_markup_and_numbers(db, segment):
+    memory = TranslationMemory()
+    memory.store(db, {"Run make first.": "T1", "Run make 3 times.": "T2"}, "en", "ur")
+    assert lookup(memory, db, segment) == {}
+
+
+def test_fuzzy_reuse_is_off_by_default(db):
+    memory = TranslationMemory()
+    memory.store(db, {ENABLED: "T-enabled"}, "en", "ur")
+    assert lookup(memory, db, DISABLED) == {}
+
+
+def test_fuzzy_tier_reuses_near_matches_when_enabled(db):
+    memory = TranslationMemory(fuzzy_threshold=0.9)
+    memory.store(db, {ENABLED: "T-enabled"}, "en", "ur")
+    near = ENABLED.replace("the server", "that server")
+    assert lookup(memory, db, near) == {near: "T-enabled"}
+    # Numbers must match exactly
+    assert lookup(memory, db, ENABLED.replace("the server", "server 2")) == {}
+
+
+def test_fuzzy_index_sees_segments_stored_after_it_was_built(db):
+    memory = TranslationMemory(fuzzy_threshold=0.9)
+    assert lookup(memory, db, ENABLED) == {}
+    memory.store(db, {ENABLED: "T-enabled"}, "en", "ur")
+    near = ENABLED.replace("the server", "that server")
+    assert lookup(memory, db, near) == {near: "T-enabled"}
+
+
+def test_storing_a_segment_twice_keeps_one_row(db):
+    memory = TranslationMemory()
+    memory.store(db, {"Install it first.": "T1"}, "en", "ur")
+    memory.store(db, {"Install it first.": "T2", "Install  it first.": "T3"}, "en", "ur")
+    rows = db.query(TranslationMemoryEntry.target_text).all()
+    assert len(rows) == 1
+    assert lookup(memory, db, "Install it first.") == {"Install it first.": "T3"}
+
+
+def test_fuzzy_index_replaces_a_segment_stored_again(db):
+    memory = TranslationMemory(fuzzy_threshold=0.9)
+    assert lookup(memory, db, ENABLED) == {}
+    memory.store(db, {ENABLED: "T1"}, "en", "ur")
+    memory.store(db, {ENABLED: "T2"}, "en", "ur")
+    index = memory._fuzzy[("en", "ur")]
+    assert len(index._entries) == 1
+    near = ENABLED.replace("the server", "that server")
+    assert lookup(memory, db, near) == {near: "T2"}
@@ -0,0 +1,38 @@
+import asyncio
+import os
+
+from app.services.vector_index import NumpyVectorIndex
+
+
+def test_writes_are_saved_on_flush_only(tmp_path):
+    path = str(tmp_path / "index")
+    index = NumpyVectorIndex(3, path)
+    index.upsert(["a", "b"], [[1, 0, 0], [0, 1, 0]], [{"text": "a"}, {"text": "b"}])
+    index.delete(["b"])
+    assert not os.path.exists(f"{path}.npy")
+
+    asyncio.run(index.aflush())
+    reloaded = NumpyVectorIndex(3, path)
+    assert len(reloaded) == 1
+    assert reloaded.search([1, 0, 0], top_k=1)[0].id == "a"
+
+
+def test_flush_skips_an_unchanged_index(tmp_path):
+    path = str(tmp_path / "index")
+    index = NumpyVectorIndex(3, path)
+    index.upsert(["a"], [[1, 0, 0]], [{}])
+    index.flush()
+    saved_at = os.stat(f"{path}.npy").st_mtime_ns
+    os.utime(f"{path}.npy", ns=(0, 0))
+    index.flush()
+    assert os.stat(f"{path}.npy").st_mtime_ns == 0 != saved_at
+
+
+def test_missing_reports_ids_lost_before_a_flush(tmp_path):
+    path = str(tmp_path / "index")
+    index = NumpyVectorIndex(3, path)
+    index.upsert(["a"], [[1, 0, 0]], [{}])
+    index.flush()
+    index.upsert(["b"], [[0, 1, 0]], [{}])  # Never flushed: lost on restart
+
+    assert NumpyVectorIndex(3, path).missing(["a", "b"]) == {"b"}